@@ -3,14 +3,14 @@
 This script will analyze the inventory of pcloud.
 """
 
+import argparse
 import json
 import logging
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from lib import my_env
-from lib import pcloud_handler
+from lib import my_env, profiling
+from lib import merkle, pcloud_handler
+from lib.report import ReportWriter
+from lib.rollup import Rollup
 
 
 def item2key(pc_dict, path, contents):
@@ -35,67 +35,163 @@ def item2key(pc_dict, path, contents):
             )
     return
 
-cfg = my_env.init_env("pcloud", __file__)
-logging.info("Start application")
-pc_prev = {}
-pc_current = {}
-fp = os.getenv('DATADIR')
-inventory_files = [file for file in os.listdir(fp) if '.json' == file[-len('.json'):]]
-inventory_files.sort(reverse=True)
-[ffn_current, ffn_prev] = inventory_files[:2]
-# ffn = '/home/dirk/development/python/pcloud/data/pcloud20201227161239.json'
-with open(os.path.join(fp, ffn_current), 'r') as fh:
-    pc_contents = json.load(fh)
-pcloud_handler.item2key(pc_current, pc_contents['path'], pc_contents['contents'])
-# ffn = '/home/dirk/development/python/pcloud/data/pcloud20201227144214.json'
-with open(os.path.join(fp, ffn_prev), 'r') as fh:
-    pc_contents = json.load(fh)
-pcloud_handler.item2key(pc_prev, pc_contents['path'], pc_contents['contents'])
-new_items = []
-modified_items = []
-removed_items = []
-for k in pc_current:
-    if k in pc_prev:
-        if 'hash' in pc_current[k] and pc_current[k]['hash'] != pc_prev[k]['hash']: modified_items.append(k)
+
+def analyze(current=None, mail_rows=50, formats=('html',), rollup=100):
+    """
+    This function compares the most recent inventory with the previous inventory and mails the changes.
+
+    :param current: Tuple (filename, inventory) of the current inventory, as returned by
+    get_pcloud_inventory.collect_inventory. If None, the most recent inventory file is read.
+    :param mail_rows: Maximum number of rows per section in the mail.
+    :param formats: Report formats.
+    :param rollup: Rollup threshold, 0 to list every file.
+    :return:
+    """
+    fp = os.getenv('DATADIR')
+    inventory_files = my_env.get_inventory_files(fp)
+    with profiling.phase('load snapshot'):
+        if current:
+            ffn_current, pc_contents = current
+            # The previous inventory is the youngest file that is not the current one.
+            ffn_prev = [file for file in inventory_files if file != os.path.basename(ffn_current)][0]
+        else:
+            [ffn_current, ffn_prev] = inventory_files[:2]
+            with open(os.path.join(fp, ffn_current), 'r') as fh:
+                pc_contents = json.load(fh)
+        with open(os.path.join(fp, ffn_prev), 'r') as fh:
+            pc_prev_contents = json.load(fh)
+    with profiling.phase('diff'):
+        # Only folders with a different subtree digest are compared, pc_current and pc_prev have the changed items.
+        new_items, modified_items, removed_items, pc_current, pc_prev = merkle.diff(pc_prev_contents, pc_contents)
+    ffn_report = os.path.join(fp, 'analyze_report.html')
+    with profiling.phase('report'):
+        report = write_report(ffn_report, new_items, modified_items, removed_items, pc_current, pc_prev,
+                              mail_rows=mail_rows, formats=formats, rollup=rollup)
+    with profiling.phase('mail'):
+        send_mail(report, len(new_items), len(modified_items), len(removed_items))
+    return
+
+
+def write_report(ffn_report, new_items, modified_items, removed_items, pc_current, pc_prev, mail_rows=50,
+                 formats=('html',), rollup=100):
+    """
+    This function writes the report with the new, modified and removed items.
+
+    :param ffn_report: Full filename of the html report.
+    :param new_items: Keys of the new items.
+    :param modified_items: Keys of the modified items.
+    :param removed_items: Keys of the removed items.
+    :param pc_current: Dictionary with the new and modified items (see item2key).
+    :param pc_prev: Dictionary with the removed items.
+    :param mail_rows: Maximum number of rows per section in the mail.
+    :param formats: Report formats.
+    :param rollup: Rollup threshold, 0 to list every file.
+    :return: Closed ReportWriter, for the mail.
+    """
+    report = ReportWriter(ffn_report, summary_rows=mail_rows, formats=formats)
+    if rollup:
+        # One line per folder tree with many changes, individual files elsewhere.
+        header = ['File or folder', 'Items', 'Bytes', 'Date']
+        for title, items, tree, field in [('New', new_items, pc_current, 'created'),
+                                          ('Modified', modified_items, pc_current, 'modified'),
+                                          ('Removed', removed_items, pc_prev, 'modified')]:
+            section_rollup = Rollup(items, tree, rollup)
+            report.section(title, header, count=len(items),
+                           rows=([k, cnt, size, '' if is_rollup else pcloud_handler.fmt_time(tree[k][field])]
+                                 for k, cnt, size, is_rollup in section_rollup.rows()))
     else:
-        new_items.append(k)
-for k in pc_prev:
-    if k not in pc_current: removed_items.append(k)
-report = f'<h3>New: {len(new_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Created</th></tr>'
-for k in new_items:
-    report += f'<tr><td>{k}</td><td>{pc_current[k]["created"][:-6]}</td></tr>'
-report += '</table>'
-report += f'<h3>Modified: {len(modified_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Modified</th></tr>'
-for k in modified_items:
-    report += f'<tr><td>{k}</td><td>{pc_current[k]["modified"][:-6]}</td></tr>'
-report += '</table>'
-report += f'<h3>Removed: {len(removed_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Modified</th></tr>'
-for k in removed_items:
-    report += f'<tr><td>{k}</td><td>{pc_prev[k]["modified"][:-6]}</td></tr>'
-report += '</table>'
-
-gmail_user = os.getenv('GMAIL_USER')
-gmail_pwd = os.getenv('GMAIL_PWD')
-recipient = os.getenv('RECIPIENT')
-
-msg = MIMEMultipart()
-msg["Subject"] = f"PCloud: {len(new_items)} New - {len(modified_items)} Modified - {len(removed_items)} Removed"
-msg["From"] = gmail_user
-msg["To"] = recipient
-
-msg.attach(MIMEText(report, 'html'))
-
-smtp_server = os.getenv('SMTP_SERVER')
-smtp_port = os.getenv('SMTP_PORT')
-server = smtplib.SMTP(smtp_server, smtp_port)
-server.starttls()
-server.login(gmail_user, gmail_pwd)
-text = msg.as_string()
-server.sendmail(gmail_user, recipient, text)
-logging.debug("Mail sent!")
-server.quit()
-
-logging.info("End application")
+        report.section('New', ['File', 'Created'], count=len(new_items),
+                       rows=([k, pcloud_handler.fmt_time(pc_current[k]['created'])] for k in new_items))
+        report.section('Modified', ['File', 'Modified'], count=len(modified_items),
+                       rows=([k, pcloud_handler.fmt_time(pc_current[k]['modified'])] for k in modified_items))
+        report.section('Removed', ['File', 'Modified'], count=len(removed_items),
+                       rows=([k, pcloud_handler.fmt_time(pc_prev[k]['modified'])] for k in removed_items))
+    report.close()
+    return report
+
+
+def send_mail(report, new_cnt, modified_cnt, removed_cnt):
+    """
+    This function mails the summary of the report. The full report is attached if the summary is not complete.
+    The mail modules are imported here, so the other commands do not need to load them.
+
+    :param report: ReportWriter object, closed.
+    :param new_cnt: Number of new items.
+    :param modified_cnt: Number of modified items.
+    :param removed_cnt: Number of removed items.
+    :return:
+    """
+    import smtplib
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    gmail_user = os.getenv('GMAIL_USER')
+    gmail_pwd = os.getenv('GMAIL_PWD')
+    recipient = os.getenv('RECIPIENT')
+
+    msg = MIMEMultipart()
+    msg["Subject"] = f"PCloud: {new_cnt} New - {modified_cnt} Modified - {removed_cnt} Removed"
+    msg["From"] = gmail_user
+    msg["To"] = recipient
+
+    msg.attach(MIMEText(report.summary_html(), 'html'))
+    if report.truncated():
+        # Summary is not complete, attach the full report.
+        zip_ffn = report.archive()
+        with open(zip_ffn, 'rb') as fh:
+            attachment = MIMEApplication(fh.read(), Name=os.path.basename(zip_ffn))
+        attachment['Content-Disposition'] = f'attachment; filename="{os.path.basename(zip_ffn)}"'
+        msg.attach(attachment)
+
+    smtp_server = os.getenv('SMTP_SERVER')
+    smtp_port = os.getenv('SMTP_PORT')
+    server = smtplib.SMTP(smtp_server, smtp_port)
+    server.starttls()
+    server.login(gmail_user, gmail_pwd)
+    text = msg.as_string()
+    server.sendmail(gmail_user, recipient, text)
+    logging.debug("Mail sent!")
+    server.quit()
+    return
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for analyze to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-m', '--mail_rows', type=int, required=False, default=50,
+                        help='Maximum number of rows per section in the mail. The full report is attached if '
+                             'there are more rows.')
+    parser.add_argument('-f', '--formats', type=str, nargs='+', required=False, default=['html'],
+                        choices=['html', 'csv', 'json'],
+                        help='Report formats. csv and json files are written next to the html report.')
+    parser.add_argument('-r', '--rollup', type=int, required=False, default=100,
+                        help='Report a folder tree on one line when it has at least this number of changes and the '
+                             'folder itself is new or removed. Files are listed individually in subtrees with less '
+                             'changes. Use 0 to list every file.')
+
+
+def main(args):
+    """
+    This function runs the analyze for the command line arguments.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Start application")
+    analyze(mail_rows=args.mail_rows, formats=args.formats, rollup=args.rollup)
+    logging.info("End application")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the two most recent PCloud inventories and mail the changes."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
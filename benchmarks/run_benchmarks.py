@@ -0,0 +1,416 @@
+"""
+This script runs the benchmark suite on synthetic inventories (see tools/synthetic.py): loading an inventory
+(item2key), path conversion (convert_fn), scanning a local target (get_local_contents), comparing inventories (digests
+and full comparison), writing the report and a download sync against the fake PCloud server (tools/fake_pcloud.py).
+Every benchmark reports the best time of the runs and the peak memory of a separate run with tracemalloc. The results
+are written to a json file, with --compare the results are compared with an earlier run (e.g. of another commit).
+Setup (creating inventories and local trees) is not part of the measurements.
+"""
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Project directory is the parent of the benchmarks directory.
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+from lib import merkle, pcloud_handler
+from tools.synthetic import make_snapshot, make_local_tree, mutate_snapshot, SIZE_DISTRIBUTIONS
+
+
+class Fixtures:
+    """
+    This class creates the inputs of the benchmarks once, when a benchmark needs them.
+    """
+
+    def __init__(self, args, tmpdir):
+        self.args = args
+        self.tmpdir = tmpdir
+        self.cache = {}
+
+    def get(self, name, func):
+        if name not in self.cache:
+            start = time.perf_counter()
+            self.cache[name] = func()
+            print(f"  setup {name}: {time.perf_counter() - start:.1f} s")
+        return self.cache[name]
+
+    def snapshot(self):
+        a = self.args
+        return self.get('snapshot', lambda: make_snapshot(a.files, a.fanout_files, a.fanout_folders,
+                                                          max_depth=a.depth, sizes=a.sizes))
+
+    def snapshot_pair(self):
+        """
+        Previous and current inventory with digests, as collect_inventory stores them.
+        """
+        def make_pair():
+            prev = self.snapshot()
+            current = mutate_snapshot(prev, self.args.changes)
+            merkle.add_digests(prev)
+            merkle.add_digests(current)
+            return prev, current
+        return self.get('snapshot_pair', make_pair)
+
+    def keys(self):
+        def make_keys():
+            tree = {}
+            snapshot = self.snapshot()
+            pcloud_handler.item2key(tree, snapshot['path'], snapshot['contents'])
+            return list(tree)
+        return self.get('keys', make_keys)
+
+    def local_tree(self):
+        """
+        Local target with the first local_files files of a separate inventory.
+        """
+        def make_local():
+            local_path = os.path.join(self.tmpdir, 'local')
+            snapshot = make_snapshot(self.args.local_files, self.args.fanout_files, self.args.fanout_folders,
+                                     max_depth=self.args.depth, sizes=self.args.sizes)
+            make_local_tree(snapshot, local_path)
+            return local_path
+        return self.get('local_tree', make_local)
+
+    def diff(self):
+        def make_diff():
+            prev, current = self.snapshot_pair()
+            return merkle.diff(prev, current)
+        return self.get('diff', make_diff)
+
+
+def bench_item2key(fx):
+    snapshot = fx.snapshot()
+
+    def run():
+        tree = {}
+        pcloud_handler.item2key(tree, snapshot['path'], snapshot['contents'])
+        return tree
+    return None, run, fx.args.files
+
+
+def bench_flatten(fx):
+    """
+    item2key for a sync: every item goes through convert_fn.
+    """
+    snapshot = fx.snapshot()
+
+    def run():
+        tree = {}
+        pcloud_handler.item2key(tree, snapshot['path'], snapshot['contents'], '/', '/data/target')
+        return tree
+    return None, run, fx.args.files
+
+
+def bench_logging(fx):
+    """
+    Log records from concurrent threads, as the download and upload workers do. The time includes writing the
+    queued records to the log file.
+    """
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    threads = 8
+    records = fx.args.log_records
+
+    def worker(nr):
+        for cnt in range(records // threads):
+            logging.info("Worker %s record %s", nr, cnt)
+
+    def run():
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(worker, range(threads)))
+        for handler in logging.root.handlers:
+            while getattr(handler, 'queue', None) is not None and not handler.queue.empty():
+                time.sleep(0.001)
+    return None, run, records
+
+
+def bench_convert_fn(fx):
+    keys = fx.keys()
+
+    def run():
+        for key in keys:
+            pcloud_handler.convert_fn(key, '/folder1', '/data/target')
+    return None, run, len(keys)
+
+
+def bench_get_local_contents(fx):
+    local_path = fx.local_tree()
+    return None, lambda: pcloud_handler.get_local_contents(local_path), fx.args.local_files
+
+
+def bench_add_digests(fx):
+    snapshot = fx.snapshot()
+    return None, lambda: merkle.add_digests(snapshot), fx.args.files
+
+
+def bench_diff_digests(fx):
+    prev, current = fx.snapshot_pair()
+    return None, lambda: merkle.diff(prev, current), fx.args.files
+
+
+def bench_diff_full(fx):
+    """
+    The comparison of the complete trees, as done before the digests.
+    """
+    prev, current = fx.snapshot_pair()
+
+    def run():
+        prev_tree = {}
+        current_tree = {}
+        pcloud_handler.item2key(prev_tree, prev['path'], prev['contents'])
+        pcloud_handler.item2key(current_tree, current['path'], current['contents'])
+        return pcloud_handler.compare_trees(current_tree, prev_tree)
+    return None, run, fx.args.files
+
+
+def bench_report(fx):
+    from analyze_pcloud_file import write_report
+    new_items, modified_items, removed_items, pc_current, pc_prev = fx.diff()
+    ffn = os.path.join(fx.tmpdir, 'report', 'analyze_report.html')
+    os.makedirs(os.path.dirname(ffn), exist_ok=True)
+
+    def run():
+        write_report(ffn, new_items, modified_items, removed_items, pc_current, pc_prev, formats=('html', 'csv'),
+                     rollup=0)
+    return None, run, len(new_items) + len(modified_items) + len(removed_items)
+
+
+def sync_setup(fx):
+    """
+    Start the fake PCloud server and set the environment for PcloudHandler. The server runs until the end of the
+    benchmarks.
+    """
+    def start():
+        from tools.fake_pcloud import FakePcloud
+        snapshot = make_snapshot(fx.args.sync_files, fx.args.fanout_files, fx.args.fanout_folders, sizes='lognormal',
+                                 max_size=fx.args.sync_max_size)
+        fake = FakePcloud(snapshot, latency=fx.args.latency, bandwidth=fx.args.bandwidth)
+        data_dir = os.path.join(fx.tmpdir, 'data')
+        os.makedirs(data_dir, exist_ok=True)
+        os.environ.update(PCHome=fake.start(), PCUser='bench', PCPwd='bench', DATADIR=data_dir)
+        return fake
+    return fx.get('fake_pcloud', start)
+
+
+def sync_download(target_dir):
+    """
+    Download sync of the complete fake account, as sync_dirs does it with action run.
+    """
+    from lib.journal import SyncJournal, journal_dir
+    from sync_dirs import plan_download, run_download
+    fp = os.getenv('DATADIR')
+    pc = pcloud_handler.get_handler()
+    pcloud_contents = pc.get_contents()
+    pcloud_tree = {}
+    pcloud_handler.item2key(pcloud_tree, pcloud_contents['path'], pcloud_contents['contents'], '/', target_dir)
+    local_tree = pcloud_handler.get_local_contents(target_dir)
+    new_items, modified_items, _ = pcloud_handler.compare_trees(pcloud_tree, local_tree)
+    meta, plan = plan_download(new_items + modified_items, pcloud_tree, local_tree)
+    meta.update(direction='download', source_dir='/', target_dir=target_dir)
+    journal = SyncJournal(journal_dir(fp, 'download', '/', target_dir))
+    journal.create(meta, plan)
+    run_download(pc, fp, journal, 'off')
+    journal.close()
+    return len(plan)
+
+
+def bench_sync_initial(fx):
+    sync_setup(fx)
+    target_dir = os.path.join(fx.tmpdir, 'sync_initial')
+
+    def setup():
+        import shutil
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+    return setup, lambda: sync_download(target_dir), fx.args.sync_files
+
+
+def bench_sync_nochange(fx):
+    sync_setup(fx)
+    target_dir = os.path.join(fx.tmpdir, 'sync_nochange')
+    os.makedirs(target_dir, exist_ok=True)
+    sync_download(target_dir)
+    return None, lambda: sync_download(target_dir), fx.args.sync_files
+
+
+BENCHMARKS = dict(
+    item2key=bench_item2key,
+    flatten=bench_flatten,
+    convert_fn=bench_convert_fn,
+    get_local_contents=bench_get_local_contents,
+    add_digests=bench_add_digests,
+    diff_digests=bench_diff_digests,
+    diff_full=bench_diff_full,
+    report=bench_report,
+    logging=bench_logging,
+    sync_initial=bench_sync_initial,
+    sync_nochange=bench_sync_nochange,
+)
+
+
+def measure(setup, run, repeat, memory):
+    """
+    This function measures a benchmark.
+
+    :param setup: Function to call before every run (not measured), or None.
+    :param run: Function to measure.
+    :param repeat: Number of timed runs, the best time is reported.
+    :param memory: If True, an additional run with tracemalloc measures the peak memory.
+    :return: Dictionary with seconds (best), mean seconds and peak memory in MB (or None).
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        if setup:
+            setup()
+        gc.collect()
+        tracemalloc.start()
+        run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return dict(seconds=min(times), mean_seconds=sum(times) / len(times), peak_mb=peak_mb)
+
+
+def git_commit():
+    try:
+        res = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return res.stdout.strip() or None
+
+
+def compare(results, ffn_prev, tolerance):
+    """
+    This function prints the results next to an earlier run.
+
+    :param results: Results of this run.
+    :param ffn_prev: Results file of the earlier run.
+    :param tolerance: Relative increase of time or memory that is reported as a regression.
+    :return: List of regressions.
+    """
+    with open(ffn_prev, 'r') as fh:
+        prev = json.load(fh)
+    print(f"\nCompared with {prev.get('commit')} ({prev.get('timestamp')})")
+    regressions = []
+    for name, res in results['benchmarks'].items():
+        prev_res = prev['benchmarks'].get(name)
+        if not prev_res:
+            continue
+        line = f"{name:<20}"
+        for field in ('seconds', 'peak_mb'):
+            if res[field] is None or not prev_res.get(field):
+                continue
+            ratio = res[field] / prev_res[field]
+            line += f" {field} {prev_res[field]:.3f} -> {res[field]:.3f} ({ratio:.2f}x)"
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} {field}")
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the benchmark suite on synthetic inventories and store the results as json."
+    )
+    parser.add_argument('-b', '--benchmarks', type=str, nargs='+', required=False, default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS),
+                        help='Benchmarks to run, default all.')
+    parser.add_argument('-n', '--files', type=int, required=False, default=1000000,
+                        help='Number of files in the synthetic inventory.')
+    parser.add_argument('--fanout_files', type=int, required=False, default=100,
+                        help='Number of files per folder.')
+    parser.add_argument('--fanout_folders', type=int, required=False, default=10,
+                        help='Number of subfolders per folder.')
+    parser.add_argument('--depth', type=int, required=False,
+                        help='Maximum folder depth, default no limit.')
+    parser.add_argument('--sizes', type=str, required=False, default='lognormal', choices=SIZE_DISTRIBUTIONS,
+                        help='File size distribution.')
+    parser.add_argument('--changes', type=float, required=False, default=0.01,
+                        help='Fraction of the files that is new, modified and removed in the next inventory.')
+    parser.add_argument('--local_files', type=int, required=False, default=100000,
+                        help='Number of files in the local target (sparse files).')
+    parser.add_argument('--sync_files', type=int, required=False, default=500,
+                        help='Number of files on the fake PCloud server for the sync benchmarks.')
+    parser.add_argument('--sync_max_size', type=int, required=False, default=1024 * 1024,
+                        help='Maximum file size for the sync benchmarks.')
+    parser.add_argument('--latency', type=float, required=False, default=0,
+                        help='Seconds of latency of the fake PCloud server for every API call.')
+    parser.add_argument('--bandwidth', type=int, required=False, default=0,
+                        help='Bandwidth of the fake PCloud server in bytes per second, 0 for no limit.')
+    parser.add_argument('--log_records', type=int, required=False, default=200000,
+                        help='Number of log records for the logging benchmark.')
+    parser.add_argument('-l', '--loglevel', type=str, required=False, default='info',
+                        help='Log level for the benchmarks, logging is set up as for the scripts (log file in a '
+                             'temporary directory). Use none for no log handlers.')
+    parser.add_argument('-r', '--repeat', type=int, required=False, default=3,
+                        help='Number of timed runs per benchmark.')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='Do not measure the peak memory (saves one run with tracemalloc per benchmark).')
+    parser.add_argument('-o', '--output', type=str, required=False,
+                        help='Results file, default benchmarks/results/<commit>.json.')
+    parser.add_argument('-c', '--compare', type=str, required=False,
+                        help='Results file of an earlier run to compare with.')
+    parser.add_argument('-t', '--tolerance', type=float, required=False, default=0.2,
+                        help='Relative increase in time or memory that is a regression (exit code 1).')
+    args = parser.parse_args()
+    commit = git_commit()
+    results = dict(commit=commit, timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                   python=platform.python_version(), machine=platform.node(),
+                   parameters={k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'benchmarks')},
+                   benchmarks={})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fx = Fixtures(args, tmpdir)
+        if args.loglevel != 'none':
+            from lib import my_env
+            os.environ.update(LOGDIR=tmpdir, LOGLEVEL=args.loglevel)
+            my_env.init_loghandler('benchmark')
+        for name in args.benchmarks:
+            print(f"{name}")
+            setup, run, items = BENCHMARKS[name](fx)
+            res = measure(setup, run, args.repeat, not args.no_memory)
+            res['items'] = items
+            res['us_per_item'] = res['seconds'] / items * 1e6 if items else None
+            results['benchmarks'][name] = res
+            peak = f"{res['peak_mb']:.1f} MB" if res['peak_mb'] is not None else '-'
+            print(f"  {res['seconds']:.3f} s, {items:,} items, peak {peak}")
+        if args.loglevel != 'none':
+            # Write the queued records before the log directory is removed.
+            my_env.stop_logging()
+        if 'fake_pcloud' in fx.cache:
+            fx.cache['fake_pcloud'].stop()
+            # The API metrics of the sync benchmarks are part of the results, the data directory is removed.
+            from lib.metrics import get_metrics
+            metrics = get_metrics()
+            results['api_calls'] = metrics.summary()['calls']
+            atexit.unregister(metrics.write)
+    ffn = args.output or os.path.join(PROJECT_DIR, 'benchmarks', 'results', f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(ffn)), exist_ok=True)
+    with open(ffn, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Results written to {ffn}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
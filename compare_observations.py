@@ -0,0 +1,76 @@
+#!/opt/envs/pcloud/bin/python3
+"""
+This script compares two observations in the sqlite inventory database. Every directory and file in the source
+directory of the source observation needs to be in the target directory of the target observation, files with the same
+size. Without arguments the two most recent inventories are compared, as a daily activity report.
+The issues are written to pcloud_issues.csv in the log directory while the comparison runs.
+"""
+
+import argparse
+import logging
+import os
+from lib import my_env, profiling
+from lib.sqlstore import SqlStore
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for compare to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-s', '--source_dir', type=str, required=False, default='/',
+                        help='Please provide the source directory.')
+    parser.add_argument('-i', '--source_obs_id', type=int, required=False,
+                        help='Please provide the observation id for the source. Default: most recent inventory.')
+    parser.add_argument('-t', '--target_dir', type=str, required=False, default='/',
+                        help='Please provide the target directory.')
+    parser.add_argument('-j', '--target_obs_id', type=int, required=False,
+                        help='Please provide the observation id for the target. Default: previous inventory.')
+    parser.add_argument('-n', '--no_new', action='store_true',
+                        help='Do not report items that are only in the target.')
+
+
+def main(args):
+    """
+    This function runs the comparison for the command line arguments.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Start application")
+    logging.info("Arguments: {a}".format(a=args))
+    store = SqlStore(os.getenv('DB'))
+    source_obs_id = args.source_obs_id
+    target_obs_id = args.target_obs_id
+    if source_obs_id is None or target_obs_id is None:
+        obs_res = store.observations()
+        if len(obs_res) < 2:
+            msg = "Less than two observations in the database, provide the observation IDs."
+            logging.critical(msg)
+            raise SystemExit(msg)
+        source_obs_id = obs_res[0]['id'] if source_obs_id is None else source_obs_id
+        target_obs_id = obs_res[1]['id'] if target_obs_id is None else target_obs_id
+    counts = {}
+    with open(os.path.join(os.getenv('LOGDIR'), "pcloud_issues.csv"), "w") as fh:
+        for issue, path in store.compare(source_obs_id, args.source_dir, target_obs_id, args.target_dir,
+                                         new=not args.no_new):
+            fh.write(f"{issue},{path}\n")
+            counts[issue] = counts.get(issue, 0) + 1
+    store.close()
+    if counts:
+        logging.info(f"Issues: {counts}")
+    else:
+        logging.info('No differences found.')
+    logging.info("End application")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare source and target directories in two observations."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
@@ -1,12 +1,16 @@
 #!/opt/envs/pcloud/bin/python3
 """
 This script collect pcloud data, compares with previous run and send a difference report.
+The steps run in this process by default: the inventory is handed to the analyze step in memory. With --subprocess
+every step runs as a separate script.
 """
 
 # Allow lib to library import path.
+import argparse
 import os
 import logging
-from lib import my_env
+import time
+from lib import my_env, profiling
 from lib.my_env import run_script
 
 scripts = [
@@ -14,10 +18,32 @@ scripts = [
     "analyze_pcloud_file"
 ]
 
+parser = argparse.ArgumentParser(
+    description="Collect the PCloud inventory and mail the changes since the previous inventory."
+)
+parser.add_argument('--subprocess', action='store_true',
+                    help='Run every step as a separate script.')
+profiling.add_argument(parser)
+args = parser.parse_args()
+profiler = profiling.Profiler(args.profile)
 cfg = my_env.init_env("pcloud", __file__)
 logging.info("Start Application")
 (fp, filename) = os.path.split(__file__)
-for script in scripts:
-    logging.info("Run script: {s}.py".format(s=script))
-    run_script(fp, "{s}.py".format(s=script))
+if args.subprocess:
+    for script in scripts:
+        logging.info("Run script: {s}.py".format(s=script))
+        start = time.perf_counter()
+        # The steps are profiled in their own process.
+        run_script(fp, "{s}.py".format(s=script), *(['--profile'] if args.profile else []))
+        logging.info("Script {s}.py done in {t:.1f} seconds".format(s=script, t=time.perf_counter() - start))
+else:
+    import analyze_pcloud_file
+    import get_pcloud_inventory
+    start = time.perf_counter()
+    current = get_pcloud_inventory.collect_inventory()
+    logging.info("Step inventory done in {t:.1f} seconds".format(t=time.perf_counter() - start))
+    start = time.perf_counter()
+    analyze_pcloud_file.analyze(current=current)
+    logging.info("Step analyze done in {t:.1f} seconds".format(t=time.perf_counter() - start))
+profiler.stop()
 logging.info("End Application")
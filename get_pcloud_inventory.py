@@ -1,23 +1,81 @@
 #!/opt/envs/pcloud/bin/python3
 """
 This script will collect the inventory of pcloud and keeps it in a json file.
+The collect_inventory function can be called from other scripts (daily_run), it returns the inventory so it does not
+need to be read from disk again.
 """
 
+import argparse
 import datetime
 import json
 import logging
 import os
-from lib import my_env
-from lib import pcloud_handler
-
-
-cfg = my_env.init_env("pcloud", __file__)
-logging.info("Start application")
-now = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-pc = pcloud_handler.PcloudHandler()
-res = pc.get_contents()
-ffn = os.path.join(os.getenv('DATADIR'), f'pcloud{now}.json')
-with open(ffn, 'w') as fh:
-    json.dump(res, fh)
-pc.logout()
-logging.info("End application")
+from lib import my_env, profiling
+from lib import merkle, pcloud_handler
+
+
+def collect_inventory(stores=('json',)):
+    """
+    This function collects the PCloud inventory and writes it to a json file in the data directory. With store sqlite
+    the inventory is added as an observation to the database in environment variable DB.
+
+    :param stores: Where to keep the inventory: json and / or sqlite.
+    :return: Tuple (filename of the inventory file, inventory)
+    """
+    now = datetime.datetime.now()
+    pc = pcloud_handler.get_handler()
+    with profiling.phase('list'):
+        res = pc.get_contents()
+    with profiling.phase('digests'):
+        # Folder digests let the analyze step skip unchanged folder trees.
+        merkle.add_digests(res)
+    ffn = os.path.join(os.getenv('DATADIR'), f"pcloud{now.strftime('%Y%m%d%H%M%S')}.json")
+    if 'json' in stores:
+        with profiling.phase('store json'):
+            with open(ffn, 'w') as fh:
+                json.dump(res, fh)
+            # Sorted path index for lookups without loading the inventory.
+            from lib.path_index import index_ffn, write_index
+            write_index(res, index_ffn(ffn))
+    if 'sqlite' in stores:
+        with profiling.phase('store sqlite'):
+            from lib.sqlstore import SqlStore
+            store = SqlStore(os.getenv('DB'))
+            store.ingest(res, now.strftime('%Y-%m-%d %H:%M:%S'))
+            store.close()
+    return ffn, res
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for inventory to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-s', '--stores', type=str, nargs='+', required=False, default=['json'],
+                        choices=['json', 'sqlite'],
+                        help='Keep the inventory in a json file in the data directory and / or in the sqlite '
+                             'database DB.')
+
+
+def main(args):
+    """
+    This function collects the inventory.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Start application")
+    collect_inventory(stores=args.stores)
+    logging.info("End application")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect the PCloud inventory in a json file."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
@@ -0,0 +1,163 @@
+"""
+This module keeps an on-disk journal of a sync run. The plan (the list of items to transfer) is written once when it
+is computed, the state of every item (pending, in-flight, done, failed) is appended to a state log while the sync is
+running. When a sync run is interrupted, the next run can resume from the journal, without loading the inventory,
+scanning the local target or comparing the trees again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+PENDING = 'pending'
+INFLIGHT = 'in-flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def journal_dir(fp, direction, source_dir, target_dir):
+    """
+    This function returns the journal directory for a sync pair, so that journals of different sync pairs do not
+    overwrite each other.
+
+    :param fp: Data directory.
+    :param direction: download or upload, or daemon for the sync daemon. The daemon has its own journal, so it never
+    replaces the journal of an interrupted sync_dirs run.
+    :param source_dir: PCloud directory.
+    :param target_dir: Local directory.
+    :return: Journal directory.
+    """
+    key = hashlib.sha1(f"{source_dir}|{target_dir}".encode('utf-8')).hexdigest()[:12]
+    return os.path.join(fp, 'journal', f"{direction}_{key}")
+
+
+class SyncJournal:
+    """
+    This class handles the sync journal. The plan is in plan.jsonl (a header line with the run information, then one
+    line per item), the state log in state.log has a line 'index state' for every state change.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the journal object. Use create for a new plan or load to resume a plan.
+
+        :param path: Journal directory.
+        """
+        self.path = path
+        self.plan_file = os.path.join(path, 'plan.jsonl')
+        self.state_file = os.path.join(path, 'state.log')
+        self.meta = {}
+        self.items = []
+        self.states = []
+        self.fh = None
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def exists(self):
+        """
+        Check if there is a journal in the journal directory.
+
+        :return: True if a plan is available.
+        """
+        return os.path.exists(self.plan_file)
+
+    def create(self, meta, items):
+        """
+        Write a new plan. An existing journal in the directory is replaced. All items start in state pending.
+
+        :param meta: Dictionary with run information, needed to resume the run.
+        :param items: List of plan items (json serializable dictionaries).
+        :return:
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        tmp = f"{self.plan_file}.tmp"
+        with open(tmp, 'w') as fh:
+            fh.write(json.dumps(meta) + '\n')
+            for item in items:
+                fh.write(json.dumps(item) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.plan_file)
+        self.meta = meta
+        self.items = items
+        self.states = [PENDING] * len(items)
+        self.fh = open(self.state_file, 'a')
+        logging.info(f"Sync journal with {len(items)} items created in {self.path}")
+
+    def load(self):
+        """
+        Read the plan and replay the state log.
+
+        :return:
+        """
+        with open(self.plan_file, 'r') as fh:
+            self.meta = json.loads(fh.readline())
+            self.items = [json.loads(line) for line in fh]
+        self.states = [PENDING] * len(self.items)
+        complete = True
+        try:
+            with open(self.state_file, 'r') as fh:
+                for line in fh:
+                    complete = line.endswith('\n')
+                    try:
+                        idx, state = line.split()
+                        if state not in (PENDING, INFLIGHT, DONE, FAILED):
+                            raise ValueError
+                        self.states[int(idx)] = state
+                    except (ValueError, IndexError):
+                        # Last line can be incomplete if the process was killed while writing.
+                        logging.warning(f"Incomplete line in state log: {line!r}")
+        except FileNotFoundError:
+            pass
+        self.fh = open(self.state_file, 'a')
+        if not complete:
+            self.fh.write('\n')
+        counts = {state: self.states.count(state) for state in (PENDING, INFLIGHT, DONE, FAILED)}
+        logging.info(f"Sync journal {self.path} loaded: {counts}")
+
+    def todo(self):
+        """
+        Return the indexes of the items that still need to be handled. Items that were in-flight when the run stopped
+        and failed items are handled again.
+
+        :return: List of item indexes.
+        """
+        return [idx for idx, state in enumerate(self.states) if state != DONE]
+
+    def mark(self, idx, state):
+        """
+        Record a state change. The log line is flushed immediately, so it survives when the process is killed. It is
+        synced to disk every 100 lines or every second.
+
+        :param idx: Item index.
+        :param state: New state.
+        :return:
+        """
+        self.states[idx] = state
+        self.fh.write(f"{idx} {state}\n")
+        self.fh.flush()
+        self.unsynced += 1
+        now = time.time()
+        if self.unsynced >= 100 or now - self.last_sync > 1:
+            os.fsync(self.fh.fileno())
+            self.unsynced = 0
+            self.last_sync = now
+
+    def close(self):
+        """
+        Close the state log. The journal is removed if all items are done.
+
+        :return: True if the journal is complete (and removed).
+        """
+        self.fh.close()
+        if all(state == DONE for state in self.states):
+            shutil.rmtree(self.path)
+            logging.info(f"Sync journal {self.path} complete and removed.")
+            return True
+        logging.info(f"Sync journal {self.path} kept: {len(self.todo())} items not done, use --resume.")
+        return False
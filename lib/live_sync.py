@@ -0,0 +1,162 @@
+"""
+This module keeps an in-memory copy of the PCloud tree up to date with the events of the PCloud diff call, and maps
+the changes to the local targets of the sync pairs. It is used by the sync daemon, that applies the changes within
+seconds instead of once a day.
+"""
+
+import logging
+import os
+from pathlib import PurePosixPath
+from lib import pcloud_handler
+from lib.merkle import entry
+
+FILE_EVENTS = ('createfile', 'modifyfile')
+FOLDER_EVENTS = ('createfolder', 'modifyfolder')
+DELETE_EVENTS = ('deletefile', 'deletefolder')
+
+
+class LiveTree:
+    """
+    This class keeps the path of every PCloud folder and file, by ID. Diff events have the folder ID of the parent
+    and the name of the item, the path is derived from the parent.
+    """
+
+    def __init__(self, pcloud_contents):
+        """
+        Index the inventory.
+
+        :param pcloud_contents: Inventory as returned by PcloudHandler.get_contents.
+        """
+        root = pcloud_contents.get('path', '/')
+        self.folders = {pcloud_contents.get('folderid', 0): root}
+        self.files = {}
+        stack = [(root, pcloud_contents['contents'])]
+        while stack:
+            path, contents = stack.pop()
+            for item in contents:
+                fn = str(PurePosixPath(path).joinpath(item['name']))
+                if item['isfolder']:
+                    self.folders[item['folderid']] = fn
+                    stack.append((fn, item['contents']))
+                else:
+                    self.files[item['fileid']] = fn
+
+    def path(self, metadata):
+        """
+        Return the PCloud path of an item from the diff metadata.
+
+        :param metadata: Item metadata.
+        :return: PCloud path, or None if the parent folder is not known.
+        """
+        parent = self.folders.get(metadata.get('parentfolderid'))
+        if parent is None:
+            return metadata.get('path')
+        return str(PurePosixPath(parent).joinpath(metadata['name']))
+
+    def apply(self, event):
+        """
+        Apply a diff event. A moved or renamed folder changes the path of everything below it.
+
+        :param event: Diff entry.
+        :return: Tuple (event name, new path, old path or None, metadata), None for events that are not about files or
+        folders.
+        """
+        name = event['event']
+        metadata = event.get('metadata')
+        if not metadata or name not in FILE_EVENTS + FOLDER_EVENTS + DELETE_EVENTS:
+            return None
+        path = self.path(metadata)
+        if metadata['isfolder']:
+            old = self.folders.get(metadata['folderid'])
+            if name == 'deletefolder':
+                self.folders.pop(metadata['folderid'], None)
+            else:
+                self.folders[metadata['folderid']] = path
+                if old and old != path:
+                    self.move(old, path)
+        else:
+            old = self.files.get(metadata['fileid'])
+            if name == 'deletefile':
+                self.files.pop(metadata['fileid'], None)
+            else:
+                self.files[metadata['fileid']] = path
+        return name, path, old, metadata
+
+    def move(self, old, new):
+        """
+        Change the paths below a moved folder.
+
+        :param old: Old folder path.
+        :param new: New folder path.
+        :return:
+        """
+        prefix = old.rstrip('/') + '/'
+        for index in (self.folders, self.files):
+            for item_id, path in index.items():
+                if path.startswith(prefix):
+                    index[item_id] = new.rstrip('/') + '/' + path[len(prefix):]
+
+
+class SyncPair:
+    """
+    This class holds the PCloud tree and the local tree of a sync pair (download), in the format of item2key and
+    get_local_contents.
+    """
+
+    def __init__(self, source_dir, target_dir, pcloud_tree, local_tree):
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.pcloud_tree = pcloud_tree
+        self.local_tree = local_tree
+        self.pending = set()
+
+    def changed(self, path, metadata):
+        """
+        Record a new or modified PCloud file or folder. The item is pending if the local item is missing or has a
+        different size.
+
+        :param path: PCloud path.
+        :param metadata: Item metadata from the diff event.
+        :return: True if the item is in scope of the pair.
+        """
+        fn = PurePosixPath(path)
+        key = pcloud_handler.convert_fn(fn, self.source_dir, self.target_dir)
+        if not key:
+            return False
+        item = entry(fn, metadata)
+        self.pcloud_tree[key] = item
+        local = self.local_tree.get(key)
+        if local is None or (not item['isfolder'] and local.get('size') != item['size']):
+            self.pending.add(key)
+        return True
+
+    def removed(self, path):
+        """
+        Record a removed PCloud item. Local files are not removed by the sync, only the PCloud tree is updated.
+
+        :param path: PCloud path.
+        :return:
+        """
+        key = pcloud_handler.convert_fn(PurePosixPath(path), self.source_dir, self.target_dir)
+        if key:
+            self.pcloud_tree.pop(key, None)
+            self.pending.discard(key)
+
+    def refresh_local(self, keys):
+        """
+        Update the local tree after a sync run.
+
+        :param keys: Local paths that have been handled.
+        :return:
+        """
+        for key in keys:
+            try:
+                st = os.stat(key)
+            except FileNotFoundError:
+                self.local_tree.pop(key, None)
+                continue
+            if os.path.isdir(key):
+                self.local_tree[key] = dict(isfolder=True, modified=int(st.st_mtime))
+            else:
+                self.local_tree[key] = dict(isfolder=False, size=st.st_size, modified=int(st.st_mtime))
+        logging.debug(f"{len(keys)} local items refreshed for {self.target_dir}")
@@ -0,0 +1,239 @@
+"""
+This module keeps a content index of the files on the local target. New PCloud files that have the same content as a
+file that is already on the local drive (e.g. a photo copied to a second album) can then be created from the local
+file instead of being downloaded again.
+Local checksums are cached in a json file, so a file is only read again when inode, size or mtime have changed.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+# ioctl request number to clone a file on Linux (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+
+def sha1_file(ffn):
+    """
+    This function calculates the sha1 checksum of a file. The file is memory mapped, so no data is copied to python
+    buffers.
+
+    :param ffn: Full filename of the file.
+    :return: sha1 checksum as hex string.
+    """
+    h = hashlib.sha1()
+    with open(ffn, 'rb') as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            return h.hexdigest()
+        with mm:
+            view = memoryview(mm)
+            for pos in range(0, len(mm), 16 * 1024 * 1024):
+                h.update(view[pos:pos + 16 * 1024 * 1024])
+            view.release()
+    return h.hexdigest()
+
+
+def _sha1_job(ffn):
+    """
+    Worker function for the process pool: return filename and checksum, False if the file cannot be read.
+
+    :param ffn: Full filename of the file.
+    :return: Tuple (ffn, checksum)
+    """
+    try:
+        return ffn, sha1_file(ffn)
+    except OSError:
+        return ffn, False
+
+
+class LocalIndex:
+    """
+    This class indexes the local files by size. The checksum of a local file is only calculated when a PCloud file
+    with the same size is looked up, and then kept in the checksum cache.
+    """
+
+    def __init__(self, local_tree, cache_file=None):
+        """
+        Build the size index from the local tree as collected by pcloud_handler.get_local_contents.
+
+        :param local_tree: Dictionary with local directories and files.
+        :param cache_file: Json file to keep the local checksums between runs. No cache if None.
+        """
+        self.by_size = {}
+        for k, v in local_tree.items():
+            if not v['isfolder']:
+                self.by_size.setdefault(v['size'], []).append(k)
+        self.cache_file = cache_file
+        self.cache = {}
+        if cache_file:
+            try:
+                with open(cache_file, 'r') as fh:
+                    self.cache = json.load(fh)
+            except (FileNotFoundError, json.JSONDecodeError):
+                logging.info(f"No usable checksum cache {cache_file}, starting a new one.")
+        self.hashed = 0
+
+    def checksum(self, ffn):
+        """
+        This method returns the sha1 checksum of a local file. The checksum is read from cache if inode, size and
+        mtime of the file did not change.
+
+        :param ffn: Full filename of the local file.
+        :return: sha1 checksum, or False if the file is not accessible.
+        """
+        try:
+            st = os.stat(ffn)
+        except OSError:
+            return False
+        sig = [st.st_ino, st.st_size, st.st_mtime_ns]
+        try:
+            cached = self.cache[ffn]
+        except KeyError:
+            pass
+        else:
+            if cached[:3] == sig:
+                return cached[3]
+        checksum = sha1_file(ffn)
+        self.cache[ffn] = sig + [checksum]
+        self.hashed += 1
+        return checksum
+
+    def checksum_all(self, files, workers=None):
+        """
+        This method makes sure that the checksums of all files are in the cache. Files that are not in the cache or
+        changed since the checksum was calculated are hashed in a process pool.
+
+        :param files: List of full filenames.
+        :param workers: Number of processes, default the number of CPUs.
+        :return: Dictionary full filename -> checksum (False if the file is not accessible).
+        """
+        result = {}
+        todo = {}
+        for ffn in files:
+            try:
+                st = os.stat(ffn)
+            except OSError:
+                result[ffn] = False
+                continue
+            sig = [st.st_ino, st.st_size, st.st_mtime_ns]
+            cached = self.cache.get(ffn)
+            if cached and cached[:3] == sig:
+                result[ffn] = cached[3]
+            else:
+                todo[ffn] = sig
+        if todo:
+            logging.info(f"{len(result)} checksums from cache, {len(todo)} files to hash.")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for ffn, checksum in executor.map(_sha1_job, todo, chunksize=16):
+                    result[ffn] = checksum
+                    if checksum:
+                        self.cache[ffn] = todo[ffn] + [checksum]
+                        self.hashed += 1
+        return result
+
+    def find(self, size, sha1, exclude=None):
+        """
+        This method finds a local file with size and checksum.
+
+        :param size: Size of the file.
+        :param sha1: sha1 checksum of the file.
+        :param exclude: Filename that must not be returned (the target file itself).
+        :return: Full filename of a local file with the same contents, or None.
+        """
+        for ffn in self.by_size.get(size, []):
+            if ffn != exclude and self.checksum(ffn) == sha1:
+                return ffn
+        return None
+
+    def has_size(self, size):
+        """
+        Check if there is at least one local file with this size. This allows to skip the remote checksum lookup.
+
+        :param size: Size of the file.
+        :return: True if a local file with this size exists.
+        """
+        return size in self.by_size
+
+    def add(self, ffn, size):
+        """
+        Add a new local file to the index, so it can be a source for the next files.
+
+        :param ffn: Full filename.
+        :param size: Size of the file.
+        :return:
+        """
+        self.by_size.setdefault(size, []).append(ffn)
+
+    def save(self):
+        """
+        Write the checksum cache to disk. Entries for files that do no longer exist are removed.
+
+        :return:
+        """
+        if not self.cache_file:
+            return
+        self.cache = {k: v for k, v in self.cache.items() if os.path.exists(k)}
+        tmp = f"{self.cache_file}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(self.cache, fh)
+        os.replace(tmp, self.cache_file)
+        logging.info(f"{self.hashed} local files hashed, {len(self.cache)} checksums in cache.")
+
+
+def reflink(src, dst):
+    """
+    Clone file src to dst. The clone shares the data blocks with the source until one of them is modified.
+
+    :param src: Source file.
+    :param dst: Target file.
+    :return: True if the clone is done, False if the filesystem (or OS) does not support it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        except OSError:
+            fail = True
+        else:
+            fail = False
+    if fail:
+        os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def materialize(src, dst, mode):
+    """
+    This function creates file dst from the identical local file src.
+
+    :param src: Local file with the required contents.
+    :param dst: File to create.
+    :param mode: copy, hardlink or reflink. Reflink falls back to copy if it is not supported.
+    :return:
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            logging.warning(f"Hardlink {src} to {dst} failed ({e}), file will be copied.")
+    elif mode == 'reflink':
+        if reflink(src, dst):
+            return
+        logging.debug(f"Reflink not supported for {dst}, file will be copied.")
+    shutil.copy2(src, dst)
+    return
@@ -0,0 +1,322 @@
+"""
+This module keeps the state of a local sync target up to date with inotify (Linux), so a sync does not need to walk
+the complete target directory. The watcher writes the local tree to a state file, in the format of
+get_local_contents. A sync uses the state file only when the watcher is running and the state is complete, otherwise
+(watcher down, event queue overflow, not enough inotify watches) the local target is scanned.
+inotify is called through ctypes, no additional package is needed.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import signal
+import struct
+import time
+from lib.pcloud_handler import get_local_contents
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+# IN_CLOSE_WRITE instead of IN_MODIFY: a file is stat-ed once when it is written, not on every write.
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+# struct inotify_event: int wd, uint32_t mask, uint32_t cookie, uint32_t len, char name[len]
+EVENT = struct.Struct('iIII')
+
+
+def state_file(fp, local_path):
+    """
+    This function returns the state file for a local target.
+
+    :param fp: Data directory.
+    :param local_path: Local target directory.
+    :return: Full filename of the state file.
+    """
+    key = hashlib.sha1(os.path.abspath(local_path).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(fp, 'watch', f"{key}.json")
+
+
+def local_contents(local_path, fp, timeout=10):
+    """
+    This function returns the local tree from the watcher state, or from a full scan if the state cannot be used.
+    The watcher is asked to write its state (signal SIGUSR1), so changes of the last seconds are included.
+
+    :param local_path: Local target directory.
+    :param fp: Data directory.
+    :param timeout: Seconds to wait for the watcher.
+    :return: Dictionary with local directories and files, see get_local_contents.
+    """
+    ffn = state_file(fp, local_path)
+    try:
+        with open(ffn, 'r') as fh:
+            state = json.load(fh)
+        pid = state['pid']
+        # A watcher that crashed leaves its state file, the process ID can be in use by another process by now.
+        if process_start(pid) != state['started']:
+            raise ProcessLookupError(f"Watcher process {pid} is not running.")
+        requested = time.time()
+        os.kill(pid, signal.SIGUSR1)
+        while time.time() - requested < timeout:
+            with open(ffn, 'r') as fh:
+                state = json.load(fh)
+            if state['updated'] >= requested:
+                if state['complete'] and state['root'] == local_path:
+                    logging.info(f"Local tree for {local_path} from watcher state, {len(state['tree'])} items.")
+                    return state['tree']
+                break
+            time.sleep(0.1)
+        logging.info(f"Watcher state for {local_path} not usable.")
+    except (OSError, ValueError, KeyError) as e:
+        # No state file, watcher not running or state file incomplete.
+        logging.info(f"No watcher for {local_path}: {e}")
+    logging.info(f"Full scan of {local_path}")
+    return get_local_contents(local_path)
+
+
+def process_start(pid):
+    """
+    This function returns the start time of a process, to check that a process ID still belongs to the same process.
+
+    :param pid: Process ID.
+    :return: Start time in clock ticks after boot, from /proc/<pid>/stat.
+    """
+    with open(f"/proc/{pid}/stat", 'r') as fh:
+        stat = fh.read()
+    # The process name (field 2) can contain spaces, the fields after it start after the last ')'.
+    return int(stat[stat.rfind(')') + 2:].split()[19])
+
+
+class Inotify:
+    """
+    This class is a thin wrapper around the inotify system calls.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init1 = libc.inotify_init1
+        except AttributeError:
+            raise OSError("inotify is not available on this system.")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Read the available events.
+
+        :return: List of tuples (wd, mask, cookie, name).
+        """
+        try:
+            buf = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, name_len = EVENT.unpack_from(buf, pos)
+            pos += EVENT.size
+            name = os.fsdecode(buf[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LocalWatcher:
+    """
+    This class watches a local target directory and keeps the local tree dictionary up to date.
+    """
+
+    def __init__(self, local_path, state_ffn):
+        """
+        Add watches for all directories and scan the target. The watch for a directory is added before the directory
+        is scanned, so no change is lost.
+
+        :param local_path: Local target directory, same string as used for the sync.
+        :param state_ffn: State file.
+        """
+        self.root = local_path
+        self.state_ffn = state_ffn
+        self.inotify = Inotify()
+        self.started = process_start(os.getpid())
+        self.watches = {}
+        self.tree = {}
+        self.complete = True
+        self.dirty = True
+        self.rescan()
+
+    def rescan(self):
+        """
+        Watch and scan the complete target, after start and after an event queue overflow.
+
+        :return:
+        """
+        for wd in list(self.watches):
+            self.inotify.rm_watch(wd)
+        self.watches = {}
+        self.complete = True
+        self.tree = {}
+        self.add_tree(self.root)
+        logging.info(f"{self.root}: {len(self.watches)} directories watched, {len(self.tree)} items.")
+
+    def add_tree(self, path):
+        """
+        Watch a directory and its subdirectories, and add all items to the tree.
+
+        :param path: Directory.
+        :return:
+        """
+        for root, dirs, files in os.walk(path):
+            try:
+                self.watches[self.inotify.add_watch(root)] = root
+            except OSError as e:
+                # Most likely the maximum number of watches (fs.inotify.max_user_watches), sync will do a full scan.
+                logging.error(f"Cannot watch {root}: {e}")
+                self.complete = False
+            self.update(root, True)
+            for file in files:
+                self.update(os.path.join(root, file), False)
+
+    def remove_tree(self, path):
+        """
+        Remove a directory and everything below it from the tree and stop watching it.
+
+        :param path: Directory.
+        :return:
+        """
+        prefix = path + os.sep
+        for k in [k for k in self.tree if k == path or k.startswith(prefix)]:
+            del self.tree[k]
+        for wd, wd_path in list(self.watches.items()):
+            if wd_path == path or wd_path.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def update(self, path, isfolder):
+        """
+        Update a file or the modification time of a directory from the file system.
+
+        :param path: File or directory.
+        :param isfolder: True for a directory.
+        :return:
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.tree.pop(path, None)
+            return
+        if isfolder:
+            self.tree[path] = dict(isfolder=True, modified=int(st.st_mtime))
+        else:
+            self.tree[path] = dict(isfolder=False, size=st.st_size, modified=int(st.st_mtime))
+
+    def handle(self, wd, mask, name):
+        """
+        Handle an inotify event.
+
+        :param wd: Watch descriptor.
+        :param mask: Event mask.
+        :param name: Name of the file or directory in the watched directory, empty for the directory itself.
+        :return:
+        """
+        if mask & IN_Q_OVERFLOW:
+            logging.warning(f"{self.root}: inotify event queue overflow, scan again.")
+            self.rescan()
+            self.dirty = True
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and self.watches.get(wd) == self.root:
+            logging.error(f"{self.root} has been removed or moved.")
+            self.complete = False
+            self.dirty = True
+            return
+        dirpath = self.watches.get(wd)
+        if dirpath is None or not name:
+            return
+        path = os.path.join(dirpath, name)
+        self.dirty = True
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove_tree(path)
+            else:
+                self.update(path, True)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.tree.pop(path, None)
+        else:
+            self.update(path, False)
+        # The modification time of the directory changes with its contents.
+        self.update(dirpath, True)
+
+    def save(self):
+        """
+        Write the state file. The file is replaced atomically, readers never see a partial state.
+
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.state_ffn), exist_ok=True)
+        state = dict(root=self.root, pid=os.getpid(), started=self.started, updated=time.time(),
+                     complete=self.complete, tree=self.tree)
+        tmp = f"{self.state_ffn}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.state_ffn)
+        self.dirty = False
+
+    def process_events(self):
+        """
+        Read and handle the available events.
+
+        :return: Number of events.
+        """
+        events = self.inotify.read_events()
+        for wd, mask, _, name in events:
+            self.handle(wd, mask, name)
+        return len(events)
+
+    def close(self):
+        """
+        Stop watching. The state file is removed, a sync will scan the target until the watcher runs again.
+
+        :return:
+        """
+        self.inotify.close()
+        try:
+            os.remove(self.state_ffn)
+        except FileNotFoundError:
+            pass
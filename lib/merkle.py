@@ -0,0 +1,117 @@
+"""
+This module adds subtree digests to a PCloud inventory and compares two inventories with these digests. The digest of
+a folder is calculated from the name, size and hash of its files and the name and digest of its subfolders, so a
+folder with the same digest in two inventories has the same contents. The comparison only descends into folders with
+a different digest: the work is proportional to the changes, not to the size of the tree.
+"""
+
+import hashlib
+from pathlib import PurePosixPath
+from lib.pcloud_handler import parse_date
+
+
+def add_digests(root):
+    """
+    This function calculates the digest of every folder in an inventory, bottom-up in one pass. The digest is added to
+    the folder as attribute 'digest'.
+
+    :param root: Inventory as returned by PcloudHandler.get_contents (root folder with contents).
+    :return: Digest of the root folder.
+    """
+    stack = [(root, False)]
+    while stack:
+        folder, children_done = stack.pop()
+        if not children_done:
+            stack.append((folder, True))
+            stack.extend((item, False) for item in folder['contents'] if item['isfolder'])
+            continue
+        lines = []
+        for item in folder['contents']:
+            if item['isfolder']:
+                lines.append(f"{item['name']}/\0{item['digest']}")
+            else:
+                lines.append(f"{item['name']}\0{item['size']}\0{item['hash']}")
+        lines.sort()
+        folder['digest'] = hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+    return root['digest']
+
+
+def entry(fn, item):
+    """
+    This function returns the information of an item, as item2key does.
+
+    :param fn: PCloud path of the item (PurePosixPath).
+    :param item: Item from the inventory.
+    :return: Dictionary with the item information.
+    """
+    if item['isfolder']:
+        return dict(fn=fn, isfolder=True, created=parse_date(item['created']), modified=parse_date(item['modified']))
+    return dict(fn=fn, isfolder=False, created=parse_date(item['created']), modified=parse_date(item['modified']),
+                fileid=item['fileid'], size=item['size'], hash=item['hash'], contenttype=item['contenttype'])
+
+
+def add_subtree(keys, tree, fn, item):
+    """
+    This function adds an item and everything below it to a list of keys and to a tree dictionary.
+
+    :param keys: List of keys.
+    :param tree: Dictionary with item information per key.
+    :param fn: PCloud path of the item.
+    :param item: Item from the inventory.
+    :return:
+    """
+    stack = [(fn, item)]
+    while stack:
+        fn, item = stack.pop()
+        keys.append(fn)
+        tree[fn] = entry(fn, item)
+        if item['isfolder']:
+            stack.extend((fn.joinpath(child['name']), child) for child in reversed(item['contents']))
+
+
+def diff(prev, current):
+    """
+    This function compares two inventories, top-down. A folder with the same digest in both inventories is skipped.
+    Inventories without digests (collected before the digests were added) get their digests first.
+    The result is the same as comparing the item2key dictionaries of both inventories: a file is modified if the
+    hash is different, every item in a new or removed folder tree is reported.
+
+    :param prev: Previous inventory.
+    :param current: Current inventory.
+    :return: Tuple (new items, modified items, removed items, current tree, previous tree). The trees have the item
+    information (see item2key) of the changed items only.
+    """
+    for root in (prev, current):
+        if 'digest' not in root:
+            add_digests(root)
+    new_items = []
+    modified_items = []
+    removed_items = []
+    current_tree = {}
+    prev_tree = {}
+    stack = [(PurePosixPath(current['path']), prev, current)]
+    while stack:
+        path, prev_folder, current_folder = stack.pop()
+        if prev_folder['digest'] == current_folder['digest']:
+            continue
+        prev_items = {item['name']: item for item in prev_folder['contents']}
+        subfolders = []
+        for item in current_folder['contents']:
+            fn = path.joinpath(item['name'])
+            prev_item = prev_items.pop(item['name'], None)
+            if prev_item is not None and prev_item['isfolder'] != item['isfolder']:
+                # A file replaced by a folder or the other way round.
+                add_subtree(removed_items, prev_tree, fn, prev_item)
+                prev_item = None
+            if prev_item is None:
+                add_subtree(new_items, current_tree, fn, item)
+            elif item['isfolder']:
+                subfolders.append((fn, prev_item, item))
+            elif item['hash'] != prev_item['hash']:
+                modified_items.append(fn)
+                current_tree[fn] = entry(fn, item)
+                prev_tree[fn] = entry(fn, prev_item)
+        for name, prev_item in prev_items.items():
+            add_subtree(removed_items, prev_tree, path.joinpath(name), prev_item)
+        stack.extend(reversed(subfolders))
+    return new_items, modified_items, removed_items, current_tree, prev_tree
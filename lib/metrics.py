@@ -0,0 +1,248 @@
+"""
+This module collects the latency, byte counts, retries and errors of the PCloud API calls and downloads, per method
+and host. At the end of the script the metrics are written as a json run summary and as a Prometheus textfile, for
+the textfile collector of the node exporter. The files are written to PCMetricsDir, default DATADIR/metrics, and are
+named after the script (pcloud_<script>.json and pcloud_<script>.prom). The previous run of the script is replaced.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    This function returns the metrics of the process. The metrics are created on first use, and written when the
+    process ends.
+
+    :return: Metrics object.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(script_name())
+            atexit.register(_metrics.write)
+    return _metrics
+
+
+def script_name():
+    """
+    This function returns the name of the running script. For the pcloud command this is the subcommand, the files
+    get the pcloud_ prefix in write.
+
+    :return: Script name, e.g. sync_dirs or sync.
+    """
+    name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    if not name or name.startswith('-'):
+        # Interactive interpreter or python -c
+        name = 'python'
+    if name == 'pcloud' and len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        name = sys.argv[1]
+    return name
+
+
+class Call:
+    """
+    This class measures one call, as context manager. Set sent, received and error in the block, an exception in
+    the block is recorded as error with the name of the exception. Expected exceptions, e.g. the timeout of a long
+    poll without changes, are not recorded as error.
+    """
+
+    def __init__(self, metrics, method, host, expected=()):
+        self.metrics = metrics
+        self.method = method
+        self.host = host
+        self.expected = expected
+        self.sent = 0
+        self.received = 0
+        self.error = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.error is None and not issubclass(exc_type, self.expected):
+            self.error = exc_type.__name__
+        self.metrics.observe(self.method, self.host, time.perf_counter() - self.start, sent=self.sent,
+                             received=self.received, error=self.error)
+        return False
+
+
+class Metrics:
+    """
+    This class holds the metrics per (method, host). Worker threads can record calls concurrently.
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def _series(self, method, host):
+        key = (method, host)
+        if key not in self.series:
+            self.series[key] = dict(count=0, seconds=0.0, max_seconds=0.0, buckets=[0] * len(BUCKETS), sent=0,
+                                    received=0, errors={}, retries={})
+        return self.series[key]
+
+    def call(self, method, url, expected=()):
+        """
+        Return a context manager that measures a call.
+
+        :param method: API method, or 'download' for file contents.
+        :param url: URL of the call, the host is taken from the URL.
+        :param expected: Tuple of exception classes that are not an error of the call.
+        :return: Call object.
+        """
+        return Call(self, method, urlsplit(url).netloc, expected)
+
+    def observe(self, method, host, seconds, sent=0, received=0, error=None):
+        """
+        Record a call.
+
+        :param method: API method.
+        :param host: Host of the call.
+        :param seconds: Duration of the call.
+        :param sent: Bytes sent (uploads).
+        :param received: Bytes received.
+        :param error: Error code: PCloud result code, http_<status> or name of the exception. None for success.
+        :return:
+        """
+        with self.lock:
+            series = self._series(method, host)
+            series['count'] += 1
+            series['seconds'] += seconds
+            series['max_seconds'] = max(series['max_seconds'], seconds)
+            for idx, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series['buckets'][idx] += 1
+                    break
+            series['sent'] += sent
+            series['received'] += received
+            if error is not None:
+                series['errors'][str(error)] = series['errors'].get(str(error), 0) + 1
+
+    def retry(self, method, url, reason):
+        """
+        Record a retry of a call.
+
+        :param method: API method.
+        :param url: URL of the call.
+        :param reason: Reason of the retry, e.g. auth.
+        :return:
+        """
+        with self.lock:
+            retries = self._series(method, urlsplit(url).netloc)['retries']
+            retries[reason] = retries.get(reason, 0) + 1
+
+    def quantile(self, series, q):
+        """
+        Estimate a quantile from the histogram: the upper bound of the bucket with the quantile.
+        """
+        target = q * series['count']
+        total = 0
+        for idx, cnt in enumerate(series['buckets']):
+            total += cnt
+            if total >= target and cnt:
+                return BUCKETS[idx]
+        return series['max_seconds']
+
+    def summary(self):
+        """
+        Return the run summary.
+
+        :return: Dictionary with the run information and a list of calls per method and host.
+        """
+        with self.lock:
+            calls = []
+            for (method, host), series in sorted(self.series.items()):
+                calls.append(dict(method=method, host=host, count=series['count'],
+                                  seconds=round(series['seconds'], 3),
+                                  mean_seconds=round(series['seconds'] / series['count'], 4) if series['count'] else 0,
+                                  p50_seconds=self.quantile(series, 0.5), p95_seconds=self.quantile(series, 0.95),
+                                  max_seconds=round(series['max_seconds'], 3), bytes_sent=series['sent'],
+                                  bytes_received=series['received'], errors=dict(series['errors']),
+                                  retries=dict(series['retries'])))
+        return dict(script=self.script, started=self.started, duration_seconds=round(time.time() - self.started, 3),
+                    calls=calls)
+
+    def prometheus(self):
+        """
+        Return the metrics in the Prometheus text format.
+
+        :return: Text for the textfile collector.
+        """
+        lines = ['# HELP pcloud_request_duration_seconds Duration of PCloud API calls and downloads.',
+                 '# TYPE pcloud_request_duration_seconds histogram']
+        totals = []
+        with self.lock:
+            for (method, host), series in sorted(self.series.items()):
+                labels = f'script="{self.script}",method="{method}",host="{host}"'
+                cumulative = 0
+                for bound, cnt in zip(BUCKETS, series['buckets']):
+                    cumulative += cnt
+                    lines.append(f'pcloud_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'pcloud_request_duration_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f'pcloud_request_duration_seconds_sum{{{labels}}} {series["seconds"]:.6f}')
+                lines.append(f'pcloud_request_duration_seconds_count{{{labels}}} {series["count"]}')
+                totals.append((labels, series))
+        lines += ['# HELP pcloud_request_bytes_total Bytes sent and received by PCloud calls and downloads.',
+                  '# TYPE pcloud_request_bytes_total counter']
+        for labels, series in totals:
+            lines.append(f'pcloud_request_bytes_total{{{labels},direction="sent"}} {series["sent"]}')
+            lines.append(f'pcloud_request_bytes_total{{{labels},direction="received"}} {series["received"]}')
+        lines += ['# HELP pcloud_request_errors_total Failed PCloud calls by error code.',
+                  '# TYPE pcloud_request_errors_total counter']
+        for labels, series in totals:
+            for code, cnt in sorted(series['errors'].items()):
+                lines.append(f'pcloud_request_errors_total{{{labels},code="{code}"}} {cnt}')
+        lines += ['# HELP pcloud_request_retries_total Retried PCloud calls by reason.',
+                  '# TYPE pcloud_request_retries_total counter']
+        for labels, series in totals:
+            for reason, cnt in sorted(series['retries'].items()):
+                lines.append(f'pcloud_request_retries_total{{{labels},reason="{reason}"}} {cnt}')
+        lines += ['# HELP pcloud_run_start_time_seconds Start of the run.',
+                  '# TYPE pcloud_run_start_time_seconds gauge',
+                  f'pcloud_run_start_time_seconds{{script="{self.script}"}} {self.started:.0f}',
+                  '# HELP pcloud_run_duration_seconds Duration of the run.',
+                  '# TYPE pcloud_run_duration_seconds gauge',
+                  f'pcloud_run_duration_seconds{{script="{self.script}"}} {time.time() - self.started:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, metrics_dir=None):
+        """
+        Write the run summary and the Prometheus textfile. The files are replaced atomically, the node exporter never
+        reads a partial file.
+
+        :param metrics_dir: Directory for the files, default PCMetricsDir or DATADIR/metrics.
+        :return:
+        """
+        metrics_dir = metrics_dir or os.getenv('PCMetricsDir')
+        if not metrics_dir:
+            if not os.getenv('DATADIR'):
+                return
+            metrics_dir = os.path.join(os.getenv('DATADIR'), 'metrics')
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            base = os.path.join(metrics_dir, f"pcloud_{self.script}")
+            for ffn, text in ((f"{base}.json", json.dumps(self.summary(), indent=2)),
+                              (f"{base}.prom", self.prometheus())):
+                tmp = f"{ffn}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as fh:
+                    fh.write(text)
+                os.replace(tmp, ffn)
+        except OSError as e:
+            logging.error(f"Could not write metrics to {metrics_dir}: {e}")
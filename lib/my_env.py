@@ -4,15 +4,23 @@ setup and initializing the config file.
 Also some application specific utilities find their home here.
 """
 
+import atexit
+import collections
 import configparser
+import json
 import logging
 import logging.handlers
 import os
 import platform
+import queue
 import sys
 import subprocess
-from datetime import datetime
-from dotenv import load_dotenv
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Log listener threads, stopped when the script ends.
+_listeners = []
 
 
 def init_env(projectname, filename):
@@ -46,6 +54,9 @@ def init_loghandler(modulename):
     """
     This function initializes the loghandler. Logfilename consists of calling module name + computername.
     Format of the logmessage is specified in basicConfig function.
+    The calling thread only puts the records on a queue, a listener thread formats them and writes them to the logfile.
+    Worker threads do not wait for the disk or for each other. The listener writes the remaining records when the
+    script ends.
 
     :param modulename: The name of the module. Each module will create it's own logfile.
     :return: Log Handler
@@ -67,8 +78,14 @@ def init_loghandler(modulename):
                                        datefmt='%d/%m/%Y|%H:%M:%S')
     # Add Formatter to Rotating File Handler
     rfh.setFormatter(formatter_file)
-    # Add Handler to the logger
-    logger.addHandler(rfh)
+    # Add Handler to the logger, through the queue
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LazyQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, rfh)
+    listener.start()
+    if not _listeners:
+        atexit.register(stop_logging)
+    _listeners.append(listener)
     # Configure Console Handler
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
@@ -108,11 +125,26 @@ def get_inifile(projectname):
     except FileNotFoundError:
         # If no Config file defined, then return empty dictionary.
         ini_config = {}
+    # dotenv is only needed when the configuration is loaded, not when a script is imported.
+    from dotenv import load_dotenv
     envfile = os.path.join(filepath, ".env")
     load_dotenv(dotenv_path=envfile)
     return ini_config
 
 
+def get_inventory_files(fp):
+    """
+    This function returns the PCloud inventory files in the data directory, most recent first. Other json files in the
+    data directory (caches, state files) are ignored.
+
+    :param fp: Data directory.
+    :return: List of inventory filenames, youngest first.
+    """
+    inventory_files = [file for file in os.listdir(fp) if file.startswith('pcloud') and file.endswith('.json')]
+    inventory_files.sort(reverse=True)
+    return inventory_files
+
+
 def run_script(path, script_name, *args):
     """
     This function will run a python script with arguments.
@@ -129,6 +161,56 @@ def run_script(path, script_name, *args):
     return
 
 
+def stop_logging():
+    """
+    This function writes the queued log records and stops the log listener threads. It runs when the script ends.
+
+    :return:
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    This class puts log records on the queue without formatting them, the message is formatted in the listener thread.
+    The records stay in this process, so the arguments do not need to be converted to strings first. Arguments of a
+    log call must not be changed after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogSampler:
+    """
+    This class logs a sample of the debug messages of a hot path (a function that is called for every item of the
+    inventory): the first message and then one in every n messages. Nothing is formatted when debug logging is off.
+    """
+
+    def __init__(self, every=10000):
+        """
+        :param every: Log one in every messages.
+        """
+        self.every = every
+        self.cnt = 0
+
+    def debug(self, msg, *args):
+        """
+        Log a debug message if it is in the sample. Use %-style placeholders in msg, the arguments are only formatted
+        for the messages that are logged.
+
+        :param msg: Message with placeholders.
+        :param args: Arguments for the placeholders.
+        :return:
+        """
+        if not logging.root.isEnabledFor(logging.DEBUG):
+            return
+        self.cnt += 1
+        if self.cnt % self.every == 1 or self.every == 1:
+            logging.debug(f"{msg} (message %d, 1 in %d logged)", *args, self.cnt, self.every, stacklevel=2)
+
+
 class LoopInfo:
     """
     This class handles a FOR loop information handling.
@@ -169,3 +251,152 @@ class LoopInfo:
         curr_time = datetime.now().strftime("%H:%M:%S")
         print("{0} - {1} {2} handled - End.\n".format(curr_time, str(self.rec_cnt), str(self.attribname)))
         return self.rec_cnt
+
+
+def fmt_bytes(nbytes):
+    """
+    This function returns a number of bytes in a readable format, e.g. 1.2 GB.
+
+    :param nbytes: Number of bytes.
+    :return: String with unit.
+    """
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(nbytes) < 1000:
+            return f"{nbytes:.1f} {unit}" if unit != 'B' else f"{nbytes} {unit}"
+        nbytes /= 1000
+    return f"{nbytes:.1f} TB"
+
+
+class Progress(LoopInfo):
+    """
+    This class reports the progress of a transfer against the totals of the plan: items and bytes done, throughput
+    (moving average) and the estimated time to finish. Workers can report from any thread. A progress line is printed
+    at most every interval seconds, a log record with the progress as json at most every log_interval seconds.
+    """
+
+    def __init__(self, attribname, total_items, total_bytes, interval=5, log_interval=60, window=30):
+        """
+        :param attribname: Name of the items, e.g. files.
+        :param total_items: Number of items in the plan.
+        :param total_bytes: Number of bytes in the plan.
+        :param interval: Seconds between progress lines on the console.
+        :param log_interval: Seconds between progress log records.
+        :param window: Seconds of the moving average for the throughput.
+        """
+        super().__init__(attribname, total_items)
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.log_interval = log_interval
+        self.window = window
+        self.failed = 0
+        self.bytes_done = 0
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.next_print = self.started + interval
+        self.next_log = self.started + log_interval
+        # Samples (time, items, bytes), at least a second apart, for the moving average.
+        self.samples = collections.deque([(self.started, 0, 0)])
+
+    def update(self, nbytes):
+        """
+        Report bytes of an item that is not done yet, e.g. a block of a download.
+
+        :param nbytes: Number of bytes.
+        :return:
+        """
+        with self.lock:
+            self.bytes_done += nbytes
+            self._tick()
+
+    def done(self, items=1, nbytes=0, failed=False):
+        """
+        Report handled items.
+
+        :param items: Number of items.
+        :param nbytes: Number of bytes not reported with update yet.
+        :param failed: True if the items failed.
+        :return: Number of items handled.
+        """
+        with self.lock:
+            self.rec_cnt += items
+            if failed:
+                self.failed += items
+            self.bytes_done += nbytes
+            self._tick()
+            return self.rec_cnt
+
+    def info_loop(self):
+        return self.done()
+
+    def _tick(self):
+        """
+        Add a sample and report if it is time. The caller holds the lock.
+        """
+        now = time.monotonic()
+        if now - self.samples[-1][0] >= 1:
+            self.samples.append((now, self.rec_cnt, self.bytes_done))
+            while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+        if now >= self.next_print:
+            self.next_print = now + self.interval
+            print(self.line(self.state(now)))
+        if now >= self.next_log:
+            self.next_log = now + self.log_interval
+            logging.info("Progress %s", json.dumps(self.state(now)))
+
+    def state(self, now=None):
+        """
+        Return the progress.
+
+        :param now: Monotonic time, default now.
+        :return: Dictionary with items, bytes, throughput and ETA (seconds, None if not known).
+        """
+        now = now or time.monotonic()
+        t0, items0, bytes0 = self.samples[0]
+        elapsed = max(now - t0, 1e-9)
+        items_rate = (self.rec_cnt - items0) / elapsed
+        bytes_rate = (self.bytes_done - bytes0) / elapsed
+        if self.total_bytes and bytes_rate > 0:
+            eta = (self.total_bytes - self.bytes_done) / bytes_rate
+        elif items_rate > 0:
+            eta = (self.total_items - self.rec_cnt) / items_rate
+        else:
+            eta = None
+        return dict(name=self.attribname, items=self.rec_cnt, total_items=self.total_items, failed=self.failed,
+                    bytes=self.bytes_done, total_bytes=self.total_bytes,
+                    pct=round(100 * self.bytes_done / self.total_bytes, 1) if self.total_bytes else None,
+                    items_per_second=round(items_rate, 2), bytes_per_second=round(bytes_rate),
+                    elapsed_seconds=round(now - self.started, 1),
+                    eta_seconds=round(max(eta, 0)) if eta is not None else None)
+
+    def line(self, state):
+        """
+        Return the progress line for the console.
+        """
+        curr_time = datetime.now().strftime("%H:%M:%S")
+        line = f"{curr_time} - {state['items']}/{state['total_items']} {self.attribname}"
+        if state['failed']:
+            line += f" ({state['failed']} failed)"
+        if state['total_bytes']:
+            line += f", {fmt_bytes(state['bytes'])}/{fmt_bytes(state['total_bytes'])} ({state['pct']}%)"
+        line += f", {fmt_bytes(state['bytes_per_second'])}/s, {state['items_per_second']} {self.attribname}/s"
+        if state['eta_seconds'] is not None:
+            line += f", ETA {timedelta(seconds=state['eta_seconds'])}"
+        return line
+
+    def end_loop(self):
+        """
+        Print and log the final progress.
+
+        :return: Number of items handled.
+        """
+        with self.lock:
+            state = self.state()
+        # Throughput of the complete run instead of the moving average.
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        state.update(items_per_second=round(self.rec_cnt / elapsed, 2),
+                     bytes_per_second=round(self.bytes_done / elapsed), eta_seconds=None)
+        logging.info("Progress %s", json.dumps(state))
+        print(self.line(state))
+        return super().end_loop()
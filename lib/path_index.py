@@ -0,0 +1,178 @@
+"""
+This module writes and reads the path index of an inventory. The index is a file next to the inventory json file with
+all paths sorted, so a path can be found with a binary search on the memory mapped file, without reading the
+inventory. Paths that start with a prefix (the contents of a folder tree) are next to each other in the index.
+
+File layout (little endian):
+    header: magic b'PCIX', version (uint32), number of items (uint64)
+    offsets: one uint64 per item, position of the item record in the file, in path order
+    records: fileid or folderid (int64), hash (uint64), size (int64), modified (int64), isfolder (uint8),
+             path length (uint16), path (utf-8)
+"""
+
+import json
+import mmap
+import os
+import struct
+from lib.pcloud_handler import walk_contents
+
+MAGIC = b'PCIX'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')
+OFFSET = struct.Struct('<Q')
+RECORD = struct.Struct('<qQqqBH')
+
+
+def index_ffn(ffn):
+    """
+    This function returns the filename of the path index for an inventory file.
+
+    :param ffn: Filename of the inventory json file.
+    :return: Filename of the index.
+    """
+    return f"{os.path.splitext(ffn)[0]}.idx"
+
+
+def write_index(pcloud_contents, ffn):
+    """
+    This function writes the path index for an inventory. The index is written to a temporary file first, so a reader
+    never sees a partial index.
+
+    :param pcloud_contents: Inventory as returned by PcloudHandler.get_contents.
+    :param ffn: Filename of the index.
+    :return: Number of items in the index.
+    """
+    records = []
+    root = pcloud_contents.get('path', '/')
+    for row in walk_contents(root, pcloud_contents['contents']):
+        path, isfolder, fileid, folderid, size, pc_hash, _, _, modified = row
+        path_bytes = path.encode('utf-8')
+        records.append((path_bytes, RECORD.pack(folderid if isfolder else fileid, int(pc_hash or 0), size or 0,
+                                                modified, isfolder, len(path_bytes)) + path_bytes))
+    records.sort()
+    tmp = f"{ffn}.tmp"
+    with open(tmp, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        pos = HEADER.size + OFFSET.size * len(records)
+        offsets = bytearray()
+        for _, record in records:
+            offsets += OFFSET.pack(pos)
+            pos += len(record)
+        fh.write(offsets)
+        for _, record in records:
+            fh.write(record)
+    os.replace(tmp, ffn)
+    return len(records)
+
+
+class PathIndex:
+    """
+    This class reads a path index. Lookups read only the pages of the file that are needed for the binary search.
+    """
+
+    def __init__(self, ffn):
+        """
+        Open and map the index file.
+
+        :param ffn: Filename of the index.
+        """
+        self.fh = open(ffn, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{ffn} is not a path index (version {VERSION}).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _path(self, idx):
+        """
+        Return the path of the item at position idx, as bytes.
+        """
+        pos = OFFSET.unpack_from(self.mm, HEADER.size + OFFSET.size * idx)[0]
+        path_len = struct.unpack_from('<H', self.mm, pos + RECORD.size - 2)[0]
+        return self.mm[pos + RECORD.size:pos + RECORD.size + path_len]
+
+    def _item(self, idx):
+        """
+        Return the item at position idx.
+        """
+        pos = OFFSET.unpack_from(self.mm, HEADER.size + OFFSET.size * idx)[0]
+        item_id, pc_hash, size, modified, isfolder, path_len = RECORD.unpack_from(self.mm, pos)
+        path = self.mm[pos + RECORD.size:pos + RECORD.size + path_len].decode('utf-8')
+        if isfolder:
+            return dict(path=path, isfolder=True, folderid=item_id, modified=modified)
+        return dict(path=path, isfolder=False, fileid=item_id, hash=pc_hash, size=size, modified=modified)
+
+    def _bisect(self, key):
+        """
+        Return the position of the first path that is not smaller than key.
+        """
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._path(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def lookup(self, path):
+        """
+        This method finds an item by path.
+
+        :param path: PCloud path.
+        :return: Dictionary with path, isfolder, fileid (folderid for a folder), hash, size and modified, or None.
+        """
+        key = path.encode('utf-8')
+        idx = self._bisect(key)
+        if idx < self.count and self._path(idx) == key:
+            return self._item(idx)
+        return None
+
+    def scan(self, prefix):
+        """
+        This method returns the items with a path that starts with prefix. Use a prefix ending with '/' for the
+        contents of a folder tree.
+
+        :param prefix: Path prefix.
+        :return: Generator of items, in path order.
+        """
+        key = prefix.encode('utf-8')
+        idx = self._bisect(key)
+        while idx < self.count and self._path(idx).startswith(key):
+            yield self._item(idx)
+            idx += 1
+
+    def close(self):
+        """
+        Close the index file.
+
+        :return:
+        """
+        self.mm.close()
+        self.fh.close()
+
+
+def open_index(fp, ffn):
+    """
+    This function opens the path index of an inventory file. The index is created from the inventory if it does not
+    exist, for inventories that were collected before the index.
+
+    :param fp: Data directory.
+    :param ffn: Filename of the inventory, in the data directory.
+    :return: PathIndex object.
+    """
+    inventory_ffn = os.path.join(fp, ffn)
+    idx_ffn = index_ffn(inventory_ffn)
+    if not os.path.exists(idx_ffn):
+        with open(inventory_ffn, 'r') as fh:
+            write_index(json.load(fh), idx_ffn)
+    return PathIndex(idx_ffn)
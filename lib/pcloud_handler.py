@@ -1,41 +1,186 @@
+import calendar
 import datetime
+import json
 import logging
 import os
-import requests
+import threading
+import time
+from email.utils import parsedate_to_datetime
 from pathlib import Path, PurePosixPath
+from lib.metrics import get_metrics
+from lib.my_env import LogSampler
+
+MONTHS = dict(Jan=1, Feb=2, Mar=3, Apr=4, May=5, Jun=6, Jul=7, Aug=8, Sep=9, Oct=10, Nov=11, Dec=12)
+# Lifetime of an auth token, requested at login. PCloud also expires a token that is not used for this period.
+AUTH_LIFETIME = 30 * 24 * 3600
+# PCloud result codes for a missing, invalid or expired auth token.
+AUTH_ERRORS = (1000, 2000)
+# convert_fn is called for every inventory item, only a sample of its debug messages is logged.
+convert_log = LogSampler()
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_handler():
+    """
+    This function returns the PcloudHandler of the process. The handler is created on first use, later calls (from
+    other modules or worker threads) share the handler, its session and its auth token.
+
+    :return: PcloudHandler object.
+    """
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = PcloudHandler()
+        return _handler
 
 
 class PcloudHandler:
     """
-    This class consolidates the pcloud functionality. On initialization a connection to pcloud account is set.
+    This class consolidates the pcloud functionality. The auth token is kept in a file, so that it is reused by the
+    next scripts and runs. The token is not validated upfront: a login with username and password is done only when
+    there is no token, when the token is expired or when PCloud rejects it.
     List method allows to list all files in the specified folder. Logout method will close the connection.
     """
 
     def __init__(self):
         """
-        On initialization a connection to pcloud account is done.
+        On initialization the session is prepared and the stored auth token is read. Use get_handler to share one
+        handler in a process.
+        """
+        # requests is imported when a connection is needed, commands that work on local files start faster.
+        import requests
+        self.url_base = os.getenv('PCHome')
+        self.auth_file = os.getenv('PCAuthFile') or os.path.join(os.getenv('DATADIR'), '.pcloud_auth.json')
+        self.session = requests.Session()
+        # Allow concurrent calls from worker threads without discarding connections.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.auth_lock = threading.Lock()
+        self.auth = self.load_auth()
+        if not self.auth:
+            self.login()
+
+    def load_auth(self):
+        """
+        This method reads the auth token from the token file. A token for another user or a token that expires within
+        the next hour is not used.
+
+        :return: auth token, or None if no valid token is available.
+        """
+        try:
+            with open(self.auth_file, 'r') as fh:
+                token = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        if token.get('user') != os.getenv('PCUser') or token.get('expires', 0) < time.time() + 3600:
+            logging.info("Stored auth token expired or for another user.")
+            return None
+        logging.debug("Stored auth token reused.")
+        return token['auth']
+
+    def save_auth(self, expires):
+        """
+        This method writes the auth token to the token file. The file is only readable for the owner, it is replaced
+        atomically so that scripts running at the same time never read a partial file.
+
+        :param expires: Expiry time of the token (epoch seconds).
+        :return:
+        """
+        token = dict(user=os.getenv('PCUser'), auth=self.auth, expires=int(expires))
+        tmp = f"{self.auth_file}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(token, fh)
+        os.replace(tmp, self.auth_file)
+
+    def login(self):
+        """
+        This method logs in with username and password and stores the new auth token.
+
+        :return:
         """
         user = os.getenv('PCUser')
         passwd = os.getenv('PCPwd')
-        params = dict(username=user, password=passwd, getauth=1)
-        self.url_base = os.getenv('PCHome')
+        params = dict(username=user, password=passwd, getauth=1, authexpire=AUTH_LIFETIME,
+                      authinactiveexpire=AUTH_LIFETIME)
         method = "userinfo"
         url = self.url_base + method
-        self.session = requests.Session()
-        r = self.session.get(url, params=params)
+        with get_metrics().call(method, url) as call:
+            r = self.session.get(url, params=params)
+            call.received = len(r.content)
+            if r.status_code != 200:
+                call.error = f"http_{r.status_code}"
+            else:
+                res = r.json()
+                call.error = res["result"] or None
         if r.status_code != 200:
             msg = "Could not connect to pcloud. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
             logging.critical(msg)
             raise SystemExit(msg)
+        if res["result"] != 0:
+            msg = "Could not log in to pcloud: {e}".format(e=res.get("error"))
+            logging.critical(msg)
+            raise SystemExit(msg)
         # Status Code OK, so successful login
-        res = r.json()
         self.auth = res["auth"]
+        self.save_auth(time.time() + AUTH_LIFETIME)
         usedquota = res["usedquota"]
         quota = res["quota"]
         pct = (usedquota / quota) * 100
         msg = "{pct:.2f}% used.".format(pct=pct)
         logging.info(msg)
 
+    def _request(self, method, errmsg, params=None, http='get', fatal=True, expected=(), **kwargs):
+        """
+        This method sends an API call with the auth token. If PCloud rejects the token, a new token is requested and
+        the call is sent again. When worker threads get the rejection at the same time, only the first one logs in.
+
+        :param method: PCloud API method.
+        :param errmsg: Message for a HTTP status that is not OK, e.g. 'Could not copy file'.
+        :param params: Dictionary with the call parameters.
+        :param http: HTTP method: get, post or put.
+        :param fatal: If True the script stops on a HTTP status that is not OK, otherwise the error is logged.
+        :param expected: Tuple of exception classes that are not counted as error in the metrics, the exception is
+        still raised.
+        :param kwargs: Additional arguments for the requests call (data, files).
+        :return: Result of the call (dictionary), or None if the HTTP status is not OK and fatal is False.
+        """
+        url = self.url_base + method
+        params = dict(params or {})
+        metrics = get_metrics()
+        for attempt in range(2):
+            auth = self.auth
+            params["auth"] = auth
+            with metrics.call(method, url, expected) as call:
+                call.sent = request_size(kwargs)
+                r = self.session.request(http, url, params=params, **kwargs)
+                call.received = len(r.content)
+                if r.status_code != 200:
+                    call.error = f"http_{r.status_code}"
+                else:
+                    res = r.json()
+                    call.error = res["result"] or None
+            if r.status_code != 200:
+                msg = "{m}. Status: {s}, reason: {reason}.".format(m=errmsg, s=r.status_code, reason=r.reason)
+                if fatal:
+                    logging.critical(msg)
+                    raise SystemExit(msg)
+                logging.error(msg)
+                return None
+            if res["result"] not in AUTH_ERRORS or attempt > 0:
+                return res
+            logging.info("Auth token rejected for {m}: {e}".format(m=method, e=res.get("error")))
+            metrics.retry(method, url, 'auth')
+            with self.auth_lock:
+                if self.auth == auth:
+                    self.login()
+            # Files are read again for the second attempt.
+            for file in kwargs.get('files', {}).values():
+                file[1].seek(0)
+        return res
+
     def get_contents(self):
         """
         This method will return the result of listfolder from root path (/) with recursive flag set, so full directory
@@ -44,36 +189,56 @@ class PcloudHandler:
         :return:
         """
         params = dict(path="/", recursive=1)
-        # params = dict(path="/")
-        method = "listfolder"
-        url = self.url_base + method
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not connect to pcloud. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
-            logging.critical(msg)
-            raise SystemExit(msg)
-        # Status Code OK, so successful login
-        res = r.json()
+        res = self._request("listfolder", "Could not connect to pcloud", params)
         return res["metadata"]
 
-    def copyfile(self, fileid, tofolderid):
+    def copyfile(self, fileid, tofolderid, toname=None):
         """
-        This method copies a file to a destination folder on PCloud.
+        This method copies a file to a destination folder on PCloud. The copy is done on the server, no file contents
+        are transferred.
 
         :param fileid: ID of the file to be copied.
         :param tofolderid: Target folder on PCloud.
-        :return:
+        :param toname: Name of the file in the target folder. Default: name of the source file.
+        :return: Result of the call, or None if the HTTP status is not OK.
         """
         params = dict(fileid=fileid, tofolderid=tofolderid)
-        method = "copyfile"
-        url = self.url_base + method
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not copy file. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
+        if toname:
+            params["toname"] = toname
+        return self._request("copyfile", "Could not copy file", params, fatal=False)
+
+    def createfolderifnotexists(self, path):
+        """
+        This method creates a folder on PCloud, if it does not exist yet. The parent folder must exist.
+
+        :param path: Full PCloud path of the folder.
+        :return: Folder ID of the (new or existing) folder.
+        """
+        params = dict(path=path)
+        res = self._request("createfolderifnotexists", "Could not create folder", params)
+        if res["result"] != 0:
+            msg = "Could not create folder {p}: {e}".format(p=path, e=res.get("error"))
             logging.critical(msg)
             raise SystemExit(msg)
-        # Status Code OK, so successful login
-        res = r.json()
+        return res["metadata"]["folderid"]
+
+    def checksumfile(self, fileid):
+        """
+        This method returns the checksums that PCloud calculated for the file contents. The PCloud 'hash' attribute
+        cannot be calculated locally, the sha1 checksum can.
+
+        :param fileid: PCloud FileId of the file.
+        :return: Dictionary with sha1 and (depending on the data region) md5 or sha256 checksum, or False if the
+        checksum is not available.
+        """
+        params = dict(fileid=fileid)
+        res = self._request("checksumfile", "Could not get checksum", params, fatal=False)
+        if res is None:
+            return False
+        if res["result"] != 0:
+            msg = "Could not get checksum for file {f}: {e}".format(f=fileid, e=res.get("error"))
+            logging.error(msg)
+            return False
         return res
 
     def get_fileinfo(self, fileid):
@@ -84,16 +249,7 @@ class PcloudHandler:
         :return:
         """
         params = dict(fileid=fileid)
-        method = "getfilelink"
-        url = self.url_base + method
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not get file link. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
-            logging.critical(msg)
-            raise SystemExit(msg)
-        # Status Code OK, so successful login
-        res = r.json()
-        return res
+        return self._request("getfilelink", "Could not get file link", params)
 
     def get_filelink(self, fileid):
         """
@@ -103,8 +259,10 @@ class PcloudHandler:
         :return: URL of the file with ID fileid
         """
         res = self.get_fileinfo(fileid)
-        url = f"https://{res['hosts'][0]}{res['path']}"
-        logging.debug(f"URL: {url}")
+        # Content hosts use the scheme of the API, https for PCloud, http for a local test server.
+        scheme = self.url_base.split('://')[0] if '://' in self.url_base else 'https'
+        url = f"{scheme}://{res['hosts'][0]}{res['path']}"
+        logging.debug("URL: %s", url)
         return url
 
     def downloadfile(self, url, path, target):
@@ -117,17 +275,7 @@ class PcloudHandler:
         :return:
         """
         params = dict(url=url, path=path, target=target)
-        # params = dict(url=url, target=target)
-        method = "downloadfile"
-        url = self.url_base + method
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not download file. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
-            logging.critical(msg)
-            raise SystemExit(msg)
-        # Status Code OK, so successful login
-        res = r.json()
-        return res
+        return self._request("downloadfile", "Could not download file", params)
 
     def listfolder(self, folderid):
         """
@@ -138,32 +286,189 @@ class PcloudHandler:
         """
         # Todo: merge method with get_contents method.
         params = dict(folderid=folderid)
-        method = "listfolder"
-        url = self.url_base + method
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not collect metadata. Status: {s}, reason: {reason}.".format(s=r.status_code, reason=r.reason)
-            logging.critical(msg)
-            raise SystemExit(msg)
-        # Status Code OK, so successful login
-        res = r.json()
-        return res
+        return self._request("listfolder", "Could not collect metadata", params)
 
-    def logout(self):
-        method = "logout"
-        url = self.url_base + method
-        params = dict(auth=self.auth)
-        r = self.session.get(url, params=params)
-        if r.status_code != 200:
-            msg = "Could not logout from pcloud. Status: {s}, reason: {rsn}.".format(s=r.status_code, rsn=r.reason)
+    def diff(self, diffid=None, block=False, timeout=None, fatal=True):
+        """
+        This method returns the changes on PCloud after diffid. With block set, the call waits until there are
+        changes (long poll). Without diffid only the most recent diffid is returned, use this before the inventory is
+        collected so that no change is missed.
+
+        :param diffid: Last diffid that has been handled, or None.
+        :param block: Wait for changes.
+        :param timeout: Seconds to wait for the answer, None to wait without limit.
+        :param fatal: If True the script stops when the changes are not available, otherwise the error is logged.
+        :return: Dictionary with diffid and the list of entries (event, time, diffid, metadata), or None if the
+        changes are not available and fatal is False.
+        """
+        import requests
+        params = dict(diffid=diffid) if diffid is not None else dict(last=0)
+        expected = ()
+        if block:
+            params["block"] = 1
+            # The long poll ends with a read timeout when there are no changes, that is not an error.
+            expected = (requests.exceptions.ReadTimeout,)
+        res = self._request("diff", "Could not get changes", params, fatal=fatal, expected=expected, timeout=timeout)
+        if res is None:
+            return None
+        if res["result"] != 0:
+            msg = "Could not get changes after {d}: {e}".format(d=diffid, e=res.get("error"))
+            if fatal:
+                logging.critical(msg)
+                raise SystemExit(msg)
             logging.error(msg)
-        else:
-            res = r.json()
-            if res["auth_deleted"]:
-                msg = "Logout as required"
+            return None
+        return res
+
+    def uploadfile(self, ffn, folderid, name, mtime=None):
+        """
+        This method uploads a (small) local file in a single request.
+
+        :param ffn: Full filename of the local file.
+        :param folderid: ID of the target folder on PCloud.
+        :param name: Filename on PCloud.
+        :param mtime: Modification time (epoch seconds) to set on PCloud, or None.
+        :return: Metadata of the uploaded file, or False if the upload failed.
+        """
+        params = dict(folderid=folderid, nopartial=1)
+        if mtime is not None:
+            params["mtime"] = int(mtime)
+        with open(ffn, 'rb') as fh:
+            res = self._request("uploadfile", "Could not upload file", params, http='post', fatal=False,
+                                files={'file': (name, fh)})
+        if res is None:
+            return False
+        if res["result"] != 0:
+            logging.error("Upload of {f} failed: {e}".format(f=ffn, e=res.get("error")))
+            return False
+        return res["metadata"][0]
+
+    def upload_create(self):
+        """
+        This method starts an upload session. Data is added with upload_write, upload_save creates the file.
+
+        :return: ID of the upload session, or None if the session could not be created.
+        """
+        res = self._request("upload_create", "Could not create upload", fatal=False)
+        if res is None:
+            return None
+        if res["result"] != 0:
+            logging.error("Could not create upload: {e}".format(e=res.get("error")))
+            return None
+        return res["uploadid"]
+
+    def upload_info(self, uploadid):
+        """
+        This method returns the status of an upload session.
+
+        :param uploadid: ID of the upload session.
+        :return: Dictionary with upload information, False if the upload session is not known (anymore) or None if
+        the status could not be requested.
+        """
+        params = dict(uploadid=uploadid)
+        res = self._request("upload_info", "Could not get upload info", params, fatal=False)
+        if res is None:
+            return None
+        if res["result"] != 0:
+            return False
+        return res
+
+    def upload_write(self, uploadid, offset, data):
+        """
+        This method writes a chunk of data at an offset in the upload session. Chunks can be written in any order and
+        concurrently.
+
+        :param uploadid: ID of the upload session.
+        :param offset: Position of the chunk in the file.
+        :param data: Chunk contents (bytes).
+        :return: True if the chunk has been written, False otherwise.
+        """
+        params = dict(uploadid=uploadid, uploadoffset=offset)
+        res = self._request("upload_write", "Could not write chunk", params, http='put', fatal=False, data=data)
+        if res is None:
+            return False
+        if res["result"] != 0:
+            logging.error("Could not write chunk at {o}: {e}".format(o=offset, e=res.get("error")))
+            return False
+        return True
+
+    def upload_save(self, uploadid, folderid, name, mtime=None):
+        """
+        This method creates the file from the data in the upload session.
+
+        :param uploadid: ID of the upload session.
+        :param folderid: ID of the target folder on PCloud.
+        :param name: Filename on PCloud.
+        :param mtime: Modification time (epoch seconds) to set on PCloud, or None.
+        :return: Metadata of the new file, or False if the file could not be saved.
+        """
+        params = dict(uploadid=uploadid, folderid=folderid, name=name)
+        if mtime is not None:
+            params["mtime"] = int(mtime)
+        res = self._request("upload_save", "Could not save upload", params, fatal=False)
+        if res is None:
+            return False
+        if res["result"] != 0:
+            logging.error("Could not save upload {u} as {n}: {e}".format(u=uploadid, n=name, e=res.get("error")))
+            return False
+        return res["metadata"]
+
+    def logout(self, forget=False):
+        """
+        This method closes the session. The auth token is kept for the next script, unless forget is set: then the
+        token is deleted on PCloud and the token file is removed.
+
+        :param forget: Delete the auth token.
+        :return:
+        """
+        if forget:
+            method = "logout"
+            url = self.url_base + method
+            params = dict(auth=self.auth)
+            r = self.session.get(url, params=params)
+            if r.status_code != 200:
+                msg = "Could not logout from pcloud. Status: {s}, reason: {rsn}.".format(s=r.status_code, rsn=r.reason)
+                logging.error(msg)
             else:
-                msg = "Logout not successful, status code: {status}".format(status=r.status_code)
-            logging.info(msg)
+                res = r.json()
+                if res.get("auth_deleted"):
+                    msg = "Logout as required"
+                else:
+                    msg = "Logout not successful, status code: {status}".format(status=r.status_code)
+                logging.info(msg)
+            try:
+                os.remove(self.auth_file)
+            except FileNotFoundError:
+                pass
+        self.session.close()
+
+
+def parse_date(pc_date):
+    """
+    This function converts a PCloud date string (e.g. 'Sat, 24 Oct 2020 16:14:43 +0000') to epoch seconds. The fixed
+    PCloud format is parsed directly, other formats are handled by the email date parser.
+
+    :param pc_date: Date as returned by PCloud.
+    :return: Epoch seconds (int).
+    """
+    try:
+        _, day, mon, year, hms, tz = pc_date.split()
+        hour, minute, sec = hms.split(':')
+        ts = calendar.timegm((int(year), MONTHS[mon], int(day), int(hour), int(minute), int(sec)))
+        offset = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+    except (ValueError, KeyError):
+        return int(parsedate_to_datetime(pc_date).timestamp())
+    return ts - offset if tz[0] == '+' else ts + offset
+
+
+def fmt_time(ts):
+    """
+    This function formats epoch seconds for reports.
+
+    :param ts: Epoch seconds.
+    :return: Local date and time as string.
+    """
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
 
 
 def convert_fn(fn, pcloud_root, local_root):
@@ -184,48 +489,154 @@ def convert_fn(fn, pcloud_root, local_root):
     # Compare without anchor
     fn_comp = fn_parts[1:]
     pcloud_comp = pcloud_parts[1:]
-    logging.debug(f"For File {fn} Compare Parts {fn_comp} with Root {pcloud_comp}")
     if (len(fn_comp) >= len(pcloud_comp)) and (fn_comp[0:len(pcloud_comp)] == pcloud_comp):
         fn_naked = fn_parts[len(pcloud_parts):]
         fn_newparts = local_parts + fn_naked
-        fn_new = Path(*fn_newparts)
-        logging.debug(f"Source: {fn} - Target: {fn_new}")
-        return str(fn_new)
+        fn_new = str(Path(*fn_newparts))
+        convert_log.debug("Source: %s - Target: %s", fn, fn_new)
+        return fn_new
     else:
         # logging.error(f"File {fn} is not in scope of PCloud {pcloud_root}")
         return False
 
 
-def get_file(url, ffn):
+def local2pcloud(fn, local_root, pcloud_root):
+    """
+    This function is the reverse of convert_fn: it accepts a local filename and returns the PCloud filename.
+
+    :param fn: Filename (or directory name) on the local target.
+    :param local_root: Local root directory.
+    :param pcloud_root: PCloud root directory.
+    :return: Filename on PCloud as a string, or False if the file is not in scope of local_root.
+    """
+    try:
+        rel = Path(fn).relative_to(local_root)
+    except ValueError:
+        return False
+    return str(PurePosixPath(pcloud_root).joinpath(*rel.parts))
+
+
+def compare_trees(source_tree, target_tree, quick=False):
+    """
+    This function compares a source tree with a target tree. Both trees are dictionaries with the same keys for the
+    same item (see item2key and get_local_contents).
+
+    :param source_tree: Dictionary of the source directories and files.
+    :param target_tree: Dictionary of the target directories and files.
+    :param quick: If True, a file is modified if size or modification time are different (quick check). Otherwise
+    only the size is compared.
+    :return: Tuple with lists of new items (not on target), modified items (other size or mtime on target) and removed
+    items (only on target).
+    """
+    new_items = []
+    modified_items = []
+    removed_items = []
+    for k in source_tree:
+        if k in target_tree:
+            source = source_tree[k]
+            if 'size' in source:
+                target = target_tree[k]
+                if source['size'] != target.get('size') or (quick and source['modified'] != target['modified']):
+                    modified_items.append(k)
+        else:
+            new_items.append(k)
+    for k in target_tree:
+        if k not in source_tree:
+            removed_items.append(k)
+    return new_items, modified_items, removed_items
+
+
+def request_size(kwargs):
+    """
+    This function returns the number of bytes that a call sends, for the metrics.
+
+    :param kwargs: Additional arguments for the requests call (data, files).
+    :return: Number of bytes in data and files.
+    """
+    size = len(kwargs['data']) if kwargs.get('data') else 0
+    for file in kwargs.get('files', {}).values():
+        size += os.fstat(file[1].fileno()).st_size
+    return size
+
+
+def get_file(url, ffn, mtime=None, progress=None):
     """
     This function gets a file from URL url and keeps it on location in ffn.
 
     :param url: URL where to get the file.
     :param ffn:
-    :return: True if file has been downloaded, False otherwise
+    :param mtime: Modification time (epoch seconds) of the file on PCloud, set as local modification time.
+    :param progress: my_env.Progress object, the downloaded bytes are reported to it. None for no progress.
+    :return: Nothing, an OSError (requests exception) is raised if the file could not be downloaded.
     """
+    import requests
     ffn_obj = Path(ffn)
     ffn_path = ffn_obj.parent
     fn = ffn_obj.name
     logging.info(f"Get path: {ffn_path} - File: {fn}")
     ffn_path.mkdir(parents=True, exist_ok=True)
-    with open(ffn, 'wb') as handle:
-        r = requests.get(url, stream=True)
-        if r.status_code != 200:
-            msg = f"Could not get file link. Status: {r.status_code}, reason: {r.reason}."
-            logging.critical(msg)
-            raise SystemExit(msg)
-        # Chunk size should be at least 1MB, to avoid switching getting content and writing to disk.
-        for block in r.iter_content(chunk_size=1024 * 1024):
-            if not block:
-                break
-            handle.write(block)
+    # Download to a temporary file, then replace the target. An existing target can be a hardlink to another file,
+    # which must not be overwritten.
+    ffn_tmp = f"{ffn}.part"
+    try:
+        with open(ffn_tmp, 'wb') as handle, get_metrics().call('download', url) as call:
+            r = requests.get(url, stream=True)
+            if r.status_code != 200:
+                # HTTPError is an OSError, the caller handles it as a failed download (e.g. an expired link).
+                call.error = f"http_{r.status_code}"
+                msg = f"Could not download file {url}. Status: {r.status_code}, reason: {r.reason}."
+                raise requests.exceptions.HTTPError(msg, response=r)
+            # Chunk size should be at least 1MB, to avoid switching getting content and writing to disk.
+            for block in r.iter_content(chunk_size=1024 * 1024):
+                if not block:
+                    break
+                handle.write(block)
+                call.received += len(block)
+                if progress:
+                    progress.update(len(block))
+        if mtime is not None:
+            os.utime(ffn_tmp, (mtime, mtime))
+        os.replace(ffn_tmp, ffn)
+    except BaseException:
+        # A partial download would show up as an extra local file in the next compare.
+        try:
+            os.remove(ffn_tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def walk_contents(path, contents):
+    """
+    This function walks a PCloud inventory tree and returns one tuple per item. The tree is walked with a stack, so
+    deep trees do not hit the recursion limit.
+
+    :param path: PCloud path of the folder with the contents.
+    :param contents: List of items as returned by listfolder with recursive flag.
+    :return: Generator of tuples (path, isfolder, fileid, folderid, size, hash, contenttype, created, modified).
+    """
+    stack = [(path, contents)]
+    while stack:
+        path, contents = stack.pop()
+        # Same result as PurePosixPath(path).joinpath(name), without creating a path object per item.
+        prefix = path.rstrip('/')
+        for item in contents:
+            fn = f"{prefix}/{item['name']}"
+            created = parse_date(item['created'])
+            modified = parse_date(item['modified'])
+            if item['isfolder']:
+                yield fn, 1, None, item['folderid'], None, None, None, created, modified
+                stack.append((fn, item['contents']))
+            else:
+                yield (fn, 0, item['fileid'], None, item['size'], str(item['hash']), item.get('contenttype'),
+                       created, modified)
 
 
 def item2key(pcloud_dict, path, contents, parent_dir=None, local_dir=None):
     """
     Recursive function to reduce the PCloud inventory and convert the directories and files in scope into a dictionary.
     Files are added as keys to the dictionary, Directories are further explored by calling this function again.
+    PCloud created and modified dates are converted to epoch seconds here, once.
 
     :param pcloud_dict: Dictionary containing Directories and Files in scope for the sync process. The dictionary is
     created in the recursive process.
@@ -248,16 +659,16 @@ def item2key(pcloud_dict, path, contents, parent_dir=None, local_dir=None):
                 pcloud_dict[key] = dict(
                     fn=fn,
                     isfolder=item['isfolder'],
-                    created=item['created'],
-                    modified=item['modified']
+                    created=parse_date(item['created']),
+                    modified=parse_date(item['modified'])
                 )
             item2key(pcloud_dict, fn, item['contents'], parent_dir, local_dir)
         elif key:
             pcloud_dict[key] = dict(
                 fn=fn,
                 isfolder=item['isfolder'],
-                created=item['created'],
-                modified=item['modified'],
+                created=parse_date(item['created']),
+                modified=parse_date(item['modified']),
                 fileid=item['fileid'],
                 size=item['size'],
                 hash=item['hash'],
@@ -268,7 +679,8 @@ def item2key(pcloud_dict, path, contents, parent_dir=None, local_dir=None):
 
 def get_local_contents(local_path):
     """
-    This function collects directories and files on the local device.
+    This function collects directories and files on the local device. Modification time is in epoch seconds, same as
+    the PCloud dates in item2key.
 
     :param local_path: Root folder of the local path.
     :return: Dictionary to keep directories and files on local device.
@@ -277,14 +689,14 @@ def get_local_contents(local_path):
     for root, dirs, files in os.walk(local_path):
         local_dict[root] = dict(
             isfolder=True,
-            modified=datetime.datetime.fromtimestamp(int(os.path.getmtime(root))).strftime("%Y-%m-%d %H:%M:%S")
+            modified=int(os.path.getmtime(root))
         )
         for file in files:
             key = os.path.join(root, file)
+            st = os.stat(key)
             local_dict[key] = dict(
                 isfolder=False,
-                size=os.path.getsize(os.path.join(root, file)),
-                modified=datetime.datetime.fromtimestamp(int(os.path.getmtime(os.path.join(root, file))))
-                .strftime("%Y-%m-%d %H:%M:%S")
+                size=st.st_size,
+                modified=int(st.st_mtime)
             )
     return local_dict
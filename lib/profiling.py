@@ -0,0 +1,147 @@
+"""
+This module adds the --profile option to the scripts. With --profile the run is profiled with cProfile (main thread
+only) and tracemalloc. The pstats dump is written to LOGDIR/profile, the functions with the highest cumulative time,
+the memory peak and the top allocation sites are written to the log. Load the dump with pstats or snakeviz for
+details.
+Scripts mark their phases (load snapshot, flatten, local scan, diff, report, transfer) with phase(). The wall-clock
+time of each phase is logged, also without --profile.
+"""
+
+import contextlib
+import logging
+import os
+import time
+
+# Profiler of the running script, phases add memory information when profiling is on.
+_profiler = None
+
+
+def add_argument(parser):
+    """
+    This function adds the --profile option to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile the run: cProfile dump in LOGDIR/profile, memory peak, top allocation sites and '
+                             'phase timings in the log.')
+
+
+def run(main, args):
+    """
+    This function runs the main function of a script, profiled if the profile option is set.
+
+    :param main: Main function of the script.
+    :param args: Parsed command line arguments.
+    :return: Result of main.
+    """
+    profiler = Profiler(getattr(args, 'profile', False))
+    try:
+        return main(args)
+    finally:
+        profiler.stop()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    This function times a phase of a script, as context manager.
+
+    :param name: Name of the phase, e.g. local scan.
+    :return:
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        logging.info("Phase {p} done in {t:.1f} seconds".format(p=name, t=seconds))
+        if _profiler:
+            _profiler.phase_done(name, seconds)
+
+
+class Profiler:
+    """
+    This class profiles a run between start (on initialization) and stop. When not enabled, it does nothing.
+    """
+
+    def __init__(self, enabled, top=25):
+        """
+        Start profiling.
+
+        :param enabled: Profile the run.
+        :param top: Number of functions and allocation sites in the log.
+        """
+        global _profiler
+        self.enabled = enabled
+        if not enabled:
+            return
+        import cProfile
+        import tracemalloc
+        self.top = top
+        self.phases = []
+        self.snapshot = None
+        self.snapshot_size = 0
+        self.snapshot_phase = None
+        self.started = time.perf_counter()
+        tracemalloc.start()
+        self.profile = cProfile.Profile()
+        _profiler = self
+        self.profile.enable()
+
+    def phase_done(self, name, seconds):
+        """
+        Record the memory at the end of a phase. The allocation sites are taken at the end of the phase with the most
+        memory in use, that is where the large structures are.
+
+        :param name: Name of the phase.
+        :param seconds: Wall-clock time of the phase.
+        :return:
+        """
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        self.phases.append((name, seconds, current, peak))
+        if current > self.snapshot_size:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+            self.snapshot_phase = name
+
+    def stop(self):
+        """
+        Stop profiling, write the pstats dump and log the results.
+
+        :return:
+        """
+        global _profiler
+        if not self.enabled:
+            return
+        import io
+        import pstats
+        import tracemalloc
+        from datetime import datetime
+        from lib.metrics import script_name
+        self.profile.disable()
+        _profiler = None
+        elapsed = time.perf_counter() - self.started
+        _, peak = tracemalloc.get_traced_memory()
+        if self.snapshot is None:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_phase = 'end'
+        tracemalloc.stop()
+        profile_dir = os.path.join(os.getenv('LOGDIR') or '.', 'profile')
+        os.makedirs(profile_dir, exist_ok=True)
+        ffn = os.path.join(profile_dir, f"{script_name()}_{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+        self.profile.dump_stats(ffn)
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+        logging.info(f"Profile of {elapsed:.1f} seconds written to {ffn}\n{stream.getvalue()}")
+        logging.info(f"Memory peak {peak / 1024 / 1024:.1f} MB (tracemalloc)")
+        for name, seconds, current, phase_peak in self.phases:
+            logging.info(f"Phase {name}: {seconds:.1f} seconds, {current / 1024 / 1024:.1f} MB in use at the end, "
+                         f"peak so far {phase_peak / 1024 / 1024:.1f} MB")
+        lines = [f"Top allocation sites at the end of phase {self.snapshot_phase}:"]
+        for stat in self.snapshot.statistics('lineno')[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"  {frame.filename}:{frame.lineno}: {stat.size / 1024 / 1024:.1f} MB in {stat.count} blocks")
+        logging.info('\n'.join(lines))
@@ -0,0 +1,157 @@
+"""
+This module finds content that is already available on PCloud, so that it can be copied on the server (copyfile)
+instead of being transferred again. The PCloud inventory is indexed on (hash, size) and on size.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import PurePosixPath
+
+
+class RemoteIndex:
+    """
+    This class indexes the files and folders of a PCloud inventory (result of listfolder with recursive flag).
+    """
+
+    def __init__(self, pcloud_contents):
+        """
+        Walk the inventory and build the indexes.
+
+        :param pcloud_contents: Inventory as returned by PcloudHandler.get_contents or read from the inventory file.
+        """
+        self.by_hash = {}
+        self.by_size = {}
+        self.folders = {}
+        root = pcloud_contents.get('path', '/')
+        self.folders[root] = pcloud_contents.get('folderid', 0)
+        stack = [(root, pcloud_contents['contents'])]
+        while stack:
+            path, contents = stack.pop()
+            for item in contents:
+                fn = str(PurePosixPath(path).joinpath(item['name']))
+                if item['isfolder']:
+                    self.folders[fn] = item['folderid']
+                    stack.append((fn, item['contents']))
+                else:
+                    self.by_hash.setdefault((item['hash'], item['size']), item['fileid'])
+                    self.by_size.setdefault(item['size'], []).append(item['fileid'])
+
+    def lookup(self, pc_hash, size):
+        """
+        Find a PCloud file with hash and size.
+
+        :param pc_hash: PCloud hash of the file.
+        :param size: Size of the file.
+        :return: fileid of a file with the same contents, or None.
+        """
+        return self.by_hash.get((pc_hash, size))
+
+    def lookup_sha1(self, pc, size, sha1, checksum_cache=None):
+        """
+        Find a PCloud file with size and sha1 checksum. This is used for local files, since the PCloud hash cannot be
+        calculated locally. The PCloud checksum is only requested for files with the same size.
+
+        :param pc: PcloudHandler object.
+        :param size: Size of the file.
+        :param sha1: sha1 checksum of the file.
+        :param checksum_cache: Dictionary fileid -> sha1 to remember PCloud checksums, or None.
+        :return: fileid of a file with the same contents, or None.
+        """
+        if checksum_cache is None:
+            checksum_cache = {}
+        for fileid in self.by_size.get(size, []):
+            try:
+                remote_sha1 = checksum_cache[fileid]
+            except KeyError:
+                res = pc.checksumfile(fileid)
+                remote_sha1 = res['sha1'] if res else None
+                checksum_cache[fileid] = remote_sha1
+            if remote_sha1 == sha1:
+                return fileid
+        return None
+
+
+def plan_copies(wanted, index):
+    """
+    This function splits a list of wanted files in files that can be copied on PCloud and files that need a transfer.
+
+    :param wanted: List of dictionaries with keys path (target PCloud path), size and hash (PCloud hash).
+    :param index: RemoteIndex of the current inventory.
+    :return: Tuple (copies, missing). Copies is a list of dictionaries with keys fileid, path and size. Missing is the
+    list of wanted items that are not available on PCloud.
+    """
+    copies = []
+    missing = []
+    for item in wanted:
+        fileid = index.lookup(item['hash'], item['size'])
+        if fileid:
+            copies.append(dict(fileid=fileid, path=item['path'], size=item['size']))
+        else:
+            missing.append(item)
+    return copies, missing
+
+
+def get_folderid(pc, index, path):
+    """
+    This function returns the folder ID for a PCloud path. Folders that are not in the index are created, parent
+    folders first.
+
+    :param pc: PcloudHandler object.
+    :param index: RemoteIndex, the folders dictionary is updated with new folders.
+    :param path: PCloud folder path.
+    :return: folderid
+    """
+    try:
+        return index.folders[path]
+    except KeyError:
+        pass
+    parent = str(PurePosixPath(path).parent)
+    if parent != path:
+        get_folderid(pc, index, parent)
+    folderid = pc.createfolderifnotexists(path)
+    index.folders[path] = folderid
+    return folderid
+
+
+def copy_files(pc, copies, index, workers=8, batch_size=200, callback=None):
+    """
+    This function executes the server side copies. Target folders are created first, then the copyfile calls are
+    sent in batches with a number of concurrent calls.
+
+    :param pc: PcloudHandler object.
+    :param copies: List of copies as returned by plan_copies.
+    :param index: RemoteIndex, used to find or create the target folders.
+    :param workers: Number of concurrent copyfile calls.
+    :param batch_size: Number of copies submitted per batch.
+    :param callback: Function called with (copy, True / False) when a copy is done or failed, or None.
+    :return: Tuple (number of files copied, bytes not transferred, list of failed copies).
+    """
+    # Folder creation depends on the parent, so do this sequentially before the copies start.
+    for copy in copies:
+        copy['folderid'] = get_folderid(pc, index, str(PurePosixPath(copy['path']).parent))
+    copied = 0
+    saved = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(copies), batch_size):
+            batch = copies[start:start + batch_size]
+            futures = {executor.submit(pc.copyfile, copy['fileid'], copy['folderid'],
+                                       PurePosixPath(copy['path']).name): copy for copy in batch}
+            for future in as_completed(futures):
+                copy = futures[future]
+                try:
+                    res = future.result() or dict(error='HTTP error')
+                except Exception as e:
+                    # Includes network errors, the other copies continue.
+                    res = dict(error=str(e))
+                ok = res.get('result') == 0
+                if ok:
+                    copied += 1
+                    saved += copy['size']
+                else:
+                    logging.error(f"Copy of file {copy['fileid']} to {copy['path']} failed: {res.get('error')}")
+                    failed.append(copy)
+                if callback:
+                    callback(copy, ok)
+            logging.info(f"{start + len(batch)} of {len(copies)} copies handled, {saved} bytes not transferred.")
+    return copied, saved, failed
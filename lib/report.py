@@ -0,0 +1,176 @@
+"""
+This module writes the change reports. Rows are written to disk as they come, so a report with hundreds of thousands
+of rows does not need to be built in memory first. Large sections are split over pages, the first page of each section
+is in the main report file with links to the next pages. The same rows can be written to csv and json files for
+further processing.
+A small summary with a limited number of rows per section is kept for the mail, the full report can be attached as a
+zip archive.
+"""
+
+import csv
+import html
+import json
+import os
+import zipfile
+
+TABLE_START = '<table border="1" cellpadding="4">'
+
+
+class ReportWriter:
+    """
+    This class writes a report with sections. Each section is a table with a header and rows.
+    """
+
+    def __init__(self, ffn, page_size=5000, summary_rows=50, formats=('html',)):
+        """
+        Open the report files.
+
+        :param ffn: Full filename of the main html report. The csv, json and page files are written next to it.
+        :param page_size: Maximum number of rows per section on a html page.
+        :param summary_rows: Maximum number of rows per section in the summary.
+        :param formats: Formats to write: html, csv and / or json.
+        """
+        self.ffn = ffn
+        self.base = os.path.splitext(ffn)[0]
+        self.page_size = page_size
+        self.summary_rows = summary_rows
+        self.files = [ffn]
+        self.summary = []
+        self.section_cnt = 0
+        self.fh = open(ffn, 'w', encoding='utf-8')
+        self.fh.write('<html><body>')
+        self.csv_fh = None
+        self.csv_writer = None
+        self.json_fh = None
+        if 'csv' in formats:
+            self.files.append(f"{self.base}.csv")
+            self.csv_fh = open(f"{self.base}.csv", 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.writer(self.csv_fh)
+        if 'json' in formats:
+            self.files.append(f"{self.base}.json")
+            self.json_fh = open(f"{self.base}.json", 'w', encoding='utf-8')
+            self.json_fh.write('{"sections": [')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def section(self, title, header, rows, count=None):
+        """
+        Write a section. Rows are consumed one by one from the iterable.
+
+        :param title: Title of the section. The number of rows is added if count is given.
+        :param header: List of column names.
+        :param rows: Iterable of rows, each row a list of values.
+        :param count: Number of rows in the section, or None if not known.
+        :return: Number of rows written.
+        """
+        self.section_cnt += 1
+        heading = f"{title}: {count} items" if count is not None else title
+        header_html = '<tr>' + ''.join(f'<th>{html.escape(str(col))}</th>' for col in header) + '</tr>'
+        self.fh.write(f'<h3>{html.escape(heading)}</h3>{TABLE_START}{header_html}')
+        if self.json_fh:
+            if self.section_cnt > 1:
+                self.json_fh.write(', ')
+            self.json_fh.write(f'{{"title": {json.dumps(title)}, "header": {json.dumps(header)}, "rows": [')
+        summary = []
+        page_fh = self.fh
+        page_nr = 1
+        rows_written = 0
+        for row in rows:
+            if rows_written and rows_written % self.page_size == 0:
+                page_nr += 1
+                page_fh = self._next_page(page_fh, heading, header_html, page_nr)
+            line = '<tr>' + ''.join(f'<td>{html.escape(str(value))}</td>' for value in row) + '</tr>'
+            page_fh.write(line)
+            if len(summary) < self.summary_rows:
+                summary.append(line)
+            if self.csv_writer:
+                self.csv_writer.writerow([title] + list(row))
+            if self.json_fh:
+                self.json_fh.write((', ' if rows_written else '') + json.dumps(list(row), default=str))
+            rows_written += 1
+        page_fh.write('</table>')
+        if page_fh is not self.fh:
+            page_fh.write('</body></html>')
+            page_fh.close()
+            # Close the list of page links in the main report.
+            self.fh.write('</p>')
+        if self.json_fh:
+            self.json_fh.write(']}')
+        self.summary.append((heading, header_html, summary, rows_written))
+        return rows_written
+
+    def _next_page(self, page_fh, heading, header_html, page_nr):
+        """
+        Close the current page of a section and open the next page. The main report has links to all pages.
+
+        :return: File handle of the new page.
+        """
+        page_ffn = f"{self.base}_{self.section_cnt}_{page_nr}.html"
+        page_name = os.path.basename(page_ffn)
+        if page_fh is self.fh:
+            self.fh.write('</table><p>More pages: ')
+        else:
+            page_fh.write(f'</table><p><a href="{page_name}">Next page</a></p></body></html>')
+            page_fh.close()
+        self.fh.write(f'<a href="{page_name}">{page_nr}</a> ')
+        self.files.append(page_ffn)
+        page_fh = open(page_ffn, 'w', encoding='utf-8')
+        page_fh.write(f'<html><body><h3>{html.escape(heading)} - page {page_nr}</h3>{TABLE_START}{header_html}')
+        return page_fh
+
+    def close(self):
+        """
+        Close the report files.
+
+        :return:
+        """
+        if self.fh.closed:
+            return
+        self.fh.write('</body></html>')
+        self.fh.close()
+        if self.csv_fh:
+            self.csv_fh.close()
+        if self.json_fh:
+            self.json_fh.write(']}')
+            self.json_fh.close()
+
+    def summary_html(self):
+        """
+        Return the summary of the report: all section titles with at most summary_rows rows per section.
+
+        :return: html string.
+        """
+        parts = []
+        for heading, header_html, rows, count in self.summary:
+            parts.append(f'<h3>{html.escape(heading)}</h3>{TABLE_START}{header_html}')
+            parts.extend(rows)
+            parts.append('</table>')
+            if count > len(rows):
+                parts.append(f'<p>... and {count - len(rows)} more, see attached report.</p>')
+        return ''.join(parts)
+
+    def truncated(self):
+        """
+        Check if the summary is missing rows of the report.
+
+        :return: True if at least one section has more rows than the summary.
+        """
+        return any(count > len(rows) for _, _, rows, count in self.summary)
+
+    def archive(self, zip_ffn=None):
+        """
+        Compress all report files in a zip archive.
+
+        :param zip_ffn: Filename of the archive. Default: report filename with extension zip.
+        :return: Filename of the archive.
+        """
+        self.close()
+        zip_ffn = zip_ffn or f"{self.base}.zip"
+        with zipfile.ZipFile(zip_ffn, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for ffn in self.files:
+                zf.write(ffn, arcname=os.path.basename(ffn))
+        return zip_ffn
@@ -0,0 +1,97 @@
+"""
+This module rolls up the changes of a report section by directory. When a complete folder tree appears or disappears,
+the folder is reported on one line with the number of items and bytes in the subtree, instead of one line per file.
+Files are listed individually only where the number of changes in a subtree is below the threshold.
+"""
+
+from pathlib import PurePosixPath
+
+
+class Rollup:
+    """
+    This class collects the counts and bytes per directory subtree in one pass over the changed items.
+    """
+
+    def __init__(self, items, tree, threshold):
+        """
+        Aggregate the changed items.
+
+        :param items: Keys of the changed items (PCloud paths, str or PurePosixPath as from merkle.diff).
+        :param tree: Dictionary with the item information (see item2key), for isfolder and size.
+        :param threshold: Subtrees with at least this number of changed items are candidates for a rollup line.
+        """
+        self.tree = tree
+        self.threshold = threshold
+        # Changed items by path, to the key in tree. Directories are compared as paths, the keys can be strings.
+        self.changed = {PurePosixPath(k): k for k in items}
+        # Per directory: [items in subtree, bytes in subtree]
+        self.totals = {}
+        self.children = {}
+        self.direct = {}
+        for k in items:
+            path = PurePosixPath(k)
+            size = tree[k].get('size', 0)
+            parent = path.parent
+            self.direct.setdefault(parent, []).append(k)
+            child = path
+            for ancestor in path.parents:
+                totals = self.totals.setdefault(ancestor, [0, 0])
+                totals[0] += 1
+                totals[1] += size
+                if child != path:
+                    self.children.setdefault(ancestor, set()).add(child)
+                child = ancestor
+        self.root = PurePosixPath(items[0]).parents[-1] if items else None
+
+    def rows(self):
+        """
+        Generate the report lines, top-down from the root. A line is a tuple (path, number of items, bytes, rollup).
+        For a rollup line path is the folder name, otherwise path is the key of the changed item.
+
+        :return: Generator of report lines.
+        """
+        if self.root is None:
+            return
+        yield from self._visit(self.root)
+
+    def _visit(self, folder):
+        """
+        Generate the lines for a directory.
+
+        :param folder: Directory (PurePosixPath).
+        :return: Generator of report lines.
+        """
+        count, size = self.totals[folder]
+        # The parent leaves the folder key to this directory, see direct below.
+        folder_key = self.changed.get(folder)
+        if count < self.threshold:
+            if folder_key is not None:
+                yield folder_key, 1, self.tree[folder_key].get('size', 0), False
+            yield from self._files(folder)
+            return
+        if folder_key is not None:
+            # The folder itself is new or removed, so the complete subtree is. The line counts the folder too.
+            yield str(folder), count + 1, size, True
+            return
+        for child in sorted(self.children.get(folder, [])):
+            if child in self.totals:
+                yield from self._visit(child)
+        direct = [k for k in self.direct.get(folder, []) if PurePosixPath(k) not in self.totals]
+        if len(direct) >= self.threshold:
+            yield f"{folder} (files in folder)", len(direct), sum(self.tree[k].get('size', 0) for k in direct), True
+        else:
+            for k in sorted(direct, key=str):
+                yield k, 1, self.tree[k].get('size', 0), False
+
+    def _files(self, folder):
+        """
+        Generate one line per changed item in the subtree of a directory.
+
+        :param folder: Directory (PurePosixPath).
+        :return: Generator of report lines.
+        """
+        for k in sorted(self.direct.get(folder, []), key=str):
+            yield k, 1, self.tree[k].get('size', 0), False
+        for child in sorted(self.children.get(folder, [])):
+            if child in self.totals:
+                yield from self._files(child)
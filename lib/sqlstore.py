@@ -0,0 +1,326 @@
+"""
+This module keeps PCloud inventories (observations) in a sqlite database. It replaces the ORM based store in retired,
+that flushed and refreshed every directory and was too slow for large inventories.
+A snapshot is ingested in one transaction with batched executemany calls. Every item has its full path, so two
+observations can be compared with joins on the (observation_id, path) index instead of walking directories.
+"""
+
+import logging
+import sqlite3
+from lib.pcloud_handler import parse_date, walk_contents
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    remark TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    observation_id INTEGER NOT NULL REFERENCES observations(id),
+    path TEXT NOT NULL,
+    isfolder INTEGER NOT NULL,
+    fileid INTEGER,
+    folderid INTEGER,
+    size INTEGER,
+    hash TEXT,
+    contenttype TEXT,
+    created INTEGER,
+    modified INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS items_obs_path ON items (observation_id, path);
+CREATE INDEX IF NOT EXISTS items_fileid ON items (fileid);
+CREATE INDEX IF NOT EXISTS items_hash ON items (hash);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    fileid INTEGER,
+    size INTEGER,
+    hash TEXT,
+    modified INTEGER,
+    first_obs INTEGER NOT NULL REFERENCES observations(id),
+    last_obs INTEGER NOT NULL REFERENCES observations(id)
+);
+CREATE INDEX IF NOT EXISTS versions_path ON versions (path, last_obs);
+CREATE INDEX IF NOT EXISTS versions_fileid ON versions (fileid);
+CREATE INDEX IF NOT EXISTS versions_last_obs ON versions (last_obs);
+CREATE TABLE IF NOT EXISTS history_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    observation_id INTEGER NOT NULL REFERENCES observations(id)
+);
+"""
+
+# A file version is still current if path, fileid, size, hash and modified are the same in the new observation.
+EXTEND_VERSIONS = """
+UPDATE versions SET last_obs = :obs_id
+WHERE last_obs = :prev_obs
+  AND EXISTS (SELECT 1 FROM items i WHERE i.observation_id = :obs_id AND i.path = versions.path AND i.isfolder = 0
+              AND i.fileid IS versions.fileid AND i.size IS versions.size AND i.hash IS versions.hash
+              AND i.modified IS versions.modified)
+"""
+
+ADD_VERSIONS = """
+INSERT INTO versions (path, fileid, size, hash, modified, first_obs, last_obs)
+SELECT i.path, i.fileid, i.size, i.hash, i.modified, :obs_id, :obs_id FROM items i
+WHERE i.observation_id = :obs_id AND i.isfolder = 0
+  AND NOT EXISTS (SELECT 1 FROM versions v WHERE v.path = i.path AND v.last_obs = :obs_id)
+"""
+
+VERSION_QUERY = """
+SELECT v.path, v.fileid, v.size, v.hash, v.modified, f.timestamp AS first_seen, l.timestamp AS last_seen,
+       v.first_obs, v.last_obs
+FROM versions v JOIN observations f ON f.id = v.first_obs JOIN observations l ON l.id = v.last_obs
+"""
+
+# Issue categories of a comparison, same text as in the retired compare scripts.
+NEW = "New"
+DIR_NOT_FOUND = "Directory not found"
+FILE_NOT_FOUND = "File not found"
+SIZE_NOT_OK = "File size not ok"
+
+INSERT_ITEM = """
+INSERT INTO items (observation_id, path, isfolder, fileid, folderid, size, hash, contenttype, created, modified)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def subtree_range(path):
+    """
+    This function returns the bounds for the paths below a directory. '0' is the character after '/', so the range
+    condition path > 'dir/' AND path < 'dir0' selects the subtree and can use the path index, unlike LIKE 'dir/%'.
+
+    :param path: Directory path.
+    :return: Tuple (lower bound, upper bound).
+    """
+    prefix = path.rstrip('/')
+    return f"{prefix}/", f"{prefix}0"
+
+
+def collapse(rows, folder_issue, file_issue):
+    """
+    This function reports a missing directory once, items in the directory are not reported. The rows are
+    (path, isfolder) of missing items, sorted on path.
+
+    :param rows: Iterable of (path, isfolder).
+    :param folder_issue: Issue category for a directory.
+    :param file_issue: Issue category for a file.
+    :return: Generator of (issue, path).
+    """
+    reported = set()
+    for path, isfolder in rows:
+        parent = path
+        while parent:
+            parent = parent[:parent.rfind('/')]
+            if parent in reported:
+                break
+        else:
+            if isfolder:
+                reported.add(path)
+                yield folder_issue, path
+            else:
+                yield file_issue, path
+
+
+class SqlStore:
+    """
+    This class handles the inventory database.
+    """
+
+    def __init__(self, db):
+        """
+        Open the database and create the tables and indexes if needed. The database is in WAL mode, so reports can read
+        while a snapshot is ingested.
+
+        :param db: Filename of the sqlite database.
+        """
+        self.db = db
+        self.conn = sqlite3.connect(db)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode a commit is durable after the next checkpoint, which is enough for an inventory.
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def ingest(self, pcloud_contents, timestamp, remark="PCloud Inventory", batch_size=10000, history=True):
+        """
+        This method adds an inventory as a new observation. All rows are inserted in one transaction, in batches of
+        batch_size rows.
+
+        :param pcloud_contents: Inventory as returned by PcloudHandler.get_contents.
+        :param timestamp: Timestamp of the inventory, format YYYY-MM-DD HH:MM:SS.
+        :param remark: Description of the observation.
+        :param batch_size: Number of rows per executemany call.
+        :param history: Update the file version history with the new observation. Observations must be ingested in
+        chronological order for the history.
+        :return: ID of the new observation.
+        """
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO observations (timestamp, remark) VALUES (?, ?)", (timestamp, remark))
+            obs_id = cur.lastrowid
+            root = pcloud_contents.get('path', '/')
+            created = parse_date(pcloud_contents['created']) if 'created' in pcloud_contents else None
+            modified = parse_date(pcloud_contents['modified']) if 'modified' in pcloud_contents else None
+            batch = [(obs_id, root, 1, None, pcloud_contents.get('folderid', 0), None, None, None, created, modified)]
+            cnt = 0
+            for row in walk_contents(root, pcloud_contents['contents']):
+                batch.append((obs_id,) + row)
+                if len(batch) >= batch_size:
+                    self.conn.executemany(INSERT_ITEM, batch)
+                    cnt += len(batch)
+                    batch = []
+            self.conn.executemany(INSERT_ITEM, batch)
+            cnt += len(batch)
+            if history:
+                self.update_history(obs_id)
+        logging.info(f"Observation {obs_id} with {cnt} items added to {self.db}")
+        return obs_id
+
+    def update_history(self, obs_id):
+        """
+        This method adds an observation to the file version history. A version that is the same in the new
+        observation is extended, a new or changed file gets a new version. A version that is not extended ends with
+        the previous observation: the file was changed or removed after that. Only the new observation and the
+        versions of the previous observation are read, so the cost does not grow with the number of observations.
+        The caller handles the transaction.
+
+        :param obs_id: ID of the observation, more recent than all observations in the history.
+        :return:
+        """
+        prev_obs = self.last_history_obs()
+        params = dict(obs_id=obs_id, prev_obs=prev_obs)
+        if prev_obs is not None:
+            self.conn.execute(EXTEND_VERSIONS, params)
+        self.conn.execute(ADD_VERSIONS, params)
+        self.conn.execute("INSERT INTO history_log (observation_id) VALUES (?)", (obs_id,))
+
+    def rebuild_history(self):
+        """
+        This method creates the file version history from all observations, oldest first. Use this for a database
+        with observations from before the history.
+
+        :return: Number of versions.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM versions")
+            self.conn.execute("DELETE FROM history_log")
+            obs_ids = [row[0] for row in self.conn.execute("SELECT id FROM observations ORDER BY timestamp, id")]
+            for obs_id in obs_ids:
+                self.update_history(obs_id)
+        cnt = self.conn.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+        logging.info(f"File history with {cnt} versions created from {len(obs_ids)} observations.")
+        return cnt
+
+    def history(self, path=None, fileid=None):
+        """
+        This method returns the versions of a file, by path or by PCloud fileid. A fileid stays the same when a file
+        is moved or renamed, so the fileid history shows the paths of a file.
+
+        :param path: PCloud path of the file.
+        :param fileid: PCloud fileid.
+        :return: List of rows (path, fileid, size, hash, modified, first_seen, last_seen, first_obs, last_obs),
+        most recent first.
+        """
+        if path is not None:
+            query = f"{VERSION_QUERY} WHERE v.path = ? ORDER BY f.timestamp DESC, v.id DESC"
+            return self.conn.execute(query, (path,)).fetchall()
+        query = f"{VERSION_QUERY} WHERE v.fileid = ? ORDER BY f.timestamp DESC, v.id DESC"
+        return self.conn.execute(query, (fileid,)).fetchall()
+
+    def last_history_obs(self):
+        """
+        This method returns the most recent observation in the history.
+
+        :return: Observation ID, or None if the history is empty.
+        """
+        row = self.conn.execute("SELECT observation_id FROM history_log ORDER BY seq DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def observations(self, remark="PCloud Inventory", limit=2):
+        """
+        This method returns the most recent observations.
+
+        :param remark: Description of the observations.
+        :param limit: Maximum number of observations.
+        :return: List of rows (id, timestamp, remark), youngest first.
+        """
+        query = ("SELECT id, timestamp, remark FROM observations WHERE remark = ? "
+                 "ORDER BY timestamp DESC, id DESC LIMIT ?")
+        return self.conn.execute(query, (remark, limit)).fetchall()
+
+    def get_item(self, obs_id, path):
+        """
+        This method returns an item of an observation.
+
+        :param obs_id: ID of the observation.
+        :param path: PCloud path of the item.
+        :return: Row with the item, or None if the path is not in the observation.
+        """
+        query = "SELECT * FROM items WHERE observation_id = ? AND path = ?"
+        return self.conn.execute(query, (obs_id, path)).fetchone()
+
+    def find_hash(self, pc_hash, obs_id=None):
+        """
+        This method returns the items with a PCloud hash.
+
+        :param pc_hash: PCloud hash.
+        :param obs_id: ID of the observation, or None for all observations.
+        :return: List of rows.
+        """
+        if obs_id is None:
+            return self.conn.execute("SELECT * FROM items WHERE hash = ?", (str(pc_hash),)).fetchall()
+        query = "SELECT * FROM items WHERE hash = ? AND observation_id = ?"
+        return self.conn.execute(query, (str(pc_hash), obs_id)).fetchall()
+
+    def compare(self, src_obs, src_dir, tgt_obs, tgt_dir, new=True):
+        """
+        This method compares a directory in a source observation with a directory in a target observation. Every item
+        in source should be in target, files with the same size. Each category is one query: the source subtree is
+        joined with the target subtree on the relative path, using the (observation_id, path) index. The result is
+        streamed from the cursor, it is not collected in memory.
+
+        :param src_obs: ID of the source observation.
+        :param src_dir: Source directory.
+        :param tgt_obs: ID of the target observation.
+        :param tgt_dir: Target directory.
+        :param new: Report items in target that are not in source as well.
+        :return: Generator of (issue, path). Path is the source path, for new items the target path.
+        """
+        src_low, src_high = subtree_range(src_dir)
+        tgt_low, tgt_high = subtree_range(tgt_dir)
+        src_len = len(src_low)
+        tgt_len = len(tgt_low)
+        query = """
+            SELECT s.path, s.isfolder FROM items s
+            WHERE s.observation_id = :src_obs AND s.path > :src_low AND s.path < :src_high
+              AND NOT EXISTS (SELECT 1 FROM items t WHERE t.observation_id = :tgt_obs
+                              AND t.path = :tgt_low || substr(s.path, :src_len + 1))
+            ORDER BY s.path
+        """
+        params = dict(src_obs=src_obs, src_low=src_low, src_high=src_high, src_len=src_len, tgt_obs=tgt_obs,
+                      tgt_low=tgt_low, tgt_high=tgt_high, tgt_len=tgt_len)
+        yield from collapse(self.conn.execute(query, params), DIR_NOT_FOUND, FILE_NOT_FOUND)
+        query = """
+            SELECT s.path FROM items s JOIN items t
+              ON t.observation_id = :tgt_obs AND t.path = :tgt_low || substr(s.path, :src_len + 1)
+            WHERE s.observation_id = :src_obs AND s.path > :src_low AND s.path < :src_high
+              AND s.isfolder = 0 AND t.size IS NOT s.size
+            ORDER BY s.path
+        """
+        for (path,) in self.conn.execute(query, params):
+            yield SIZE_NOT_OK, path
+        if new:
+            query = """
+                SELECT t.path, t.isfolder FROM items t
+                WHERE t.observation_id = :tgt_obs AND t.path > :tgt_low AND t.path < :tgt_high
+                  AND NOT EXISTS (SELECT 1 FROM items s WHERE s.observation_id = :src_obs
+                                  AND s.path = :src_low || substr(t.path, :tgt_len + 1))
+                ORDER BY t.path
+            """
+            yield from collapse(self.conn.execute(query, params), NEW, NEW)
+
+    def close(self):
+        """
+        Close the database.
+
+        :return:
+        """
+        self.conn.close()
@@ -0,0 +1,197 @@
+"""
+This module estimates what a sync will cost before it runs: the number of files and bytes, by size class, the files
+that can be created without a transfer (local dedupe on download, server side copy on upload) and the duration.
+The duration comes from the measured runs of the same direction. Each run adds its number of transferred files and
+bytes and the time spent in these transfers to the throughput history, and the estimate fits a time per file and a
+bandwidth to recent runs. Dedupes, server side copies and folders are not timed, they are not in the counts either.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from lib.my_env import fmt_bytes
+
+# Upper bounds of the size classes in bytes, None for no upper bound.
+SIZE_CLASSES = ((1000000, '< 1 MB'), (100000000, '1 MB - 100 MB'), (1000000000, '100 MB - 1 GB'), (None, '>= 1 GB'))
+# Number of runs per direction in the history.
+HISTORY_RUNS = 20
+
+
+def size_class(size):
+    """
+    This function returns the size class of a file.
+
+    :param size: Size of the file in bytes.
+    :return: Label of the size class.
+    """
+    for bound, label in SIZE_CLASSES:
+        if bound is None or size < bound:
+            return label
+
+
+def summarize(direction, meta, plan, dedupe):
+    """
+    This function counts the files and bytes of a sync plan. Files with the same size as a file on the other side
+    are candidates for a local dedupe (download) or a server side copy (upload). Whether the contents are the same is
+    only known when the checksums are compared during the run, so the candidates are an upper bound of the savings.
+
+    :param direction: download or upload.
+    :param meta: Meta of the plan, from plan_download or plan_upload.
+    :param plan: Plan items, from plan_download or plan_upload.
+    :param dedupe: Dedupe mode, no candidates if off.
+    :return: Dictionary with the counts.
+    """
+    by_size = {size for size, _ in meta['by_size']} if dedupe != 'off' else set()
+    summary = dict(direction=direction, folders=0, files=0, bytes=0, mtime_only=0, mtime_only_bytes=0,
+                   candidates=0, candidate_bytes=0, size_classes={label: [0, 0] for _, label in SIZE_CLASSES})
+    for item in plan:
+        if item['isfolder']:
+            summary['folders'] += 1
+            continue
+        size = item['size']
+        summary['files'] += 1
+        summary['bytes'] += size
+        size_cnt = summary['size_classes'][size_class(size)]
+        size_cnt[0] += 1
+        size_cnt[1] += size
+        if direction == 'download' and dedupe != 'off' and item['local_size'] == size:
+            # Same size, only the modification time is different (quick check): set from PCloud if contents match.
+            summary['mtime_only'] += 1
+            summary['mtime_only_bytes'] += size
+        elif size > 0 and size in by_size:
+            summary['candidates'] += 1
+            summary['candidate_bytes'] += size
+    return summary
+
+
+class ThroughputHistory:
+    """
+    This class keeps the measured sync runs per direction: transferred files and bytes and transfer seconds.
+    """
+
+    def __init__(self, history_file):
+        """
+        Load the history.
+
+        :param history_file: Json file with the history.
+        """
+        self.history_file = history_file
+        self.runs = {}
+        try:
+            with open(history_file) as fh:
+                self.runs = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read throughput history {history_file}: {e}")
+
+    def add(self, direction, files, nbytes, seconds):
+        """
+        Add a run and save the history. Runs without transfers are not added.
+
+        :param direction: download or upload.
+        :param files: Number of files transferred.
+        :param nbytes: Number of bytes transferred.
+        :param seconds: Time spent in the transfers.
+        :return:
+        """
+        if files == 0:
+            return
+        runs = self.runs.setdefault(direction, [])
+        runs.append(dict(end=round(time.time()), files=files, bytes=nbytes, seconds=round(seconds, 3)))
+        del runs[:-HISTORY_RUNS]
+        tmp = f"{self.history_file}.tmp"
+        try:
+            with open(tmp, 'w') as fh:
+                json.dump(self.runs, fh)
+            os.replace(tmp, self.history_file)
+        except OSError as e:
+            logging.error(f"Could not write throughput history {self.history_file}: {e}")
+
+    def model(self, direction):
+        """
+        Fit seconds = files * seconds_per_file + bytes / bytes_per_second to the recent runs (least squares). With
+        too few or too similar runs only the bandwidth is fitted.
+
+        :param direction: download or upload.
+        :return: Tuple (seconds per file, seconds per byte, number of runs), or None if there are no runs.
+        """
+        runs = self.runs.get(direction, [])
+        if not runs:
+            return None
+        sff = sum(r['files'] * r['files'] for r in runs)
+        sfb = sum(r['files'] * r['bytes'] for r in runs)
+        sbb = sum(r['bytes'] * r['bytes'] for r in runs)
+        sfs = sum(r['files'] * r['seconds'] for r in runs)
+        sbs = sum(r['bytes'] * r['seconds'] for r in runs)
+        det = sff * sbb - sfb * sfb
+        if det > 1e-9 * sff * sbb:
+            per_file = (sfs * sbb - sbs * sfb) / det
+            per_byte = (sff * sbs - sfb * sfs) / det
+            if per_file >= 0 and per_byte >= 0:
+                return per_file, per_byte, len(runs)
+        seconds = sum(r['seconds'] for r in runs)
+        nbytes = sum(r['bytes'] for r in runs)
+        if nbytes:
+            return 0, seconds / nbytes, len(runs)
+        return seconds / sum(r['files'] for r in runs), 0, len(runs)
+
+    def estimate(self, direction, files, nbytes):
+        """
+        Estimate the duration of a transfer.
+
+        :param direction: download or upload.
+        :param files: Number of files to transfer.
+        :param nbytes: Number of bytes to transfer.
+        :return: Seconds, or None if there are no measured runs.
+        """
+        model = self.model(direction)
+        if model is None:
+            return None
+        per_file, per_byte, _ = model
+        return files * per_file + nbytes * per_byte
+
+
+def report_rows(summary, history):
+    """
+    This function returns the rows of the transfer plan section of the sync report.
+
+    :param summary: Counts of the plan, from summarize.
+    :param history: ThroughputHistory.
+    :return: List of rows [plan, files, bytes, size, duration].
+    """
+    direction = summary['direction']
+
+    def duration(files, nbytes):
+        seconds = history.estimate(direction, files, nbytes)
+        return str(timedelta(seconds=round(seconds))) if seconds is not None else 'unknown'
+
+    rows = [['Folders to create', summary['folders'], '', '', ''],
+            ['Files', summary['files'], summary['bytes'], fmt_bytes(summary['bytes']), '']]
+    for label, (cnt, nbytes) in summary['size_classes'].items():
+        rows.append([f"Files {label}", cnt, nbytes, fmt_bytes(nbytes), ''])
+    if direction == 'download':
+        rows.append(['Modification time only (candidates)', summary['mtime_only'], summary['mtime_only_bytes'],
+                     fmt_bytes(summary['mtime_only_bytes']), ''])
+        rows.append(['Local dedupe (candidates)', summary['candidates'], summary['candidate_bytes'],
+                     fmt_bytes(summary['candidate_bytes']), ''])
+    else:
+        rows.append(['Server side copy (candidates)', summary['candidates'], summary['candidate_bytes'],
+                     fmt_bytes(summary['candidate_bytes']), ''])
+    min_files = summary['files'] - summary['mtime_only'] - summary['candidates']
+    min_bytes = summary['bytes'] - summary['mtime_only_bytes'] - summary['candidate_bytes']
+    rows.append(['Transfer if all candidates match', min_files, min_bytes, fmt_bytes(min_bytes),
+                 duration(min_files, min_bytes)])
+    rows.append(['Transfer if no candidate matches', summary['files'], summary['bytes'], fmt_bytes(summary['bytes']),
+                 duration(summary['files'], summary['bytes'])])
+    model = history.model(direction)
+    if model:
+        per_file, per_byte, runs = model
+        bandwidth = f"{fmt_bytes(1 / per_byte)}/s" if per_byte else 'no bytes'
+        rows.append([f"Estimate from {runs} recent {direction} runs: {bandwidth}, {per_file:.3f} seconds per file",
+                     '', '', '', ''])
+    else:
+        rows.append([f"No measured {direction} runs yet, run a sync to estimate the duration", '', '', '', ''])
+    return rows
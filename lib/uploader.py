@@ -0,0 +1,193 @@
+"""
+This module uploads local files to PCloud. Small files are uploaded with a single uploadfile call, with a number of
+files uploaded concurrently. Large files are sent in an upload session (upload_create, upload_write, upload_save) with
+several chunks in flight. The state of every upload session is kept on disk, so an interrupted upload of a large file
+continues with the chunks that were not written yet.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lib.remote_dedupe import get_folderid
+from pathlib import PurePosixPath
+
+# Files of at least this size are uploaded in chunks.
+CHUNK_THRESHOLD = 32 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ChunkedUpload:
+    """
+    This class handles the upload of one large file in an upload session. The session state (uploadid and written
+    chunks) is kept in a json file in the state directory.
+    """
+
+    def __init__(self, pc, ffn, state_dir, chunk_size=CHUNK_SIZE):
+        """
+        Find the upload state for this file. An upload session is reused if the file did not change since the
+        session was created and PCloud still knows the session. The state remains None if PCloud cannot be asked,
+        then run fails for this file and the state file is kept for the next run.
+
+        :param pc: PcloudHandler object.
+        :param ffn: Full filename of the local file.
+        :param state_dir: Directory for the upload state files.
+        :param chunk_size: Size of a chunk.
+        """
+        self.pc = pc
+        self.ffn = ffn
+        st = os.stat(ffn)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.chunk_size = chunk_size
+        key = hashlib.sha1(os.path.abspath(ffn).encode('utf-8')).hexdigest()
+        self.state_file = os.path.join(state_dir, f"{key}.json")
+        self.state = None
+        try:
+            with open(self.state_file, 'r') as fh:
+                state = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        else:
+            if (state['size'], state['mtime_ns'], state['chunk_size']) == (self.size, self.mtime_ns, chunk_size):
+                info = pc.upload_info(state['uploadid'])
+                if info is None:
+                    return
+                if info:
+                    logging.info(f"Resume upload of {ffn}: {len(state['done'])} chunks already written.")
+                    self.state = state
+        if not self.state:
+            uploadid = pc.upload_create()
+            if uploadid is None:
+                return
+            self.state = dict(uploadid=uploadid, size=self.size, mtime_ns=self.mtime_ns, chunk_size=chunk_size,
+                              done=[])
+            self.save_state()
+
+    def save_state(self):
+        """
+        Write the upload state to disk.
+
+        :return:
+        """
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp, self.state_file)
+
+    def write_chunk(self, fd, offset):
+        """
+        Read a chunk from the file and write it to the upload session.
+
+        :param fd: File descriptor of the local file.
+        :param offset: Position of the chunk.
+        :return: True if the chunk is written.
+        """
+        data = os.pread(fd, self.chunk_size, offset)
+        return self.pc.upload_write(self.state['uploadid'], offset, data)
+
+    def run(self, folderid, name, workers=4):
+        """
+        Write all missing chunks with workers chunks in flight, then save the file on PCloud.
+
+        :param folderid: Target folder ID on PCloud.
+        :param name: Filename on PCloud.
+        :param workers: Number of chunks in flight.
+        :return: Metadata of the new file, or False if the upload is not complete.
+        """
+        if self.state is None:
+            logging.error(f"No upload session for {self.ffn}, run again to resume.")
+            return False
+        done = set(self.state['done'])
+        todo = [offset for offset in range(0, self.size, self.chunk_size) if offset not in done]
+        fd = os.open(self.ffn, os.O_RDONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self.write_chunk, fd, offset): offset for offset in todo}
+                for future in as_completed(futures):
+                    try:
+                        written = future.result()
+                    except Exception as e:
+                        # Includes network errors, the chunk is written again on the next run.
+                        logging.error(f"Could not write chunk at {futures[future]} of {self.ffn}: {e}")
+                        continue
+                    if written:
+                        self.state['done'].append(futures[future])
+                        self.save_state()
+        finally:
+            os.close(fd)
+        if len(self.state['done']) * self.chunk_size < self.size:
+            logging.error(f"Upload of {self.ffn} not complete, run again to resume.")
+            return False
+        res = self.pc.upload_save(self.state['uploadid'], folderid, name, mtime=self.mtime_ns // 1000000000)
+        if res:
+            os.remove(self.state_file)
+        return res
+
+
+def upload_files(pc, uploads, index, state_dir, workers=8, chunk_workers=4, chunk_threshold=CHUNK_THRESHOLD,
+                 chunk_size=CHUNK_SIZE, callback=None):
+    """
+    This function uploads a list of files to PCloud. Small files are uploaded concurrently, large files are uploaded
+    one by one, each with several chunks in flight.
+
+    :param pc: PcloudHandler object.
+    :param uploads: List of dictionaries with keys ffn (local file), path (PCloud path) and size.
+    :param index: RemoteIndex to find or create the target folders.
+    :param state_dir: Directory for the upload session state files.
+    :param workers: Number of concurrent small file uploads.
+    :param chunk_workers: Number of chunks in flight for a large file.
+    :param chunk_threshold: Files of at least this size are uploaded in chunks.
+    :param chunk_size: Size of a chunk.
+    :param callback: Function called with (upload, True / False) when an upload is done or failed, or None.
+    :return: Tuple (number of files uploaded, bytes uploaded, list of failed uploads).
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    for upload in uploads:
+        upload['folderid'] = get_folderid(pc, index, str(PurePosixPath(upload['path']).parent))
+    small = [u for u in uploads if u['size'] < chunk_threshold]
+    large = [u for u in uploads if u['size'] >= chunk_threshold]
+    uploaded = 0
+    uploaded_bytes = 0
+    failed = []
+
+    def upload_small(upload):
+        # In the worker: a file that disappeared since the plan fails this upload only.
+        mtime = int(os.path.getmtime(upload['ffn']))
+        return pc.uploadfile(upload['ffn'], upload['folderid'], PurePosixPath(upload['path']).name, mtime)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(upload_small, u): u for u in small}
+        for future in as_completed(futures):
+            upload = futures[future]
+            try:
+                ok = bool(future.result())
+            except Exception as e:
+                # Includes network errors, the other uploads continue.
+                logging.error(f"Upload of {upload['ffn']} failed: {e}")
+                ok = False
+            if ok:
+                uploaded += 1
+                uploaded_bytes += upload['size']
+                logging.info(f"File {upload['ffn']} uploaded to {upload['path']}")
+            else:
+                failed.append(upload)
+            if callback:
+                callback(upload, ok)
+    for upload in large:
+        try:
+            chunked = ChunkedUpload(pc, upload['ffn'], state_dir, chunk_size=chunk_size)
+            ok = bool(chunked.run(upload['folderid'], PurePosixPath(upload['path']).name, workers=chunk_workers))
+        except Exception as e:
+            logging.error(f"Upload of {upload['ffn']} failed: {e}")
+            ok = False
+        if ok:
+            uploaded += 1
+            uploaded_bytes += upload['size']
+            logging.info(f"File {upload['ffn']} uploaded to {upload['path']} in chunks")
+        else:
+            failed.append(upload)
+        if callback:
+            callback(upload, ok)
+    return uploaded, uploaded_bytes, failed
@@ -0,0 +1,111 @@
+"""
+This module verifies the contents of the local target against PCloud. Sync only compares size, so a corrupted local
+file or a same-size edit is not noticed. Verify compares the sha1 checksum of the local file with the sha1 checksum
+that PCloud keeps for the file.
+Local checksums come from the LocalIndex cache, PCloud checksums are kept in a cache with the PCloud hash.
+On later runs only changed files are hashed again and only changed PCloud files are requested again.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RemoteChecksums:
+    """
+    This class keeps the sha1 checksums of PCloud files by fileid. The PCloud hash changes when the file contents
+    change, so a cached checksum is valid as long as the hash of the file is the same.
+    """
+
+    def __init__(self, cache_file=None):
+        """
+        Load the checksum cache.
+
+        :param cache_file: Json file to keep the PCloud checksums between runs. No cache if None.
+        """
+        self.cache_file = cache_file
+        self.cache = {}
+        if cache_file:
+            try:
+                with open(cache_file, 'r') as fh:
+                    self.cache = json.load(fh)
+            except (FileNotFoundError, json.JSONDecodeError):
+                logging.info(f"No usable checksum cache {cache_file}, starting a new one.")
+
+    def get_all(self, pc, files, workers=8):
+        """
+        This method returns the PCloud checksums for a list of files. Checksums that are not in the cache are requested
+        concurrently.
+
+        :param pc: PcloudHandler object.
+        :param files: List of dictionaries with keys fileid and hash.
+        :param workers: Number of concurrent checksumfile calls.
+        :return: Dictionary fileid -> sha1 (False if PCloud did not return a checksum).
+        """
+        result = {}
+        todo = []
+        for item in files:
+            cached = self.cache.get(str(item['fileid']))
+            if cached and cached[0] == item['hash']:
+                result[item['fileid']] = cached[1]
+            else:
+                todo.append(item)
+        if todo:
+            logging.info(f"{len(result)} PCloud checksums from cache, {len(todo)} to request.")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for item, res in zip(todo, executor.map(lambda i: pc.checksumfile(i['fileid']), todo)):
+                    if res:
+                        result[item['fileid']] = res['sha1']
+                        self.cache[str(item['fileid'])] = [item['hash'], res['sha1']]
+                    else:
+                        result[item['fileid']] = False
+        return result
+
+    def save(self):
+        """
+        Write the checksum cache to disk.
+
+        :return:
+        """
+        if not self.cache_file:
+            return
+        tmp = f"{self.cache_file}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(self.cache, fh)
+        os.replace(tmp, self.cache_file)
+
+
+def verify(pc, pcloud_tree, local_tree, local_index, remote_checksums, workers=8, processes=None):
+    """
+    This function compares the checksums of the files that are on PCloud and on the local target with the same size.
+    Files with a different size are reported by the sync compare already.
+
+    :param pc: PcloudHandler object.
+    :param pcloud_tree: Dictionary of PCloud items, key is the local filename (see item2key).
+    :param local_tree: Dictionary of local items (see get_local_contents).
+    :param local_index: LocalIndex with the local checksum cache.
+    :param remote_checksums: RemoteChecksums with the PCloud checksum cache.
+    :param workers: Number of concurrent checksumfile calls.
+    :param processes: Number of processes to hash local files, default the number of CPUs.
+    :return: Tuple (number of files verified, list of files with a checksum mismatch, list of files that could not
+    be verified)
+    """
+    in_scope = [k for k, v in pcloud_tree.items()
+                if not v['isfolder'] and k in local_tree and local_tree[k].get('size') == v['size']]
+    logging.info(f"{len(in_scope)} files in scope for verification.")
+    local_sums = local_index.checksum_all(in_scope, workers=processes)
+    remote_sums = remote_checksums.get_all(pc, [pcloud_tree[k] for k in in_scope], workers=workers)
+    mismatches = []
+    unverified = []
+    for k in in_scope:
+        local_sum = local_sums[k]
+        remote_sum = remote_sums[pcloud_tree[k]['fileid']]
+        if not (local_sum and remote_sum):
+            unverified.append(k)
+        elif local_sum != remote_sum:
+            logging.error(f"Checksum mismatch for {k}: local {local_sum}, PCloud {remote_sum}")
+            mismatches.append(k)
+    remote_checksums.save()
+    local_index.save()
+    return len(in_scope) - len(unverified), mismatches, unverified
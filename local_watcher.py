@@ -0,0 +1,82 @@
+#!/opt/envs/pcloud/bin/python3
+"""
+This script watches local sync targets with inotify (Linux) and keeps their state files up to date, so sync_dirs
+does not need to scan the targets. Run it as a service, e.g. with a systemd user unit. The state is written every few
+seconds when there are changes, and immediately when a sync asks for it.
+"""
+
+import argparse
+import logging
+import os
+import selectors
+import signal
+import time
+from lib import my_env, profiling
+from lib.local_watch import LocalWatcher, state_file
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for watch to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-t', '--target_dirs', type=str, nargs='+', required=True,
+                        help='Local target directories to watch, same as the target directory of the sync.')
+    parser.add_argument('-i', '--interval', type=float, required=False, default=5,
+                        help='Seconds between writes of the state file when there are changes.')
+
+
+def main(args):
+    """
+    This function watches the targets until the process is stopped (SIGTERM or Ctrl-C).
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Start application")
+    fp = os.getenv('DATADIR')
+    flags = dict(save=False, stop=False)
+
+    def request_save(signum, frame):
+        flags['save'] = True
+
+    def request_stop(signum, frame):
+        flags['stop'] = True
+
+    signal.signal(signal.SIGUSR1, request_save)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    selector = selectors.DefaultSelector()
+    watchers = []
+    for target_dir in args.target_dirs:
+        watcher = LocalWatcher(target_dir, state_file(fp, target_dir))
+        watcher.save()
+        selector.register(watcher.inotify.fd, selectors.EVENT_READ, watcher)
+        watchers.append(watcher)
+    last_save = time.time()
+    while not flags['stop']:
+        for key, _ in selector.select(timeout=0.5):
+            key.data.process_events()
+        if flags['save'] or time.time() - last_save > args.interval:
+            for watcher in watchers:
+                # Events that arrived before the request must be in the state.
+                watcher.process_events()
+                if watcher.dirty or flags['save']:
+                    watcher.save()
+            flags['save'] = False
+            last_save = time.time()
+    for watcher in watchers:
+        watcher.close()
+    logging.info("End application")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Watch local sync targets and keep their state up to date."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
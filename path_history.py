@@ -0,0 +1,64 @@
+#!/opt/envs/pcloud/bin/python3
+"""
+This script shows the version history of a PCloud file from the sqlite inventory database: when did the file change
+and what was it before. The history is updated when an inventory is added to the database (inventory --stores sqlite),
+use --rebuild once for a database with older observations.
+"""
+
+import argparse
+import logging
+import os
+from lib import my_env, profiling
+from lib.pcloud_handler import fmt_time
+from lib.sqlstore import SqlStore
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for history to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('path', type=str, nargs='?',
+                        help='PCloud path of the file.')
+    parser.add_argument('-f', '--fileid', type=int, required=False,
+                        help='PCloud file ID, shows the paths of a file that has been moved or renamed.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Create the history from all observations in the database.')
+
+
+def main(args):
+    """
+    This function prints the history for the command line arguments.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    store = SqlStore(os.getenv('DB'))
+    if args.rebuild:
+        store.rebuild_history()
+    if args.path is None and args.fileid is None:
+        store.close()
+        return
+    versions = store.history(path=args.path, fileid=args.fileid)
+    last_obs = store.last_history_obs()
+    store.close()
+    if not versions:
+        print(f"No history for {args.path or args.fileid}.")
+        return
+    for version in versions:
+        state = 'current' if version['last_obs'] == last_obs else f"last seen {version['last_seen']}"
+        print(f"{version['first_seen']} - {state}: {version['path']} fileid {version['fileid']}, "
+              f"size {version['size']}, hash {version['hash']}, modified {fmt_time(version['modified'])}")
+    logging.debug(f"{len(versions)} versions for {args.path or args.fileid}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the version history of a PCloud file."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
@@ -0,0 +1,66 @@
+#!/opt/envs/pcloud/bin/python3
+"""
+This script is the single entry point for the PCloud scripts: pcloud <command> [arguments].
+Only the module of the selected command is imported, so a simple lookup does not pay for the imports of the sync or
+the mail modules. Each command module has an add_arguments(parser) and a main(args) function.
+"""
+
+import argparse
+import importlib
+import sys
+from lib import profiling
+
+# Command name: (module, description)
+COMMANDS = dict(
+    inventory=("get_pcloud_inventory", "Collect the PCloud inventory in a json file."),
+    analyze=("analyze_pcloud_file", "Compare the two most recent PCloud inventories and mail the changes."),
+    compare=("compare_observations", "Compare two observations in the sqlite inventory database."),
+    history=("path_history", "Show the version history of a PCloud file."),
+    sync=("sync_dirs", "Compare and synchronize a PCloud directory and a local directory."),
+    daemon=("sync_daemon", "Keep local targets in sync with PCloud directories, using PCloud change notifications."),
+    watch=("local_watcher", "Watch local sync targets with inotify and keep their state up to date."),
+    link=("tools.get_link_file", "Get the download link of a file."),
+    folder=("tools.get_folder_data", "Get folder information."),
+    copy=("tools.copy_tree", "Copy a PCloud folder tree on the server, also from an older inventory."),
+)
+
+
+def get_parser():
+    """
+    This function returns the top level parser. The arguments of the command are not parsed here, so the help for
+    all commands is available without importing the command modules.
+
+    :return: argparse parser.
+    """
+    epilog = "Commands:\n" + "\n".join(f"  {name:<10} {description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="pcloud",
+        description="PCloud inventory, analyze and sync commands.",
+        epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', type=str, choices=COMMANDS.keys(), metavar='command',
+                        help='Command to run, see below.')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER,
+                        help='Arguments for the command, use pcloud <command> -h for help.')
+    return parser
+
+
+def main(argv=None):
+    """
+    This function parses the command, imports the command module and runs the command.
+
+    :param argv: Command line arguments, default sys.argv.
+    :return:
+    """
+    args = get_parser().parse_args(argv)
+    module_name, description = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    parser = argparse.ArgumentParser(prog=f"pcloud {args.command}", description=description)
+    module.add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(module.main, parser.parse_args(args.arguments))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
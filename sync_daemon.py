@@ -0,0 +1,194 @@
+#!/opt/envs/pcloud/bin/python3
+"""
+This script runs as a daemon and keeps local targets in sync with PCloud directories (download). It lists PCloud and
+the local targets once at start, then waits for changes with the blocking PCloud diff call and downloads new and
+modified files within seconds. The session, the trees and the connections stay in memory between changes.
+As for sync_dirs, local files are not removed when they are removed on PCloud.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import time
+from lib import my_env, pcloud_handler, profiling
+from lib.journal import SyncJournal, journal_dir, FAILED
+from lib.live_sync import LiveTree, SyncPair, DELETE_EVENTS
+from lib.local_watch import local_contents
+from lib.metrics import get_metrics
+from sync_dirs import plan_download, run_download
+
+# Seconds to wait after a failure, doubled for every failure in a row up to the maximum.
+BACKOFF_START = 5
+BACKOFF_MAX = 300
+
+
+def load_pairs(pc, fp, pair_dirs):
+    """
+    This function lists PCloud and the local targets and returns the trees for the sync pairs. The diffid is taken
+    before the listing, so changes during the listing are handled by the next diff call.
+
+    :param pc: PcloudHandler object.
+    :param fp: Data directory.
+    :param pair_dirs: List of (PCloud directory, local directory).
+    :return: Tuple (diffid, LiveTree, list of SyncPair).
+    """
+    diffid = pc.diff()["diffid"]
+    pcloud_contents = pc.get_contents()
+    live = LiveTree(pcloud_contents)
+    pairs = []
+    for source_dir, target_dir in pair_dirs:
+        pcloud_tree = {}
+        pcloud_handler.item2key(pcloud_tree, pcloud_contents['path'], pcloud_contents['contents'], source_dir,
+                                target_dir)
+        pair = SyncPair(source_dir, target_dir, pcloud_tree, local_contents(target_dir, fp))
+        new_items, modified_items, _ = pcloud_handler.compare_trees(pair.pcloud_tree, pair.local_tree)
+        pair.pending.update(new_items + modified_items)
+        logging.info(f"{source_dir} -> {target_dir}: {len(pair.pending)} items to sync.")
+        pairs.append(pair)
+    return diffid, live, pairs
+
+
+def sync_pending(pc, fp, pair, dedupe):
+    """
+    This function downloads the pending items of a sync pair, through the sync journal. Failed items stay pending.
+
+    :param pc: PcloudHandler object.
+    :param fp: Data directory.
+    :param pair: SyncPair.
+    :param dedupe: Dedupe mode (off, copy, hardlink, reflink).
+    :return:
+    """
+    # Parents first, so folders exist before their files are downloaded.
+    keys = sorted(pair.pending)
+    meta, plan = plan_download(keys, pair.pcloud_tree, pair.local_tree)
+    meta.update(direction='download', source_dir=pair.source_dir, target_dir=pair.target_dir)
+    journal = SyncJournal(journal_dir(fp, 'daemon', pair.source_dir, pair.target_dir))
+    journal.create(meta, plan)
+    try:
+        run_download(pc, fp, journal, dedupe)
+        pair.pending = {item['key'] for idx, item in enumerate(journal.items) if journal.states[idx] == FAILED}
+    finally:
+        journal.close()
+        pair.refresh_local(keys)
+
+
+def backoff(flags, seconds):
+    """
+    This function waits after a failure, until the wait time is over or a stop is requested.
+
+    :param flags: Dictionary with the stop flag.
+    :param seconds: Wait time of the previous failure, 0 if the previous call was successful.
+    :return: Wait time of this failure.
+    """
+    seconds = min(seconds * 2, BACKOFF_MAX) if seconds else BACKOFF_START
+    logging.info(f"Retry in {seconds} seconds.")
+    end = time.monotonic() + seconds
+    while not flags['stop'] and time.monotonic() < end:
+        time.sleep(min(1, end - time.monotonic()))
+    return seconds
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for the daemon to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-p', '--pair', type=str, nargs=2, action='append', required=True,
+                        metavar=('SOURCE_DIR', 'TARGET_DIR'),
+                        help='PCloud source directory and local target directory. Repeat for more pairs.')
+    parser.add_argument('-d', '--dedupe', type=str, required=False, default='reflink',
+                        choices=['off', 'copy', 'hardlink', 'reflink'],
+                        help='Create new files from identical local files instead of downloading them.')
+    parser.add_argument('--timeout', type=int, required=False, default=60,
+                        help='Seconds to wait for changes in one diff call. The daemon stops within this time.')
+
+
+def main(args):
+    """
+    This function runs the daemon until SIGTERM or Ctrl-C.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    # Imported here as in the other commands, only for the timeout of the long poll.
+    import requests
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Start application")
+    logging.info("Arguments: {a}".format(a=args))
+    fp = os.getenv('DATADIR')
+    flags = dict(stop=False)
+
+    def request_stop(signum, frame):
+        flags['stop'] = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    pc = pcloud_handler.get_handler()
+    diffid, live, pairs = load_pairs(pc, fp, args.pair)
+    wait = 0
+    try:
+        while not flags['stop']:
+            try:
+                for pair in pairs:
+                    if pair.pending:
+                        sync_pending(pc, fp, pair, args.dedupe)
+                # The daemon does not end, the metrics are written once per diff call for the node exporter.
+                get_metrics().write()
+                res = pc.diff(diffid, block=True, timeout=args.timeout, fatal=False)
+            except requests.exceptions.ReadTimeout:
+                # The long poll ended without changes.
+                logging.debug("No changes.")
+                wait = 0
+                continue
+            except (OSError, SystemExit) as e:
+                # Network errors, and API calls that stop a script (SystemExit) must not stop the daemon.
+                logging.error(f"Sync or diff call failed: {e}")
+                res = None
+            if res is None:
+                wait = backoff(flags, wait)
+                continue
+            wait = 0
+            reload = False
+            for event in res.get("entries", []):
+                if event['event'] == 'reset':
+                    reload = True
+                    break
+                change = live.apply(event)
+                if change is None:
+                    continue
+                name, path, old, metadata = change
+                if metadata['isfolder'] and old and old != path:
+                    # Moved folder: the paths of the complete subtree change, list again.
+                    reload = True
+                    break
+                for pair in pairs:
+                    if name in DELETE_EVENTS:
+                        pair.removed(path)
+                        continue
+                    if old and old != path:
+                        pair.removed(old)
+                    pair.changed(path, metadata)
+            if reload:
+                logging.info("PCloud tree changed too much for incremental changes, list again.")
+                try:
+                    diffid, live, pairs = load_pairs(pc, fp, args.pair)
+                except (OSError, SystemExit) as e:
+                    # Keep the previous trees and diffid, the changes are requested again.
+                    logging.error(f"Listing PCloud failed: {e}")
+                    wait = backoff(flags, wait)
+            else:
+                diffid = res["diffid"]
+    except KeyboardInterrupt:
+        pass
+    logging.info("End application")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep local targets in sync with PCloud directories."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
@@ -2,78 +2,393 @@
 """
 This script syncs directories from pcloud to local drive. All files on pcloud will be on local drive as well.
 Local drive can have more files.
+With direction upload the local directory is synced to pcloud: all local files will be on pcloud as well.
 """
 
 import argparse
 import json
 import logging
 import os
+import time
 import webbrowser
-from lib import my_env, pcloud_handler
-from pathlib import Path
-
-parser = argparse.ArgumentParser(
-    description="Compare source (PCloud) and target (Local) directories."
-)
-parser.add_argument('-s', '--source_dir', type=str, required=True,
-                    help='Please provide the PCloud source directory.')
-parser.add_argument('-t', '--target_dir', type=str, required=True,
-                    help='Please provide the Local target directory ID.')
-parser.add_argument('-a', '--action', type=str, required=False, default='view', choices=['view', 'run'],
-                    help='Please provide the action: view changes or run to synchronize target with source')
-args = parser.parse_args()
-cfg = my_env.init_env("pcloud", __file__)
-pc = pcloud_handler.PcloudHandler()
-logging.info("Start application")
-logging.info("Arguments: {a}".format(a=args))
-source_dir = args.source_dir
-target_dir = args.target_dir
-pcloud_tree = {}
-fp = os.getenv('DATADIR')
-# Get youngest pcloud inventory file
-inventory_files = [file for file in os.listdir(fp) if '.json' == file[-len('.json'):]]
-inventory_files.sort(reverse=True)
-ffn_current = inventory_files[0]
-with open(os.path.join(fp, ffn_current), 'r') as fh:
-    pcloud_contents = json.load(fh)
-pcloud_handler.item2key(pcloud_tree, pcloud_contents['path'], pcloud_contents['contents'], source_dir, target_dir)
-local_tree = pcloud_handler.get_local_contents(target_dir)
-new_items = []
-modified_items = []
-removed_items = []
-for k in pcloud_tree:
-    if k in local_tree:
-        if 'size' in pcloud_tree[k] and pcloud_tree[k]['size'] != local_tree[k]['size']: modified_items.append(k)
-    else:
-        new_items.append(k)
-for k in local_tree:
-    if k not in pcloud_tree: removed_items.append(k)
-report = f'<html><body><h3>New: {len(new_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Created</th></tr>'
-for k in new_items:
-    report += f'<tr><td>{k}</td><td>{pcloud_tree[k]["created"][:-6]}</td></tr>'
-report += '</table>'
-report += f'<h3>Modified: {len(modified_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Modified</th></tr>'
-for k in modified_items:
-    report += f'<tr><td>{k}</td><td>{pcloud_tree[k]["modified"][:-6]}</td></tr>'
-report += '</table>'
-report += f'<h3>Removed: {len(removed_items)} items</h3>'
-report += '<table border="1" cellpadding="4"><tr><th>File</th><th>Modified</th></tr>'
-for k in removed_items:
-    report += f'<tr><td>{k}</td><td>{local_tree[k]["modified"]}</td></tr>'
-report += '</table></body></html>'
-ffn = os.path.join(fp, 'report.html')
-with open(ffn,'w') as fh:
-    fh.write(report)
-webbrowser.open(ffn)
-
-if args.action == 'run':
-    for k in new_items + modified_items:
+from concurrent.futures import ThreadPoolExecutor
+from lib import my_env, pcloud_handler, profiling
+from lib.journal import SyncJournal, journal_dir, INFLIGHT, DONE, FAILED
+from lib.local_index import LocalIndex, materialize
+from lib.local_watch import local_contents
+from lib.report import ReportWriter
+from lib.remote_dedupe import RemoteIndex, copy_files, get_folderid
+from lib.transfer_plan import ThroughputHistory, report_rows, summarize
+from lib.uploader import upload_files
+from lib.verify import RemoteChecksums, verify
+from pathlib import Path, PurePosixPath
+
+
+def fmt_date(item, field):
+    """
+    Local items do not have a created date, the modified date is shown instead.
+
+    :param item: Item from the PCloud or local tree.
+    :param field: created or modified
+    :return: Date string for the report.
+    """
+    return pcloud_handler.fmt_time(item.get(field, item['modified']))
+
+
+def plan_download(items, pcloud_tree, local_tree):
+    """
+    This function creates the journal plan for a download. Each plan item has all information to handle the item, so
+    a resumed run does not need the inventory or the local tree.
+
+    :param items: Keys of the new and modified items.
+    :param pcloud_tree: Dictionary of PCloud items.
+    :param local_tree: Dictionary of local items.
+    :return: Tuple (meta, plan items). Meta has the local files (by size) that can be a source for dedupe.
+    """
+    plan = []
+    sizes = set()
+    for k in items:
         if pcloud_tree[k]['isfolder']:
-            Path(k).mkdir(parents=True, exist_ok=True)
+            plan.append(dict(key=k, isfolder=True))
+        else:
+            plan.append(dict(key=k, isfolder=False, fileid=pcloud_tree[k]['fileid'], size=pcloud_tree[k]['size'],
+                             modified=pcloud_tree[k]['modified'], local_size=local_tree.get(k, {}).get('size')))
+            sizes.add(pcloud_tree[k]['size'])
+    by_size = {}
+    for k, v in local_tree.items():
+        if not v['isfolder'] and v['size'] in sizes:
+            by_size.setdefault(v['size'], []).append(k)
+    return dict(by_size=list(by_size.items())), plan
+
+
+def run_download(pc, fp, journal, dedupe):
+    """
+    This function handles the download items in the journal that are not done yet.
+
+    :param pc: PcloudHandler object.
+    :param fp: Data directory.
+    :param journal: SyncJournal with the plan.
+    :param dedupe: Dedupe mode (off, copy, hardlink, reflink).
+    :return: Tuple (number of files downloaded, bytes downloaded, seconds spent in the downloads).
+    """
+    local_index = None
+    if dedupe != 'off':
+        local_index = LocalIndex({}, os.path.join(fp, 'local_checksums.json'))
+        for size, paths in journal.meta['by_size']:
+            local_index.by_size[size] = paths
+        for idx, item in enumerate(journal.items):
+            if journal.states[idx] == DONE and not item['isfolder']:
+                local_index.add(item['key'], item['size'])
+    dedupe_cnt = 0
+    dedupe_bytes = 0
+    download_cnt = 0
+    download_bytes = 0
+    download_seconds = 0
+    todo = list(journal.todo())
+    progress = my_env.Progress('files', len(todo), sum(journal.items[idx].get('size', 0) for idx in todo))
+    for idx in todo:
+        item = journal.items[idx]
+        k = item['key']
+        journal.mark(idx, INFLIGHT)
+        try:
+            if item['isfolder']:
+                Path(k).mkdir(parents=True, exist_ok=True)
+                journal.mark(idx, DONE)
+                progress.done()
+                continue
+            size = item['size']
+            mtime = item['modified']
+            if local_index and size > 0 and local_index.has_size(size):
+                # Only ask PCloud for the checksum if a local file can have the same contents.
+                checksums = pc.checksumfile(item['fileid'])
+                if checksums and item['local_size'] == size and local_index.checksum(k) == checksums['sha1']:
+                    # Only the modification time is different (quick check), contents are the same.
+                    if dedupe == 'hardlink' and os.stat(k).st_nlink > 1:
+                        # The links share one modification time, setting it here changes the other copies.
+                        logging.info(f"File {k} is hardlinked, modification time not set from PCloud")
+                    else:
+                        os.utime(k, (mtime, mtime))
+                        logging.info(f"File {k} modification time set from PCloud")
+                    journal.mark(idx, DONE)
+                    progress.done(nbytes=size)
+                    continue
+                src = checksums and local_index.find(size, checksums['sha1'], exclude=k)
+                if src:
+                    materialize(src, k, dedupe)
+                    if dedupe != 'hardlink':
+                        os.utime(k, (mtime, mtime))
+                    local_index.add(k, size)
+                    dedupe_cnt += 1
+                    dedupe_bytes += size
+                    logging.info(f"File {k} created from local file {src} ({dedupe})")
+                    journal.mark(idx, DONE)
+                    progress.done(nbytes=size)
+                    continue
+            start = time.monotonic()
+            pcloud_handler.get_file(pc.get_filelink(item['fileid']), k, mtime=mtime, progress=progress)
+            download_seconds += time.monotonic() - start
+            download_cnt += 1
+            download_bytes += size
+            if local_index:
+                local_index.add(k, size)
+            logging.info(f"File {k} Contents: {item}")
+            journal.mark(idx, DONE)
+            progress.done()
+        except OSError as e:
+            # Includes network errors (requests exceptions are OSErrors).
+            logging.error(f"Sync of {k} failed: {e}")
+            journal.mark(idx, FAILED)
+            progress.done(failed=True)
+    progress.end_loop()
+    if local_index:
+        local_index.save()
+        logging.info(f"{dedupe_cnt} files ({dedupe_bytes} bytes) created from local content instead of download.")
+    return download_cnt, download_bytes, download_seconds
+
+
+def plan_upload(items, local_tree, pcloud_contents, source_dir, target_dir):
+    """
+    This function creates the journal plan for an upload.
+
+    :param items: Keys of the new and modified local items.
+    :param local_tree: Dictionary of local items.
+    :param pcloud_contents: PCloud inventory.
+    :param source_dir: PCloud directory.
+    :param target_dir: Local directory.
+    :return: Tuple (meta, plan items). Meta has the known PCloud folders and the PCloud files (by size) that can be
+    copied on the server.
+    """
+    index = RemoteIndex(pcloud_contents)
+    plan = []
+    folders = {}
+    sizes = set()
+    for k in items:
+        path = pcloud_handler.local2pcloud(k, target_dir, source_dir)
+        parent = str(PurePosixPath(path).parent)
+        if parent in index.folders:
+            folders[parent] = index.folders[parent]
+        if local_tree[k]['isfolder']:
+            plan.append(dict(key=k, isfolder=True, path=path))
         else:
-            pcloud_handler.get_file(pc.get_filelink(pcloud_tree[k]['fileid']), k)
-            logging.info(f"File {k} Contents: {pcloud_tree[k]}")
+            plan.append(dict(key=k, isfolder=False, path=path, size=local_tree[k]['size']))
+            sizes.add(local_tree[k]['size'])
+    by_size = [(size, fileids) for size, fileids in index.by_size.items() if size in sizes]
+    return dict(folders=folders, by_size=by_size), plan
+
+
+def run_upload(pc, fp, journal, dedupe, workers):
+    """
+    This function handles the upload items in the journal that are not done yet.
+
+    :param pc: PcloudHandler object.
+    :param fp: Data directory.
+    :param journal: SyncJournal with the plan.
+    :param dedupe: Dedupe mode, files are copied on the server unless off.
+    :param workers: Number of concurrent uploads or copies.
+    :return: Tuple (number of files uploaded, bytes uploaded, seconds spent in the uploads).
+    """
+    index = RemoteIndex(dict(path='/', folderid=0, contents=[]))
+    index.folders.update(journal.meta['folders'])
+    index.by_size = {size: fileids for size, fileids in journal.meta['by_size']}
+
+    todo = list(journal.todo())
+    progress = my_env.Progress('files', len(todo), sum(journal.items[idx].get('size', 0) for idx in todo))
+
+    def mark_result(upload, ok):
+        journal.mark(upload['idx'], DONE if ok else FAILED)
+        progress.done(nbytes=upload['size'] if ok else 0, failed=not ok)
+
+    uploads = []
+    for idx in todo:
+        item = journal.items[idx]
+        if item['isfolder']:
+            journal.mark(idx, INFLIGHT)
+            get_folderid(pc, index, item['path'])
+            journal.mark(idx, DONE)
+            progress.done()
+        else:
+            uploads.append(dict(idx=idx, ffn=item['key'], path=item['path'], size=item['size']))
+    for upload in uploads:
+        journal.mark(upload['idx'], INFLIGHT)
+    if dedupe != 'off':
+        # Files that are on PCloud already (same size and sha1) are copied on the server.
+        local_index = LocalIndex({}, os.path.join(fp, 'local_checksums.json'))
+        checksum_cache = {}
+        candidates = [u for u in uploads if u['size'] > 0 and u['size'] in index.by_size]
+        # Local checksums are calculated in a process pool, PCloud checksums are requested concurrently.
+        sha1s = local_index.checksum_all([u['ffn'] for u in candidates])
+
+        def find_copy(upload):
+            sha1 = sha1s[upload['ffn']]
+            return index.lookup_sha1(pc, upload['size'], sha1, checksum_cache) if sha1 else None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fileids = dict(zip((u['idx'] for u in candidates), executor.map(find_copy, candidates)))
+        copies = []
+        transfers = []
+        for upload in uploads:
+            fileid = fileids.get(upload['idx'])
+            if fileid:
+                copies.append(dict(idx=upload['idx'], fileid=fileid, path=upload['path'], size=upload['size']))
+            else:
+                transfers.append(upload)
+        local_index.save()
+        # A failed copy is uploaded instead, so only successful copies are recorded.
+        copied, saved, failed = copy_files(pc, copies, index, workers=workers,
+                                           callback=lambda copy, ok: ok and mark_result(copy, ok))
+        logging.info(f"{copied} files copied on PCloud, {saved} bytes not uploaded.")
+        failed_paths = {f['path'] for f in failed}
+        uploads = transfers + [u for u in uploads if u['path'] in failed_paths]
+    # Target folders are created before the uploads, only the uploads are timed for the throughput history.
+    for upload in uploads:
+        get_folderid(pc, index, str(PurePosixPath(upload['path']).parent))
+    start = time.monotonic()
+    uploaded, uploaded_bytes, failed = upload_files(pc, uploads, index, os.path.join(fp, 'uploads'),
+                                                    workers=workers, callback=mark_result)
+    upload_seconds = time.monotonic() - start
+    progress.end_loop()
+    logging.info(f"{uploaded} files ({uploaded_bytes} bytes) uploaded, {len(failed)} uploads failed.")
+    return uploaded, uploaded_bytes, upload_seconds
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for sync to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-s', '--source_dir', type=str, required=True,
+                        help='Please provide the PCloud source directory.')
+    parser.add_argument('-t', '--target_dir', type=str, required=True,
+                        help='Please provide the Local target directory ID.')
+    parser.add_argument('-a', '--action', type=str, required=False, default='view',
+                        choices=['view', 'run', 'verify'],
+                        help='Please provide the action: view changes, run to synchronize target with source or '
+                             'verify checksums of the local files against PCloud')
+    parser.add_argument('-r', '--direction', type=str, required=False, default='download',
+                        choices=['download', 'upload'],
+                        help='download: sync PCloud directory to local directory, upload: sync local directory to '
+                             'PCloud directory.')
+    parser.add_argument('-d', '--dedupe', type=str, required=False, default='reflink',
+                        choices=['off', 'copy', 'hardlink', 'reflink'],
+                        help='Create new files from identical local files instead of downloading them: copy, '
+                             'hardlink, reflink (copy if not supported) or off. Hardlinked files share one '
+                             'modification time. On upload any value except off copies files that are on PCloud '
+                             'already on the server.')
+    parser.add_argument('-c', '--check', type=str, required=False, default='size', choices=['size', 'quick'],
+                        help='size: a file is modified if the size is different, quick: a file is modified if size '
+                             'or modification time are different.')
+    parser.add_argument('-f', '--formats', type=str, nargs='+', required=False, default=['html'],
+                        choices=['html', 'csv', 'json'],
+                        help='Report formats. csv and json files are written next to the html report.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the interrupted run for this source and target from the sync journal, without '
+                             'comparing the directories again.')
+    parser.add_argument('-w', '--workers', type=int, required=False, default=8,
+                        help='Number of concurrent uploads or server side copies.')
+
+
+def main(args):
+    """
+    This function runs the sync for the command line arguments.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    pc = pcloud_handler.get_handler()
+    logging.info("Start application")
+    logging.info("Arguments: {a}".format(a=args))
+    source_dir = args.source_dir
+    target_dir = args.target_dir
+    fp = os.getenv('DATADIR')
+    journal = SyncJournal(journal_dir(fp, args.direction, source_dir, target_dir))
+    history = ThroughputHistory(os.path.join(fp, 'throughput.json'))
+    if args.resume:
+        if not journal.exists():
+            msg = f"No sync journal to resume for {source_dir} and {target_dir}."
+            logging.critical(msg)
+            raise SystemExit(msg)
+        journal.load()
+    else:
+        pcloud_tree = {}
+        with profiling.phase('load snapshot'):
+            # Get youngest pcloud inventory file
+            inventory_files = my_env.get_inventory_files(fp)
+            ffn_current = inventory_files[0]
+            with open(os.path.join(fp, ffn_current), 'r') as fh:
+                pcloud_contents = json.load(fh)
+        with profiling.phase('flatten'):
+            pcloud_handler.item2key(pcloud_tree, pcloud_contents['path'], pcloud_contents['contents'], source_dir,
+                                    target_dir)
+        with profiling.phase('local scan'):
+            # From the local watcher state if the watcher is running, otherwise a full scan.
+            local_tree = local_contents(target_dir, fp)
+        if args.direction == 'download':
+            source_tree, target_tree = pcloud_tree, local_tree
+        else:
+            source_tree, target_tree = local_tree, pcloud_tree
+        with profiling.phase('diff'):
+            new_items, modified_items, removed_items = pcloud_handler.compare_trees(source_tree, target_tree,
+                                                                                     quick=(args.check == 'quick'))
+        if args.action in ('view', 'run'):
+            if args.direction == 'download':
+                meta, plan = plan_download(new_items + modified_items, pcloud_tree, local_tree)
+            else:
+                meta, plan = plan_upload(new_items + modified_items, local_tree, pcloud_contents, source_dir,
+                                         target_dir)
+            summary = summarize(args.direction, meta, plan, args.dedupe)
+            logging.info(f"Transfer plan: {json.dumps(summary)}")
+        ffn = os.path.join(fp, 'report.html')
+        with profiling.phase('report'), ReportWriter(ffn, formats=args.formats) as report:
+            if args.action in ('view', 'run'):
+                report.section('Transfer plan', ['Plan', 'Files', 'Bytes', 'Size', 'Duration'],
+                               rows=report_rows(summary, history))
+            report.section('New', ['File', 'Created'], count=len(new_items),
+                           rows=([k, fmt_date(source_tree[k], 'created')] for k in new_items))
+            report.section('Modified', ['File', 'Modified'], count=len(modified_items),
+                           rows=([k, fmt_date(source_tree[k], 'modified')] for k in modified_items))
+            report.section('Removed', ['File', 'Modified'], count=len(removed_items),
+                           rows=([k, fmt_date(target_tree[k], 'modified')] for k in removed_items))
+        webbrowser.open(ffn)
+
+        if args.action == 'run':
+            meta.update(direction=args.direction, source_dir=source_dir, target_dir=target_dir)
+            journal.create(meta, plan)
+
+        if args.action == 'verify':
+            local_index = LocalIndex(local_tree, os.path.join(fp, 'local_checksums.json'))
+            remote_checksums = RemoteChecksums(os.path.join(fp, 'remote_checksums.json'))
+            with profiling.phase('verify'):
+                verified, mismatches, unverified = verify(pc, pcloud_tree, local_tree, local_index, remote_checksums,
+                                                          workers=args.workers)
+            ffn = os.path.join(fp, 'verify.html')
+            with ReportWriter(ffn, formats=args.formats) as report:
+                report.section(f'Verified: {verified} files - Checksum mismatch', ['File', 'Modified'],
+                               count=len(mismatches),
+                               rows=([k, fmt_date(pcloud_tree[k], 'modified')] for k in mismatches))
+                report.section('Not verified', ['File'], count=len(unverified), rows=([k] for k in unverified))
+            webbrowser.open(ffn)
+            logging.info(f"{verified} files verified, {len(mismatches)} checksum mismatches, "
+                         f"{len(unverified)} not verified.")
+
+    if args.resume or args.action == 'run':
+        with profiling.phase('transfer'):
+            if args.direction == 'download':
+                files, nbytes, seconds = run_download(pc, fp, journal, args.dedupe)
+            else:
+                files, nbytes, seconds = run_upload(pc, fp, journal, args.dedupe, args.workers)
+        journal.close()
+        # Only the time of the transfers: dedupes, copies and folders are not in the files and bytes.
+        history.add(args.direction, files, nbytes, seconds)
+    logging.info("End application")
+
 
-logging.info("End application")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare source (PCloud) and target (Local) directories."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
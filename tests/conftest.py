@@ -0,0 +1,41 @@
+"""
+Fixtures for the tests against the fake PCloud server (tools/fake_pcloud.py).
+"""
+
+import os
+import sys
+
+import pytest
+
+# Project directory is the parent of the tests directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib import pcloud_handler
+from tools.fake_pcloud import FakePcloud
+from tools.synthetic import make_snapshot
+
+
+@pytest.fixture
+def fake():
+    """
+    Fake PCloud server with a small synthetic account, running in a thread.
+    """
+    server = FakePcloud(make_snapshot(30, files_per_folder=10, folders_per_folder=3, max_size=100000),
+                        poll_timeout=2)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def pc(fake, tmp_path, monkeypatch):
+    """
+    PcloudHandler for the fake server, with the data directory in the test directory.
+    """
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    monkeypatch.setenv('PCHome', fake.url)
+    monkeypatch.setenv('PCUser', 'test')
+    monkeypatch.setenv('PCPwd', 'test')
+    monkeypatch.setenv('DATADIR', str(data_dir))
+    monkeypatch.setattr(pcloud_handler, '_handler', None)
+    return pcloud_handler.get_handler()
@@ -0,0 +1,99 @@
+"""
+Tests for the sync daemon against the fake PCloud server. The daemon runs as a subprocess, as it runs in production:
+it handles SIGTERM in the main thread.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(condition, timeout=30):
+    """
+    Wait until condition() is true, fail the test after timeout seconds.
+    """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return
+        time.sleep(0.2)
+    pytest.fail(f"Condition not met within {timeout} seconds.")
+
+
+def local_size(ffn):
+    try:
+        return os.path.getsize(ffn)
+    except FileNotFoundError:
+        return None
+
+
+@pytest.fixture
+def daemon(fake, pc, tmp_path):
+    """
+    Sync daemon for the complete fake account to a local target. Yields the local target directory.
+    """
+    target = tmp_path / 'local'
+    target.mkdir()
+    log_dir = tmp_path / 'log'
+    log_dir.mkdir()
+    env = dict(os.environ, LOGDIR=str(log_dir), LOGLEVEL='info')
+    proc = subprocess.Popen([sys.executable, os.path.join(PROJECT_DIR, 'sync_daemon.py'), '-p', '/', str(target),
+                             '--timeout', '5', '-d', 'off'], cwd=PROJECT_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        yield target
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            _, stderr = proc.communicate(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+        assert proc.returncode == 0, stderr.decode()
+
+
+def initial_sync(fake, target):
+    """
+    Wait for the initial sync of the complete account. Returns the PCloud paths by fileid.
+    """
+    tree = fake.tree
+    files = {fileid: tree.folder_path(f['parentfolderid']).rstrip('/') + '/' + f['name']
+             for fileid, f in tree.files.items()}
+    wait_for(lambda: all(local_size(f"{target}{path}") == tree.files[fileid]['size']
+                         for fileid, path in files.items()))
+    return files
+
+
+def test_daemon_follows_changes(fake, daemon):
+    tree = fake.tree
+    files = initial_sync(fake, daemon)
+
+    res = requests.get(f"{fake.url}_admin/create", params=dict(path='/new_folder/new.bin', size=12345)).json()
+    assert res['result'] == 0
+    new_file = daemon / 'new_folder' / 'new.bin'
+    wait_for(lambda: local_size(new_file) == 12345)
+    assert new_file.read_bytes() == tree.content(res['metadata']['fileid'])
+
+    fileid, path = next(iter(files.items()))
+    res = requests.get(f"{fake.url}_admin/modify", params=dict(fileid=fileid, size=4321)).json()
+    assert res['result'] == 0
+    wait_for(lambda: local_size(f"{daemon}{path}") == 4321)
+    with open(f"{daemon}{path}", 'rb') as fh:
+        assert fh.read() == tree.content(fileid)
+
+
+def test_daemon_survives_api_errors(fake, daemon):
+    initial_sync(fake, daemon)
+    # All API calls fail for a while, the daemon backs off and keeps polling.
+    fake.server.error_rate = 1.0
+    time.sleep(6)
+    fake.server.error_rate = 0
+    requests.get(f"{fake.url}_admin/create", params=dict(path='/after_errors.bin', size=100))
+    wait_for(lambda: local_size(daemon / 'after_errors.bin') == 100, timeout=60)
@@ -0,0 +1,35 @@
+"""
+Tests for the download direction of sync_dirs against the fake PCloud server.
+"""
+
+import os
+
+import pytest
+
+from lib.journal import SyncJournal, journal_dir, DONE
+from sync_dirs import plan_download, run_download
+
+
+@pytest.mark.parametrize('dedupe, expected_mtime', [('hardlink', 1000), ('copy', 2000)])
+def test_quick_check_hardlinked_mtime(fake, pc, tmp_path, dedupe, expected_mtime):
+    # Two hardlinked copies with the contents of a PCloud file, the PCloud file has another modification time.
+    source = next(f for f in fake.tree.files.values() if f['size'] > 0)
+    data = fake.tree.content(source['fileid'])
+    first = str(tmp_path / 'first.bin')
+    second = str(tmp_path / 'second.bin')
+    with open(first, 'wb') as fh:
+        fh.write(data)
+    os.link(first, second)
+    os.utime(first, (1000, 1000))
+    pcloud_tree = {first: dict(isfolder=False, fileid=source['fileid'], size=len(data), modified=2000)}
+    local_tree = {k: dict(isfolder=False, size=len(data), modified=1000) for k in (first, second)}
+    meta, plan = plan_download([first], pcloud_tree, local_tree)
+    fp = os.getenv('DATADIR')
+    journal = SyncJournal(journal_dir(fp, 'download', '/', str(tmp_path)))
+    journal.create(meta, plan)
+    # Nothing is downloaded, so no time for the throughput history either.
+    assert run_download(pc, fp, journal, dedupe) == (0, 0, 0)
+    assert journal.states == [DONE]
+    journal.close()
+    # With hardlink dedupe the shared modification time is kept, otherwise the second copy changes on every run.
+    assert os.stat(second).st_mtime == expected_mtime
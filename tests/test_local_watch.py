@@ -0,0 +1,53 @@
+"""
+Tests for the inotify watcher of local sync targets.
+"""
+
+import os
+
+import pytest
+
+from lib.local_watch import LocalWatcher
+from lib.pcloud_handler import get_local_contents
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    """
+    Watcher for a local target with one file and one directory.
+    """
+    target = tmp_path / 'target'
+    (target / 'sub').mkdir(parents=True)
+    (target / 'sub' / 'old.txt').write_bytes(b'old')
+    watcher = LocalWatcher(str(target), str(tmp_path / 'state.json'))
+    yield watcher
+    watcher.close()
+
+
+def test_changes_update_the_tree(watcher):
+    root = watcher.root
+    assert watcher.tree == get_local_contents(root)
+    with open(os.path.join(root, 'new.txt'), 'wb') as fh:
+        fh.write(b'new contents')
+    os.rename(os.path.join(root, 'sub', 'old.txt'), os.path.join(root, 'sub', 'renamed.txt'))
+    os.mkdir(os.path.join(root, 'dir'))
+    with open(os.path.join(root, 'dir', 'in_dir.txt'), 'wb') as fh:
+        fh.write(b'x')
+    os.rename(os.path.join(root, 'dir'), os.path.join(root, 'moved'))
+    os.remove(os.path.join(root, 'new.txt'))
+    watcher.process_events()
+    assert watcher.tree == get_local_contents(root)
+    assert os.path.join(root, 'moved', 'in_dir.txt') in watcher.tree
+    assert os.path.join(root, 'sub', 'old.txt') not in watcher.tree
+    assert os.path.join(root, 'new.txt') not in watcher.tree
+
+
+def test_file_written_in_chunks(watcher):
+    ffn = os.path.join(watcher.root, 'large.bin')
+    with open(ffn, 'wb') as fh:
+        for _ in range(100):
+            fh.write(b'x' * 4096)
+            fh.flush()
+        # Only the create event while the file is written, not one event per write.
+        assert watcher.process_events() == 1
+    assert watcher.process_events() == 1
+    assert watcher.tree[ffn]['size'] == 100 * 4096
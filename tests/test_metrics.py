@@ -0,0 +1,47 @@
+"""
+Tests for the PCloud call metrics.
+"""
+
+import os
+
+import pytest
+import requests
+
+from lib.metrics import Metrics, script_name
+
+
+def diff_series(metrics):
+    return next(c for c in metrics.summary()['calls'] if c['method'] == 'diff')
+
+
+def test_idle_long_poll_is_not_an_error(fake, pc, monkeypatch):
+    metrics = Metrics('test')
+    monkeypatch.setattr('lib.pcloud_handler.get_metrics', lambda: metrics)
+    fake.server.poll_timeout = 10
+    diffid = pc.diff()['diffid']
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        pc.diff(diffid, block=True, timeout=0.5)
+    assert diff_series(metrics)['count'] == 2
+    assert diff_series(metrics)['errors'] == {}
+
+
+def test_failed_call_is_an_error(fake, pc, monkeypatch):
+    metrics = Metrics('test')
+    monkeypatch.setattr('lib.pcloud_handler.get_metrics', lambda: metrics)
+    fake.server.error_rate = 1.0
+    assert pc.diff(1, block=True, timeout=5, fatal=False) is None
+    assert diff_series(metrics)['errors'] == {'http_500': 1}
+
+
+@pytest.mark.parametrize('argv, expected', [(['/opt/pcloud/sync_dirs.py', '-a', 'run'], 'sync_dirs'),
+                                            (['/opt/pcloud/pcloud.py', 'sync', '-a', 'run'], 'sync'),
+                                            (['/opt/pcloud/pcloud.py', '-h'], 'pcloud')])
+def test_script_name(argv, expected, monkeypatch):
+    monkeypatch.setattr('sys.argv', argv)
+    assert script_name() == expected
+
+
+def test_pcloud_command_files(tmp_path, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pcloud', 'sync'])
+    Metrics(script_name()).write(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['pcloud_sync.json', 'pcloud_sync.prom']
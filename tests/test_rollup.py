@@ -0,0 +1,65 @@
+"""
+Tests for the rollup of report sections by folder.
+"""
+
+import pytest
+
+from lib import merkle
+from lib.rollup import Rollup
+
+TREE = {
+    '/a': dict(isfolder=True),
+    '/a/new': dict(isfolder=True),
+    '/a/new/x': dict(isfolder=False, size=5),
+    '/a/new/y': dict(isfolder=False, size=7),
+    '/a/z': dict(isfolder=False, size=1),
+}
+ITEMS = ['/a/new', '/a/new/x', '/a/new/y', '/a/z']
+
+
+@pytest.mark.parametrize('threshold', [1, 2, 3, 4, 100])
+def test_rows_add_up(threshold):
+    rows = list(Rollup(ITEMS, TREE, threshold).rows())
+    assert sum(cnt for _, cnt, _, _ in rows) == len(ITEMS)
+    assert sum(size for _, _, size, _ in rows) == 13
+
+
+def test_new_folder_below_threshold():
+    rows = list(Rollup(ITEMS, TREE, 3).rows())
+    assert rows == [('/a/new', 1, 0, False), ('/a/new/x', 1, 5, False), ('/a/new/y', 1, 7, False),
+                    ('/a/z', 1, 1, False)]
+
+
+def test_new_folder_rolled_up():
+    rows = list(Rollup(ITEMS, TREE, 2).rows())
+    assert rows == [('/a/new', 3, 12, True), ('/a/z', 1, 1, False)]
+
+
+def inventory(contents):
+    return dict(path='/', name='/', isfolder=True, contents=contents)
+
+
+def folder(name, contents):
+    return dict(name=name, isfolder=True, created='Mon, 01 Jan 2024 00:00:00 +0000',
+                modified='Mon, 01 Jan 2024 00:00:00 +0000', contents=contents)
+
+
+def file(name, size):
+    return dict(name=name, isfolder=False, created='Mon, 01 Jan 2024 00:00:00 +0000',
+                modified='Mon, 01 Jan 2024 00:00:00 +0000', fileid=size, size=size, hash=size,
+                contenttype='application/octet-stream')
+
+
+@pytest.mark.parametrize('threshold, expected', [
+    (100, ('/bigdir', 151, 150 * 151 // 2, True)),
+    (200, ('/bigdir', 1, 0, False)),
+])
+def test_merkle_diff_keys(threshold, expected):
+    # merkle.diff has PurePosixPath keys, not strings.
+    prev = inventory([file('old.txt', 1)])
+    current = inventory([file('old.txt', 1), folder('bigdir', [file(f"f{i}", i) for i in range(1, 151)])])
+    new_items, _, _, current_tree, _ = merkle.diff(prev, current)
+    rows = list(Rollup(new_items, current_tree, threshold).rows())
+    assert (str(rows[0][0]),) + rows[0][1:] == expected
+    assert sum(cnt for _, cnt, _, _ in rows) == len(new_items)
+    assert all(k in current_tree for k, _, _, is_rollup in rows if not is_rollup)
@@ -0,0 +1,34 @@
+"""
+Tests for the transfer plan estimates.
+"""
+
+from lib.transfer_plan import ThroughputHistory, report_rows, summarize
+
+
+def make_history(tmp_path):
+    history = ThroughputHistory(str(tmp_path / 'throughput.json'))
+    # 1 second per file and 1000 bytes per second.
+    history.add('download', 10, 10000, 20)
+    history.add('download', 10, 20000, 30)
+    return history
+
+
+def test_model(tmp_path):
+    per_file, per_byte, runs = make_history(tmp_path).model('download')
+    assert (round(per_file, 6), round(per_byte, 6), runs) == (1, 0.001, 2)
+    # The history is saved and loaded again.
+    assert ThroughputHistory(str(tmp_path / 'throughput.json')).model('download')[2] == 2
+
+
+def test_duration_of_best_and_worst_case(tmp_path):
+    meta = dict(by_size=[(3000, ['/local/other'])])
+    plan = [dict(key='/local/a', isfolder=False, size=3000, local_size=None),
+            dict(key='/local/b', isfolder=False, size=2000, local_size=None),
+            dict(key='/local/c', isfolder=False, size=5000, local_size=None)]
+    summary = summarize('download', meta, plan, 'copy')
+    assert (summary['files'], summary['bytes'], summary['candidates'], summary['candidate_bytes']) == \
+           (3, 10000, 1, 3000)
+    rows = {row[0]: row for row in report_rows(summary, make_history(tmp_path))}
+    # 2 files and 7000 bytes if the candidate matches, 3 files and 10000 bytes if not.
+    assert rows['Transfer if all candidates match'][1:] == [2, 7000, '7.0 kB', '0:00:09']
+    assert rows['Transfer if no candidate matches'][1:] == [3, 10000, '10.0 kB', '0:00:13']
@@ -0,0 +1,161 @@
+"""
+Tests for the upload direction of sync_dirs against the fake PCloud server.
+"""
+
+import os
+from pathlib import PurePosixPath
+from urllib.parse import urlparse
+
+import requests
+
+from lib import pcloud_handler
+from lib.journal import SyncJournal, journal_dir, DONE, FAILED
+from lib.remote_dedupe import RemoteIndex
+from lib.uploader import upload_files
+from sync_dirs import plan_upload, run_upload
+from tools.fake_pcloud import FakeHandler
+
+
+def sync_upload(pc, source_dir, target_dir, dedupe='off'):
+    """
+    Upload sync of target_dir to source_dir, as sync_dirs does it with action run. Returns the journal states by key.
+    """
+    fp = os.getenv('DATADIR')
+    pcloud_contents = pc.get_contents()
+    pcloud_tree = {}
+    pcloud_handler.item2key(pcloud_tree, pcloud_contents['path'], pcloud_contents['contents'], source_dir,
+                            target_dir)
+    local_tree = pcloud_handler.get_local_contents(target_dir)
+    new_items, modified_items, _ = pcloud_handler.compare_trees(local_tree, pcloud_tree)
+    meta, plan = plan_upload(new_items + modified_items, local_tree, pcloud_contents, source_dir, target_dir)
+    meta.update(direction='upload', source_dir=source_dir, target_dir=target_dir)
+    journal = SyncJournal(journal_dir(fp, 'upload', source_dir, target_dir))
+    journal.create(meta, plan)
+    run_upload(pc, fp, journal, dedupe, workers=4)
+    states = {item['key']: journal.states[idx] for idx, item in enumerate(journal.items)}
+    journal.close()
+    return states
+
+
+def remote_file(fake, path):
+    """
+    Return the file on the fake server for a PCloud path, or None.
+    """
+    tree = fake.tree
+    folderid = tree.find_folder(str(PurePosixPath(path).parent))
+    fileid = folderid is not None and tree.find_file(folderid, PurePosixPath(path).name)
+    return tree.files[fileid] if fileid else None
+
+
+def write_files(local_dir, files):
+    local_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in files.items():
+        (local_dir / name).write_bytes(data)
+
+
+def test_small_uploads(fake, pc, tmp_path):
+    files = {'a.txt': b'a' * 100, 'b.txt': b'b' * 2000, 'c.txt': b''}
+    write_files(tmp_path / 'local' / 'sub', files)
+    states = sync_upload(pc, '/upload', str(tmp_path / 'local'))
+    assert set(states.values()) == {DONE}
+    for name, data in files.items():
+        f = remote_file(fake, f"/upload/sub/{name}")
+        assert f is not None
+        assert fake.tree.content(f['fileid']) == data
+    assert fake.server.calls['uploadfile'] == len(files)
+
+
+def test_failed_upload_continues(fake, pc, tmp_path, monkeypatch):
+    write_files(tmp_path / 'local', {'a.txt': b'a', 'b.txt': b'b', 'c.txt': b'c'})
+    uploadfile = pc.uploadfile
+
+    def failing_uploadfile(ffn, folderid, name, mtime=None):
+        if name == 'b.txt':
+            raise requests.exceptions.ConnectionError('Connection reset')
+        return uploadfile(ffn, folderid, name, mtime)
+
+    monkeypatch.setattr(pc, 'uploadfile', failing_uploadfile)
+    states = sync_upload(pc, '/upload', str(tmp_path / 'local'))
+    by_name = {os.path.basename(k): state for k, state in states.items() if k.endswith('.txt')}
+    assert by_name == {'a.txt': DONE, 'b.txt': FAILED, 'c.txt': DONE}
+    assert set(states.values()) == {DONE, FAILED}
+    assert remote_file(fake, '/upload/b.txt') is None
+
+
+def test_vanished_file_fails_alone(fake, pc, tmp_path):
+    write_files(tmp_path, {'a.txt': b'a', 'gone.txt': b'gone'})
+    index = RemoteIndex(pc.get_contents())
+    uploads = [dict(ffn=str(tmp_path / name), path=f"/upload/{name}", size=1) for name in ('a.txt', 'gone.txt')]
+    os.remove(tmp_path / 'gone.txt')
+    uploaded, _, failed = upload_files(pc, uploads, index, str(tmp_path / 'uploads'))
+    assert (uploaded, [u['path'] for u in failed]) == (1, ['/upload/gone.txt'])
+    assert remote_file(fake, '/upload/a.txt') is not None
+
+
+def test_upload_create_error_fails_one_file(fake, pc, tmp_path, monkeypatch):
+    write_files(tmp_path, {'a.bin': b'a' * 1000, 'b.bin': b'b' * 1000})
+    index = RemoteIndex(pc.get_contents())
+    uploads = [dict(ffn=str(tmp_path / name), path=f"/upload/{name}", size=1000) for name in ('a.bin', 'b.bin')]
+    dispatch = FakeHandler.dispatch
+    errors = []
+
+    def failing_dispatch(handler):
+        # The first upload_create gets a HTTP 500.
+        if urlparse(handler.path).path.strip('/') == 'upload_create' and not errors:
+            errors.append(handler.path)
+            return handler.send_json(dict(result=5000, error='Internal error. Try again later.'), status=500)
+        return dispatch(handler)
+
+    monkeypatch.setattr(FakeHandler, 'dispatch', failing_dispatch)
+    uploaded, _, failed = upload_files(pc, uploads, index, str(tmp_path / 'uploads'), chunk_threshold=1,
+                                       chunk_size=256)
+    assert (uploaded, [u['path'] for u in failed]) == (1, ['/upload/a.bin'])
+    assert fake.tree.content(remote_file(fake, '/upload/b.bin')['fileid']) == b'b' * 1000
+
+
+def test_chunked_upload_resumes(fake, pc, tmp_path, monkeypatch):
+    chunk_size = 64 * 1024
+    data = os.urandom(5 * chunk_size - 1000)
+    ffn = tmp_path / 'large.bin'
+    ffn.write_bytes(data)
+    state_dir = str(tmp_path / 'uploads')
+    index = RemoteIndex(pc.get_contents())
+    upload = dict(ffn=str(ffn), path='/upload/large.bin', size=len(data))
+    upload_write = pc.upload_write
+
+    def interrupted_write(uploadid, offset, chunk):
+        if offset >= 2 * chunk_size:
+            raise requests.exceptions.ConnectionError('Connection reset')
+        return upload_write(uploadid, offset, chunk)
+
+    monkeypatch.setattr(pc, 'upload_write', interrupted_write)
+    results = []
+    uploaded, _, failed = upload_files(pc, [dict(upload)], index, state_dir, chunk_threshold=1, chunk_size=chunk_size,
+                                       callback=lambda u, ok: results.append(ok))
+    assert (uploaded, len(failed), results) == (0, 1, [False])
+    assert len(os.listdir(state_dir)) == 1
+    assert remote_file(fake, '/upload/large.bin') is None
+
+    monkeypatch.setattr(pc, 'upload_write', upload_write)
+    fake.server.calls.clear()
+    uploaded, uploaded_bytes, failed = upload_files(pc, [dict(upload)], index, state_dir, chunk_threshold=1,
+                                                    chunk_size=chunk_size)
+    assert (uploaded, uploaded_bytes, failed) == (1, len(data), [])
+    # The session of the first run is reused, only the missing chunks are written.
+    assert 'upload_create' not in fake.server.calls
+    assert fake.server.calls['upload_write'] == 3
+    assert os.listdir(state_dir) == []
+    f = remote_file(fake, '/upload/large.bin')
+    assert fake.tree.content(f['fileid']) == data
+
+
+def test_server_side_copy(fake, pc, tmp_path):
+    source = next(f for f in fake.tree.files.values() if f['size'] > 0)
+    write_files(tmp_path / 'local', {'copy.bin': fake.tree.content(source['fileid']), 'new.bin': b'new contents'})
+    states = sync_upload(pc, '/upload', str(tmp_path / 'local'), dedupe='copy')
+    assert set(states.values()) == {DONE}
+    assert fake.server.calls['copyfile'] == 1
+    assert fake.server.calls['uploadfile'] == 1
+    copy = remote_file(fake, '/upload/copy.bin')
+    assert copy['content'] == source['content']
+    assert fake.tree.content(remote_file(fake, '/upload/new.bin')['fileid']) == b'new contents'
@@ -0,0 +1,94 @@
+"""
+This script compares the json inventory files with the sqlite store, on a synthetic inventory. It measures the time
+to store an inventory, the time to load it for a query and the latency of path and hash lookups.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Project directory is the parent of the tools directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib import pcloud_handler
+from lib.sqlstore import SqlStore
+from tools.synthetic import make_snapshot
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare json inventory files with the sqlite store."
+    )
+    parser.add_argument('-n', '--files', type=int, required=False, default=1000000,
+                        help='Number of files in the synthetic inventory.')
+    parser.add_argument('-q', '--queries', type=int, required=False, default=10000,
+                        help='Number of path lookups.')
+    parser.add_argument('--json', type=str, required=False,
+                        help='Write the results to this json file.')
+    args = parser.parse_args()
+    snapshot, t_make = timed(make_snapshot, args.files)
+    print(f"Synthetic inventory with {args.files} files created in {t_make:.1f} s")
+    results = dict(files=args.files)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ffn = os.path.join(tmpdir, 'pcloud.json')
+
+        def store_json():
+            with open(ffn, 'w') as fh:
+                json.dump(snapshot, fh)
+
+        def load_json():
+            pc_tree = {}
+            with open(ffn, 'r') as fh:
+                pc_contents = json.load(fh)
+            pcloud_handler.item2key(pc_tree, pc_contents['path'], pc_contents['contents'])
+            return pc_tree
+
+        _, results['json_store_s'] = timed(store_json)
+        pc_tree, results['json_load_s'] = timed(load_json)
+        results['json_bytes'] = os.path.getsize(ffn)
+        keys = random.Random(2).sample(list(pc_tree), min(args.queries, len(pc_tree)))
+        paths = [str(k) for k in keys]
+        start = time.perf_counter()
+        for key in keys:
+            pc_tree[key]
+        results['json_lookup_us'] = (time.perf_counter() - start) / len(paths) * 1e6
+        # A query on json files has to load the file first.
+        results['json_first_query_s'] = results['json_load_s']
+
+        db = os.path.join(tmpdir, 'pcloud.db')
+        store = SqlStore(db)
+        obs_id, results['sqlite_store_s'] = timed(store.ingest, snapshot, '2020-01-01 00:00:00')
+        results['sqlite_bytes'] = sum(os.path.getsize(f) for f in (db, f"{db}-wal") if os.path.exists(f))
+        store.close()
+        start = time.perf_counter()
+        store = SqlStore(db)
+        store.get_item(obs_id, paths[0])
+        results['sqlite_first_query_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in paths:
+            store.get_item(obs_id, path)
+        results['sqlite_lookup_us'] = (time.perf_counter() - start) / len(paths) * 1e6
+        hashes = [store.get_item(obs_id, path)['hash'] for path in paths[:1000]]
+        start = time.perf_counter()
+        for pc_hash in hashes:
+            store.find_hash(pc_hash, obs_id)
+        results['sqlite_hash_lookup_us'] = (time.perf_counter() - start) / len(hashes) * 1e6
+        store.close()
+    for k, v in results.items():
+        print(f"{k:<25} {v:,.3f}" if isinstance(v, float) else f"{k:<25} {v:,}")
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
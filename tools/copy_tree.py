@@ -0,0 +1,90 @@
+"""
+This script copies a PCloud folder tree to another location on PCloud. The source tree is read from an inventory file,
+this can be an older inventory to restore a tree that has been reorganized or removed since. Every file that is still
+available somewhere on PCloud (same hash and size in the most recent inventory) is copied on the server, without
+transferring the file contents. Files that are no longer available are reported.
+"""
+
+from lib import my_env, pcloud_handler, profiling
+from lib.remote_dedupe import RemoteIndex, plan_copies, copy_files
+from pathlib import PurePosixPath
+import argparse
+import json
+import logging
+import os
+
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for copy to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-s', '--source_dir', type=str, required=True,
+                        help='Please provide the PCloud source directory.')
+    parser.add_argument('-t', '--target_dir', type=str, required=True,
+                        help='Please provide the PCloud target directory.')
+    parser.add_argument('-i', '--inventory', type=str, required=False,
+                        help='Inventory file with the source tree. Default: most recent inventory.')
+    parser.add_argument('-w', '--workers', type=int, required=False, default=8,
+                        help='Number of concurrent copy calls.')
+    parser.add_argument('-a', '--action', type=str, required=False, default='view', choices=['view', 'run'],
+                        help='Please provide the action: view the copy plan or run the copies')
+
+
+def main(args):
+    """
+    This function shows the copy plan and runs the copies for action run.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    logging.info("Arguments: {a}".format(a=args))
+    fp = os.getenv('DATADIR')
+    inventory_files = my_env.get_inventory_files(fp)
+    with profiling.phase('load snapshot'):
+        with open(os.path.join(fp, inventory_files[0]), 'r') as fh:
+            pc_current = json.load(fh)
+        if args.inventory:
+            with open(args.inventory, 'r') as fh:
+                pc_source = json.load(fh)
+        else:
+            pc_source = pc_current
+    source_tree = {}
+    with profiling.phase('flatten'):
+        pcloud_handler.item2key(source_tree, pc_source['path'], pc_source['contents'])
+        index = RemoteIndex(pc_current)
+    source_root = PurePosixPath(args.source_dir)
+    target_root = PurePosixPath(args.target_dir)
+    wanted = []
+    for fn, item in source_tree.items():
+        if item['isfolder'] or not PurePosixPath(fn).is_relative_to(source_root):
+            continue
+        target = target_root.joinpath(PurePosixPath(fn).relative_to(source_root))
+        wanted.append(dict(path=str(target), size=item['size'], hash=item['hash']))
+    copies, missing = plan_copies(wanted, index)
+    print(f"{len(copies)} files ({sum(c['size'] for c in copies)} bytes) can be copied on PCloud.")
+    print(f"{len(missing)} files ({sum(m['size'] for m in missing)} bytes) are no longer available on PCloud.")
+    for item in missing:
+        print(f"Not available: {item['path']}")
+    if args.action == 'run':
+        pc = pcloud_handler.get_handler()
+        with profiling.phase('transfer'):
+            copied, saved, failed = copy_files(pc, copies, index, workers=args.workers)
+        msg = f"{copied} files copied on PCloud, {saved} bytes not transferred, {len(failed)} copies failed."
+        logging.info(msg)
+        print(msg)
+        pc.logout()
+
+
+if __name__ == "__main__":
+    # Configure command line arguments
+    parser = argparse.ArgumentParser(
+        description="Copy PCloud folder tree on the server."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
+
@@ -0,0 +1,567 @@
+"""
+This script runs a local stand-in for the PCloud API, over a synthetic tree (see synthetic.py). It implements the calls
+that PcloudHandler uses: userinfo, listfolder, getfilelink, checksumfile, copyfile, createfolderifnotexists, diff
+(with long poll), uploadfile, upload_create, upload_write, upload_info, upload_save and logout. File contents are
+served with Range support. Contents of synthetic files are generated from the file ID, uploaded contents are kept in
+memory.
+Latency, bandwidth, errors and auth token expiry can be configured, so throughput and resilience can be measured
+without a PCloud account. Changes can be made with the _admin calls (create, modify, delete) to test the diff call.
+Point PCHome to the server, e.g. PCHome=http://127.0.0.1:8765/
+The FakePcloud class can be used in benchmarks, it runs the server in a thread.
+"""
+
+import argparse
+import email.parser
+import email.utils
+import hashlib
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Project directory is the parent of the tools directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.synthetic import make_snapshot
+
+
+def pc_date(ts=None):
+    """
+    Return a date in the PCloud format, e.g. 'Sat, 24 Oct 2020 16:14:43 +0000'.
+    """
+    return email.utils.formatdate(ts, usegmt=True).replace('GMT', '+0000')
+
+
+class FakeTree:
+    """
+    This class holds the folders and files of the fake account. Every change is recorded as a diff event.
+    """
+
+    def __init__(self, snapshot):
+        """
+        Load the folders and files from a snapshot (listfolder format).
+
+        :param snapshot: Root folder with contents.
+        """
+        self.lock = threading.Condition()
+        self.folders = {}
+        self.files = {}
+        self.data = {}
+        self.checksums = {}
+        self.events = []
+        self.diffid = 1
+        self.next_id = 1
+        stack = [(snapshot, None)]
+        while stack:
+            item, parentfolderid = stack.pop()
+            if item['isfolder']:
+                folderid = item['folderid']
+                self.folders[folderid] = dict(name=item['name'], folderid=folderid, parentfolderid=parentfolderid,
+                                              created=item['created'], modified=item['modified'], children=[])
+                if parentfolderid is not None:
+                    self.folders[parentfolderid]['children'].append(('d', folderid))
+                # Reversed, so the children keep their order.
+                for child in reversed(item['contents']):
+                    stack.append((child, folderid))
+                self.next_id = max(self.next_id, folderid + 1)
+            else:
+                fileid = item['fileid']
+                self.files[fileid] = dict(name=item['name'], fileid=fileid, parentfolderid=parentfolderid,
+                                          created=item['created'], modified=item['modified'], size=item['size'],
+                                          hash=item['hash'], contenttype=item.get('contenttype'), content=fileid)
+                self.folders[parentfolderid]['children'].append(('f', fileid))
+                self.next_id = max(self.next_id, fileid + 1)
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def folder_path(self, folderid):
+        parts = []
+        while folderid:
+            folder = self.folders[folderid]
+            parts.append(folder['name'])
+            folderid = folder['parentfolderid']
+        return '/' + '/'.join(reversed(parts))
+
+    def find_folder(self, path):
+        folderid = 0
+        for name in [part for part in path.split('/') if part]:
+            for kind, child_id in self.folders[folderid]['children']:
+                if kind == 'd' and self.folders[child_id]['name'] == name:
+                    folderid = child_id
+                    break
+            else:
+                return None
+        return folderid
+
+    def find_file(self, folderid, name):
+        for kind, child_id in self.folders[folderid]['children']:
+            if kind == 'f' and self.files[child_id]['name'] == name:
+                return child_id
+        return None
+
+    def metadata(self, kind, item_id, recursive=False):
+        """
+        Return the metadata of a folder or file, with the contents of folders if recursive.
+        """
+        if kind == 'f':
+            f = self.files[item_id]
+            return dict(name=f['name'], isfolder=False, fileid=f['fileid'], id=f"f{f['fileid']}",
+                        parentfolderid=f['parentfolderid'], created=f['created'], modified=f['modified'],
+                        size=f['size'], hash=f['hash'], contenttype=f['contenttype'])
+        d = self.folders[item_id]
+        res = dict(name=d['name'], isfolder=True, folderid=d['folderid'], id=f"d{d['folderid']}",
+                   parentfolderid=d['parentfolderid'], created=d['created'], modified=d['modified'])
+        if recursive is not None:
+            res['contents'] = [self.metadata(k, i, recursive if recursive else None) for k, i in d['children']]
+        return res
+
+    def content_size(self, fileid):
+        return self.files[fileid]['size']
+
+    def content(self, fileid, start=0, end=None):
+        """
+        Return (part of) the contents of a file. Synthetic contents repeat a 20 byte pattern derived from the ID.
+        """
+        key = self.files[fileid]['content']
+        end = self.files[fileid]['size'] if end is None else end
+        if key in self.data:
+            return bytes(self.data[key][start:end])
+        pattern = hashlib.sha1(str(key).encode()).digest()
+        repeat = pattern * ((end - start) // len(pattern) + 2)
+        offset = start % len(pattern)
+        return repeat[offset:offset + end - start]
+
+    def checksum(self, fileid):
+        key = self.files[fileid]['content']
+        if key not in self.checksums:
+            data = self.content(fileid)
+            self.checksums[key] = (hashlib.sha1(data).hexdigest(), hashlib.sha256(data).hexdigest())
+        return self.checksums[key]
+
+    def event(self, name, kind, item_id):
+        """
+        Record a diff event and wake up the waiting diff calls. The caller holds the lock.
+        """
+        self.diffid += 1
+        self.events.append(dict(event=name, time=pc_date(), diffid=self.diffid,
+                                metadata=self.metadata(kind, item_id, recursive=None)))
+        self.lock.notify_all()
+
+    def add_file(self, folderid, name, size, content, mtime=None):
+        """
+        Add or replace a file. The caller holds the lock.
+        """
+        existing = self.find_file(folderid, name)
+        now = pc_date()
+        modified = pc_date(mtime) if mtime else now
+        pc_hash = int.from_bytes(hashlib.sha1(f"{content}:{size}".encode()).digest()[:8], 'big') >> 1
+        if existing:
+            self.files[existing].update(size=size, hash=pc_hash, modified=modified, content=content)
+            self.event('modifyfile', 'f', existing)
+            return existing
+        fileid = self.new_id()
+        self.files[fileid] = dict(name=name, fileid=fileid, parentfolderid=folderid, created=now, modified=modified,
+                                  size=size, hash=pc_hash, contenttype='application/octet-stream', content=content)
+        self.folders[folderid]['children'].append(('f', fileid))
+        self.event('createfile', 'f', fileid)
+        return fileid
+
+    def delete_file(self, fileid):
+        """
+        Delete a file. The caller holds the lock.
+        """
+        self.event('deletefile', 'f', fileid)
+        f = self.files.pop(fileid)
+        self.folders[f['parentfolderid']]['children'].remove(('f', fileid))
+
+    def create_folder(self, path):
+        """
+        Create a folder if it does not exist. The caller holds the lock.
+
+        :return: folderid, or None if the parent folder does not exist.
+        """
+        folderid = self.find_folder(path)
+        if folderid is not None:
+            return folderid
+        parent, name = path.rstrip('/').rsplit('/', 1)
+        parentid = self.find_folder(parent or '/')
+        if parentid is None:
+            return None
+        folderid = self.new_id()
+        now = pc_date()
+        self.folders[folderid] = dict(name=name, folderid=folderid, parentfolderid=parentid, created=now,
+                                      modified=now, children=[])
+        self.folders[parentid]['children'].append(('d', folderid))
+        self.event('createfolder', 'd', folderid)
+        return folderid
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    This class handles the HTTP requests. The server has the tree and the configuration.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, with Nagle every response waits for the delayed ACK of the client.
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def send_json(self, res, status=200):
+        body = json.dumps(res).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_throttled(self, data):
+        """
+        Send data at the configured bandwidth.
+        """
+        chunk = 64 * 1024
+        for pos in range(0, len(data), chunk):
+            self.wfile.write(data[pos:pos + chunk])
+            if self.server.bandwidth:
+                time.sleep(min(chunk, len(data) - pos) / self.server.bandwidth)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        if self.server.bandwidth:
+            time.sleep(length / self.server.bandwidth)
+        return data
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        method = url.path.strip('/')
+        server = self.server
+        server.count(method)
+        if method.startswith('_content/'):
+            return self.serve_content(method)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.rnd.random() < server.error_rate:
+            self.read_body()
+            return self.send_json(dict(result=5000, error='Internal error. Try again later.'), status=500)
+        if method == 'userinfo' and 'username' in params:
+            return self.send_json(self.userinfo(params))
+        if method.startswith('_admin/'):
+            return self.send_json(self.admin(method[len('_admin/'):], params))
+        if not server.valid_auth(params.get('auth')):
+            self.read_body()
+            return self.send_json(dict(result=1000, error='Log in required.'))
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            self.read_body()
+            return self.send_json(dict(result=2000, error=f"Unknown method {method}."))
+        self.send_json(handler(params))
+
+    def userinfo(self, params):
+        server = self.server
+        if server.password and params.get('password') != server.password:
+            return dict(result=2000, error='Log in failed.')
+        auth = secrets.token_hex(16)
+        with server.tree.lock:
+            server.tokens[auth] = time.time()
+        return dict(result=0, auth=auth, usedquota=sum(f['size'] for f in server.tree.files.values()),
+                    quota=10 ** 13, email=params['username'])
+
+    def serve_content(self, method):
+        tree = self.server.tree
+        try:
+            fileid = int(method.split('/')[1])
+            size = tree.content_size(fileid)
+        except (ValueError, KeyError):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, size
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            first, _, last = range_header[6:].partition('-')
+            if first:
+                start = int(first)
+                end = min(int(last) + 1, size) if last else size
+            else:
+                start = max(size - int(last), 0)
+            status = 206
+        data = tree.content(fileid, start, end)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{size}")
+        self.end_headers()
+        self.send_throttled(data)
+
+    def api_logout(self, params):
+        with self.server.tree.lock:
+            deleted = self.server.tokens.pop(params.get('auth'), None) is not None
+        return dict(result=0, auth_deleted=deleted)
+
+    def api_userinfo(self, params):
+        tree = self.server.tree
+        return dict(result=0, usedquota=sum(f['size'] for f in tree.files.values()), quota=10 ** 13)
+
+    def api_listfolder(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            folderid = int(params['folderid']) if 'folderid' in params else tree.find_folder(params.get('path', '/'))
+            if folderid not in tree.folders:
+                return dict(result=2005, error='Directory does not exist.')
+            metadata = tree.metadata('d', folderid, recursive=bool(int(params.get('recursive', 0))))
+            metadata['path'] = tree.folder_path(folderid)
+        return dict(result=0, metadata=metadata)
+
+    def api_getfilelink(self, params):
+        tree = self.server.tree
+        fileid = int(params['fileid'])
+        if fileid not in tree.files:
+            return dict(result=2009, error='File not found.')
+        host = f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        return dict(result=0, hosts=[host], path=f"/_content/{fileid}/{tree.files[fileid]['name']}",
+                    expires=pc_date(time.time() + 3600), size=tree.files[fileid]['size'])
+
+    def api_checksumfile(self, params):
+        tree = self.server.tree
+        fileid = int(params['fileid'])
+        if fileid not in tree.files:
+            return dict(result=2009, error='File not found.')
+        sha1, sha256 = tree.checksum(fileid)
+        return dict(result=0, sha1=sha1, sha256=sha256, metadata=tree.metadata('f', fileid))
+
+    def api_copyfile(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            fileid = int(params['fileid'])
+            tofolderid = int(params['tofolderid'])
+            if fileid not in tree.files or tofolderid not in tree.folders:
+                return dict(result=2009, error='File not found.')
+            src = tree.files[fileid]
+            new_id = tree.add_file(tofolderid, params.get('toname', src['name']), src['size'], src['content'])
+            return dict(result=0, metadata=tree.metadata('f', new_id))
+
+    def api_createfolderifnotexists(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            folderid = tree.create_folder(params['path'])
+            if folderid is None:
+                return dict(result=2002, error='A component of parent directory does not exist.')
+            return dict(result=0, metadata=tree.metadata('d', folderid, recursive=None))
+
+    def api_diff(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            if 'diffid' not in params:
+                return dict(result=0, diffid=tree.diffid, entries=[])
+            diffid = int(params['diffid'])
+            if int(params.get('block', 0)):
+                tree.lock.wait_for(lambda: tree.diffid > diffid, timeout=self.server.poll_timeout)
+            entries = [e for e in tree.events if e['diffid'] > diffid]
+            return dict(result=0, diffid=tree.diffid, entries=entries)
+
+    def api_uploadfile(self, params):
+        body = self.read_body()
+        msg = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        tree = self.server.tree
+        metadata = []
+        with tree.lock:
+            folderid = int(params['folderid'])
+            if folderid not in tree.folders:
+                return dict(result=2005, error='Directory does not exist.')
+            for part in msg.get_payload():
+                data = part.get_payload(decode=True)
+                key = f"u{tree.new_id()}"
+                tree.data[key] = data
+                fileid = tree.add_file(folderid, part.get_filename(), len(data), key,
+                                       mtime=int(params['mtime']) if 'mtime' in params else None)
+                metadata.append(tree.metadata('f', fileid))
+        return dict(result=0, fileids=[m['fileid'] for m in metadata], metadata=metadata)
+
+    def api_upload_create(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            uploadid = tree.new_id()
+            self.server.uploads[uploadid] = bytearray()
+        return dict(result=0, uploadid=uploadid)
+
+    def api_upload_info(self, params):
+        upload = self.server.uploads.get(int(params['uploadid']))
+        if upload is None:
+            return dict(result=1900, error='Invalid upload ID.')
+        return dict(result=0, size=len(upload))
+
+    def api_upload_write(self, params):
+        data = self.read_body()
+        upload = self.server.uploads.get(int(params['uploadid']))
+        if upload is None:
+            return dict(result=1900, error='Invalid upload ID.')
+        offset = int(params.get('uploadoffset', len(upload)))
+        with self.server.tree.lock:
+            if len(upload) < offset + len(data):
+                upload.extend(b'\0' * (offset + len(data) - len(upload)))
+            upload[offset:offset + len(data)] = data
+        return dict(result=0)
+
+    def api_upload_save(self, params):
+        tree = self.server.tree
+        with tree.lock:
+            upload = self.server.uploads.pop(int(params['uploadid']), None)
+            folderid = int(params['folderid'])
+            if upload is None:
+                return dict(result=1900, error='Invalid upload ID.')
+            key = f"u{tree.new_id()}"
+            tree.data[key] = bytes(upload)
+            fileid = tree.add_file(folderid, params['name'], len(upload), key,
+                                   mtime=int(params['mtime']) if 'mtime' in params else None)
+            return dict(result=0, metadata=tree.metadata('f', fileid))
+
+    def admin(self, action, params):
+        """
+        Change the tree as another PCloud client would, for the diff call.
+        create: path and size, modify: fileid and size, delete: fileid.
+        """
+        tree = self.server.tree
+        with tree.lock:
+            if action == 'create':
+                parent, name = params['path'].rsplit('/', 1)
+                folderid = tree.create_folder(parent or '/')
+                fileid = tree.add_file(folderid, name, int(params.get('size', 1000)), f"a{tree.new_id()}")
+                return dict(result=0, metadata=tree.metadata('f', fileid))
+            if action == 'modify':
+                f = tree.files[int(params['fileid'])]
+                fileid = tree.add_file(f['parentfolderid'], f['name'], int(params.get('size', f['size'])),
+                                       f"a{tree.new_id()}")
+                return dict(result=0, metadata=tree.metadata('f', fileid))
+            if action == 'delete':
+                tree.delete_file(int(params['fileid']))
+                return dict(result=0)
+        return dict(result=2000, error=f"Unknown admin action {action}.")
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    This class is the HTTP server with the fake account and the configuration.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, tree, latency=0.0, bandwidth=0, error_rate=0.0, auth_ttl=0, password=None,
+                 poll_timeout=30, seed=1, verbose=False):
+        super().__init__(address, FakeHandler)
+        self.tree = tree
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.auth_ttl = auth_ttl
+        self.password = password
+        self.poll_timeout = poll_timeout
+        self.rnd = random.Random(seed)
+        self.verbose = verbose
+        self.tokens = {}
+        self.uploads = {}
+        self.calls = {}
+
+    def valid_auth(self, auth):
+        created = self.tokens.get(auth)
+        if created is None:
+            return False
+        return not self.auth_ttl or time.time() - created < self.auth_ttl
+
+    def count(self, method):
+        key = '_content' if method.startswith('_content/') else method
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+
+class FakePcloud:
+    """
+    This class runs the fake server in a background thread.
+    """
+
+    def __init__(self, snapshot=None, files=1000, port=0, **kwargs):
+        """
+        Create the server.
+
+        :param snapshot: Inventory for the fake account, default a synthetic inventory with files files.
+        :param files: Number of files of the synthetic inventory.
+        :param port: TCP port, 0 for a free port.
+        :param kwargs: Server configuration: latency, bandwidth, error_rate, auth_ttl, password, poll_timeout.
+        """
+        self.tree = FakeTree(snapshot or make_snapshot(files))
+        self.server = FakeServer(('127.0.0.1', port), self.tree, **kwargs)
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a local fake PCloud API server over a synthetic tree."
+    )
+    parser.add_argument('-p', '--port', type=int, required=False, default=8765,
+                        help='TCP port.')
+    parser.add_argument('-n', '--files', type=int, required=False, default=10000,
+                        help='Number of files in the synthetic tree.')
+    parser.add_argument('-i', '--inventory', type=str, required=False,
+                        help='Inventory json file to serve instead of a synthetic tree.')
+    parser.add_argument('-l', '--latency', type=float, required=False, default=0,
+                        help='Seconds of latency added to every API call.')
+    parser.add_argument('-b', '--bandwidth', type=int, required=False, default=0,
+                        help='Bandwidth for downloads and uploads in bytes per second, 0 for no limit.')
+    parser.add_argument('-e', '--error_rate', type=float, required=False, default=0,
+                        help='Fraction of API calls that fail with HTTP status 500.')
+    parser.add_argument('-a', '--auth_ttl', type=int, required=False, default=0,
+                        help='Seconds after which an auth token is rejected, 0 for no expiry.')
+    parser.add_argument('--password', type=str, required=False,
+                        help='Password for the login, default any password is accepted.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log every request.')
+    args = parser.parse_args()
+    snapshot = None
+    if args.inventory:
+        with open(args.inventory, 'r') as fh:
+            snapshot = json.load(fh)
+    fake = FakePcloud(snapshot, files=args.files, port=args.port, latency=args.latency, bandwidth=args.bandwidth,
+                      error_rate=args.error_rate, auth_ttl=args.auth_ttl, password=args.password,
+                      verbose=args.verbose)
+    print(f"Fake PCloud with {len(fake.tree.files)} files on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
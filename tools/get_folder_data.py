@@ -3,23 +3,45 @@ This script collects info about a folder. It reads the folder ID from command li
 information.
 """
 
-from lib import my_env, pcloud_handler
+from lib import my_env, pcloud_handler, profiling
 import argparse
 import pprint
 
-# Configure command line arguments
-parser = argparse.ArgumentParser(
-    description="Get folder information."
-)
-parser.add_argument('-i', '--folderid', type=str, required=True,
-                    help='Please provide the folder ID.')
-args = parser.parse_args()
-cfg = my_env.init_env("pcloud", __file__)
-pc = pcloud_handler.PcloudHandler()
-res = pc.listfolder(args.folderid)
-pp = pprint.PrettyPrinter(indent=4)
-pp.pprint(res)
-files = res["metadata"]["contents"]
-for file in files:
-    for k, v in file.items():
-        print("{}: {}".format(k, v))
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for folder to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    parser.add_argument('-i', '--folderid', type=str, required=True,
+                        help='Please provide the folder ID.')
+
+
+def main(args):
+    """
+    This function prints the folder information.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    pc = pcloud_handler.get_handler()
+    res = pc.listfolder(args.folderid)
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(res)
+    files = res["metadata"]["contents"]
+    for file in files:
+        for k, v in file.items():
+            print("{}: {}".format(k, v))
+
+
+if __name__ == "__main__":
+    # Configure command line arguments
+    parser = argparse.ArgumentParser(
+        description="Get folder information."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
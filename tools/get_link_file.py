@@ -1,24 +1,64 @@
 """
-This script gets a link to a file with file ID. This link then can  be used to download the file.
+This script gets a link to a file with file ID or with the PCloud path of the file. This link then can  be used to
+download the file. A path is looked up in the path index of the most recent inventory.
 """
 
-from lib import my_env, pcloud_handler
+from lib import my_env, pcloud_handler, profiling
 import argparse
+import logging
 import os
 
-# Configure command line arguments
-parser = argparse.ArgumentParser(
-    description="Get File Link."
-)
-parser.add_argument('-f', '--fileid', type=str, required=True,
-                    help='Please provide the file ID.')
-args = parser.parse_args()
-cfg = my_env.init_env("pcloud", __file__)
-pc = pcloud_handler.PcloudHandler()
-
-url = pc.get_filelink(args.fileid)
-print(url)
-path = '/home/dirk/temp/pcloudtest/p2/p3'
-target = 'MondovinoLes106.odt'
-target_ffn = os.path.join(path, target)
-pcloud_handler.get_file(url, target_ffn)
+
+def add_arguments(parser):
+    """
+    This function adds the command line arguments for link to the parser.
+
+    :param parser: argparse parser.
+    :return:
+    """
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-f', '--fileid', type=str,
+                       help='Please provide the file ID.')
+    group.add_argument('-p', '--path', type=str,
+                       help='Please provide the PCloud path of the file.')
+    parser.add_argument('-o', '--output', type=str, required=False,
+                        help='Download the file to this filename. Default: only print the link.')
+
+
+def main(args):
+    """
+    This function prints the link to the file and downloads the file if an output filename is given.
+
+    :param args: Parsed command line arguments.
+    :return:
+    """
+    cfg = my_env.init_env("pcloud", __file__)
+    fileid = args.fileid
+    if args.path:
+        from lib.path_index import open_index
+        fp = os.getenv('DATADIR')
+        with open_index(fp, my_env.get_inventory_files(fp)[0]) as index:
+            item = index.lookup(args.path)
+        if not item or item['isfolder']:
+            raise SystemExit(f"File {args.path} not found in the most recent inventory.")
+        fileid = item['fileid']
+    pc = pcloud_handler.get_handler()
+    url = pc.get_filelink(fileid)
+    print(url)
+    if args.output:
+        try:
+            pcloud_handler.get_file(url, args.output)
+        except OSError as e:
+            msg = f"Download of file {fileid} failed: {e}"
+            logging.critical(msg)
+            raise SystemExit(msg)
+
+
+if __name__ == "__main__":
+    # Configure command line arguments
+    parser = argparse.ArgumentParser(
+        description="Get File Link."
+    )
+    add_arguments(parser)
+    profiling.add_argument(parser)
+    profiling.run(main, parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+This script measures the import time of the pcloud command and of each command module with python -X importtime.
+Every measurement runs in a new interpreter, so modules are not cached. Use the budget option to get a non-zero exit
+code when a command takes longer to import than expected, for example after adding a top level import.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Project directory is the parent of the tools directory.
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+from pcloud import COMMANDS
+
+
+def measure(module_name, runs=3):
+    """
+    This function imports a module in a new interpreter with -X importtime and collects the import times.
+    The best of runs measurements is kept, to limit the impact of a busy system.
+
+    :param module_name: Module to import.
+    :param runs: Number of measurements.
+    :return: Dictionary with total (microseconds) and modules: list of (module, self us, cumulative us).
+    """
+    best = None
+    for _ in range(runs):
+        cmd = [sys.executable, '-X', 'importtime', '-c', f'import {module_name}']
+        res = subprocess.run(cmd, cwd=PROJECT_DIR, capture_output=True, text=True)
+        if res.returncode != 0:
+            raise SystemExit(f"Import of {module_name} failed:\n{res.stderr}")
+        modules = []
+        for line in res.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(self_us), int(cumulative_us)))
+        total = sum(self_us for _, self_us, _ in modules)
+        if best is None or total < best['total']:
+            best = dict(total=total, modules=modules)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of the pcloud commands."
+    )
+    parser.add_argument('-b', '--budget', type=float, required=False,
+                        help='Maximum import time in milliseconds for the pcloud command and each command module.')
+    parser.add_argument('-n', '--top', type=int, required=False, default=5,
+                        help='Number of slowest modules to show per command.')
+    parser.add_argument('--json', type=str, required=False,
+                        help='Write the results to this json file.')
+    args = parser.parse_args()
+    targets = dict(pcloud="pcloud")
+    targets.update((name, module_name) for name, (module_name, _) in COMMANDS.items())
+    results = {}
+    over_budget = []
+    for name, module_name in targets.items():
+        res = measure(module_name)
+        total_ms = res['total'] / 1000
+        results[name] = dict(module=module_name, total_ms=total_ms,
+                             modules=[dict(module=m, self_us=s, cumulative_us=c) for m, s, c in res['modules']])
+        print(f"{name:<10} {module_name:<25} {total_ms:8.1f} ms")
+        for m, s, c in sorted(res['modules'], key=lambda x: x[1], reverse=True)[:args.top]:
+            print(f"    {m:<40} {s / 1000:8.1f} ms self, {c / 1000:8.1f} ms cumulative")
+        if args.budget and total_ms > args.budget:
+            over_budget.append(name)
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(dict(budget_ms=args.budget, results=results), fh, indent=2)
+    if over_budget:
+        print(f"Import time over budget ({args.budget} ms): {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+This module creates synthetic PCloud inventories, in the format of listfolder with recursive flag. The inventories are
+used to measure the scripts on large trees without a PCloud account.
+Local directory trees in the same shape are created with sparse files, so large trees do not use disk space.
+"""
+
+import copy
+import email.utils
+import math
+import os
+import random
+from pathlib import PurePosixPath
+
+SIZE_DISTRIBUTIONS = ('uniform', 'lognormal')
+
+
+def make_snapshot(n_files, files_per_folder=100, folders_per_folder=10, seed=1, max_depth=None, sizes='uniform',
+                  max_size=10000000):
+    """
+    This function creates an inventory with n_files files. Folders have files_per_folder files and up to
+    folders_per_folder subfolders, the tree is filled breadth first. The same seed gives the same inventory.
+    With max_depth the folders on that depth get no subfolders. When all folders have been filled, the folders on the
+    deepest level get another batch of files.
+
+    :param n_files: Number of files.
+    :param files_per_folder: Number of files per folder.
+    :param folders_per_folder: Number of subfolders per folder.
+    :param seed: Seed for sizes, hashes and dates.
+    :param max_depth: Maximum folder depth below the root, None for no limit.
+    :param sizes: File size distribution: uniform (1 byte to max_size) or lognormal (median 64 kB, long tail up to
+    max_size), which is closer to a real account with many small files and few large files.
+    :param max_size: Maximum file size.
+    :return: Inventory dictionary (root folder with contents).
+    """
+    rnd = random.Random(seed)
+    base_ts = 1600000000
+    next_id = [1]
+
+    def pc_date():
+        return email.utils.formatdate(base_ts + rnd.randrange(100000000), usegmt=True).replace('GMT', '+0000')
+
+    def folder(name):
+        folder_id = next_id[0]
+        next_id[0] += 1
+        return dict(name=name, isfolder=True, folderid=folder_id, id=f"d{folder_id}", created=pc_date(),
+                    modified=pc_date(), contents=[])
+
+    def file_size():
+        if sizes == 'lognormal':
+            return min(int(rnd.lognormvariate(math.log(65536), 2)) + 1, max_size)
+        return rnd.randrange(1, max_size)
+
+    root = folder('/')
+    root.update(path='/', folderid=0, id='d0')
+    queue = [(root, 0)]
+    leaves = []
+    files = 0
+    folder_cnt = 0
+    while files < n_files:
+        if not queue:
+            queue = [(leaf, None) for leaf in leaves]
+        parent, depth = queue.pop(0)
+        for _ in range(min(files_per_folder, n_files - files)):
+            file_id = next_id[0]
+            next_id[0] += 1
+            parent['contents'].append(dict(name=f"file{file_id}.dat", isfolder=False, fileid=file_id, id=f"f{file_id}",
+                                           size=file_size(), hash=rnd.getrandbits(63),
+                                           contenttype='application/octet-stream', created=pc_date(),
+                                           modified=pc_date()))
+            files += 1
+        if depth is None:
+            # Another batch of files for a folder on the deepest level.
+            continue
+        if max_depth is not None and depth >= max_depth:
+            leaves.append(parent)
+            continue
+        for _ in range(folders_per_folder):
+            folder_cnt += 1
+            sub = folder(f"folder{folder_cnt}")
+            parent['contents'].append(sub)
+            queue.append((sub, depth + 1))
+    return root
+
+
+def mutate_snapshot(snapshot, fraction=0.01, seed=2):
+    """
+    This function returns a copy of an inventory with changes: a fraction of the files is modified, a fraction is
+    removed and the same number of new files is added. Use it as the next inventory in a diff.
+
+    :param snapshot: Inventory dictionary.
+    :param fraction: Fraction of the files for each kind of change.
+    :param seed: Seed for the selection of the files.
+    :return: Changed copy of the inventory.
+    """
+    rnd = random.Random(seed)
+    current = copy.deepcopy(snapshot)
+    folders = []
+    stack = [current]
+    while stack:
+        item = stack.pop()
+        # Subtree digests of the copy are not valid anymore.
+        item.pop('digest', None)
+        folders.append(item)
+        stack.extend(child for child in item['contents'] if child['isfolder'])
+    next_id = 1 + max(child.get('fileid', 0) for item in folders for child in item['contents'])
+    for item in folders:
+        kept = []
+        for child in item['contents']:
+            if child['isfolder']:
+                kept.append(child)
+                continue
+            draw = rnd.random()
+            if draw < fraction:
+                # Removed, a new file is added instead.
+                kept.append(dict(child, name=f"file{next_id}.dat", fileid=next_id, id=f"f{next_id}",
+                                 hash=rnd.getrandbits(63)))
+                next_id += 1
+            elif draw < 2 * fraction:
+                kept.append(dict(child, size=child['size'] + 1, hash=rnd.getrandbits(63)))
+            else:
+                kept.append(child)
+        item['contents'] = kept
+    return current
+
+
+def make_local_tree(snapshot, local_path, source_dir='/'):
+    """
+    This function creates a local directory tree with the folders and files of an inventory subtree, as a sync
+    would create it. Files are sparse: they have the size of the PCloud file but use no disk space. The modification
+    time is the PCloud modification time.
+
+    :param snapshot: Inventory dictionary.
+    :param local_path: Local directory for the PCloud source_dir.
+    :param source_dir: PCloud directory to create locally.
+    :return: Number of files created.
+    """
+    from lib.pcloud_handler import parse_date
+    node = snapshot
+    for name in PurePosixPath(source_dir).parts[1:]:
+        node = next(item for item in node['contents'] if item['isfolder'] and item['name'] == name)
+    os.makedirs(local_path, exist_ok=True)
+    files = 0
+    stack = [(local_path, node['contents'])]
+    while stack:
+        path, contents = stack.pop()
+        for item in contents:
+            local_fn = os.path.join(path, item['name'])
+            if item['isfolder']:
+                os.makedirs(local_fn, exist_ok=True)
+                stack.append((local_fn, item['contents']))
+                continue
+            with open(local_fn, 'wb') as fh:
+                fh.truncate(item['size'])
+            mtime = parse_date(item['modified'])
+            os.utime(local_fn, (mtime, mtime))
+            files += 1
+    return files